@@ -0,0 +1,62 @@
+"""
+Микробенчмарк кодека JIM: кодирование и разбор сообщений, отправка и прием
+через сокет-заглушку в режиме сырого JSON, в режиме кадров и в бинарном формате, сжатие больших сообщений.
+
+Запуск из корня репозитория: python -m messenger.benchmarks.bench_codec
+"""
+from messenger.common.binary_codec import BINARY_FORMAT, JSON_FORMAT
+from messenger.common.compression import MessageCompression
+from messenger.common.common_functions import encode_message, decode_message, send_message, get_message
+from messenger.common.framing import FrameDecoder, pack_frame
+from messenger.common.settings import load_settings
+from messenger.benchmarks.utils import FakeSocket, measure, print_results
+
+MESSAGE = {'action': 'message', 'time': 1.1, 'from': 'client_1', 'to': 'client_2', 'mess_text': 'Привет!'}
+# Ответ на USERS_REQUEST с сотней пользователей - типичное большое сообщение
+USERS_RESPONSE = {'response': 202, 'list_info': [f'user_{number}' for number in range(100)]}
+NUMBER = 20000
+
+
+def run(scale=1.0):
+    """
+    Функция запуска замеров, возвращает словарь результатов по именам
+    """
+    number = max(1, int(NUMBER * scale))
+    raw_settings = load_settings(overrides={'framed_mode': False, 'wire_format': JSON_FORMAT})
+    binary_settings = load_settings(overrides={'wire_format': BINARY_FORMAT})
+    settings = load_settings(overrides={'wire_format': JSON_FORMAT})
+    sock = FakeSocket()
+    encoded = encode_message(MESSAGE, settings)
+    binary = encode_message(MESSAGE, binary_settings)
+    frame = pack_frame(encoded)
+    decoder = FrameDecoder()
+    large = encode_message(USERS_RESPONSE, settings)
+    sender = MessageCompression(settings.compression_threshold, settings.compression_level)
+    receiver = MessageCompression(settings.compression_threshold, settings.compression_level)
+
+    def compress_round_trip():
+        receiver.decompress(sender.compress(large))
+
+    def round_trip(current_settings):
+        send_message(sock, MESSAGE, current_settings)
+        get_message(sock, current_settings)
+
+    return {
+        'codec.encode_message': measure(lambda: encode_message(MESSAGE, settings), number),
+        'codec.decode_message': measure(lambda: decode_message(encoded, settings), number),
+        'codec.encode_binary': measure(lambda: encode_message(MESSAGE, binary_settings), number),
+        'codec.decode_binary': measure(lambda: decode_message(binary, binary_settings), number),
+        'codec.compress_round_trip_users_list': measure(compress_round_trip, number),
+        'codec.frame_decoder_feed': measure(lambda: decoder.feed(frame), number),
+        'codec.round_trip_raw': measure(lambda: round_trip(raw_settings), number),
+        'codec.round_trip_framed': measure(lambda: round_trip(settings), number),
+        'codec.round_trip_binary': measure(lambda: round_trip(binary_settings), number),
+    }
+
+
+def main():
+    print_results(run())
+
+
+if __name__ == '__main__':
+    main()
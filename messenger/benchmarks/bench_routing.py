@@ -0,0 +1,134 @@
+"""
+Микробенчмарк обработки сообщений сервером: разбор действия в
+process_client_message и доставка в process_message. Сокеты заменены
+заглушками, БД сервера находится в памяти, журнал отключен.
+
+Запуск из корня репозитория: python -m messenger.benchmarks.bench_routing
+"""
+from messenger.benchmarks.utils import FakeSocket, measure, print_results, quiet_logging
+from messenger.common.buffers import OutboundBuffer
+from messenger.common.common_functions import encode_message
+from messenger.common.framing import FrameDecoder, pack_frame
+from messenger.common.jim_variables import *
+from messenger.common.settings import load_settings
+from messenger.database.storage import ServerStorage
+from server import Server
+
+NUMBER = 5000
+# Размер группы для замера рассылки
+GROUP_SIZE = 500
+GROUP_NUMBER = 200
+
+
+def connect(server, name, port):
+    """
+    Функция регистрации клиента-заглушки на сервере в обход проверки пароля
+    """
+    sock = FakeSocket(('127.0.0.1', port))
+    connection = server.connections.add(sock, sock.address, FrameDecoder(),
+                                        OutboundBuffer(server.settings.outbound_high_watermark,
+                                                       server.settings.outbound_low_watermark,
+                                                       server.settings.outbound_limit))
+    connection.decoder.framed = True
+    server.connections.reserve(connection, name)
+    server.connections.activate(connection)
+    return sock
+
+
+def settle(server):
+    """
+    Функция ожидания запросов, поставленных в очередь потока БД, и обработки их результатов.
+    Очередь выполняется по порядку, поэтому результат последнего вызова означает готовность всех.
+    """
+    server.storage.call('directory_stats')
+    server.process_storage()
+
+
+def make_server(settings):
+    database = ServerStorage(path=':memory:', stats_flush_messages=NUMBER)
+    for name in ('alice', 'bob'):
+        database.user_login(name, '127.0.0.1', 50000, b'hash')
+    database.add_contact('alice', 'bob')
+    server = Server('', settings.default_port, database, settings)
+    return server, connect(server, 'alice', 50001), connect(server, 'bob', 50002)
+
+
+def group_fanout(settings, scale):
+    """
+    Функция замера рассылки сообщения в группу из GROUP_SIZE участников, все в сети.
+    Кроме времени одной рассылки сообщает число доставок в секунду.
+    """
+    number = max(1, int(GROUP_NUMBER * scale))
+    database = ServerStorage(path=':memory:', stats_flush_messages=NUMBER)
+    server = Server('', settings.default_port, database, settings)
+    names = [f'member_{number}' for number in range(GROUP_SIZE)]
+    for port, name in enumerate(names, start=50001):
+        database.user_login(name, '127.0.0.1', port, b'hash')
+        connect(server, name, port)
+    database.create_group('bench', names[0])
+    for name in names[1:]:
+        database.join_group('bench', name)
+    message = {ACTION: GROUP_MESSAGE, TIME: 1.1, SENDER: names[0], GROUP: 'bench', MESSAGE_TEXT: 'Привет всем!'}
+
+    def fanout():
+        server.process_group_message(message)
+        for client in list(server.pending_output):
+            server.flush_client(client)
+
+    result = measure(fanout, number)
+    result['deliveries_per_second'] = (GROUP_SIZE - 1) / result['best_us'] * 1e6
+    server.storage.close()
+    return result
+
+
+def run(scale=1.0):
+    """
+    Функция запуска замеров, возвращает словарь результатов по именам
+    """
+    quiet_logging()
+    number = max(1, int(NUMBER * scale))
+    settings = load_settings()
+    server, alice, bob = make_server(settings)
+    message = {ACTION: MESSAGE, TIME: 1.1, SENDER: 'alice', DESTINATION: 'bob', MESSAGE_TEXT: 'Привет!'}
+    frame = pack_frame(encode_message(message, settings))
+
+    def dispatch(request, client, recipient):
+        server.process_client_message(request, client)
+        server.route_messages()
+        server.flush_client(recipient)
+
+    def query(request, client):
+        # Ответ на запрос отправляется после выполнения вызова в потоке БД
+        server.process_client_message(request, client)
+        settle(server)
+        server.flush_client(client)
+
+    def deliver():
+        server.process_message(message)
+        server.flush_client(bob)
+
+    def feed():
+        server.feed_client(alice, frame)
+        server.route_messages()
+        server.flush_client(bob)
+
+    results = {
+        'routing.dispatch_message': measure(lambda: dispatch(message, alice, bob), number),
+        'routing.dispatch_get_contacts': measure(
+            lambda: query({ACTION: GET_CONTACTS, TIME: 1.1, CHAT_USER: 'alice'}, alice), number),
+        'routing.dispatch_users_request': measure(
+            lambda: query({ACTION: USERS_REQUEST, TIME: 1.1, ACCOUNT_NAME: 'alice'}, alice), number),
+        'routing.process_message': measure(deliver, number),
+        'routing.feed_client_framed': measure(feed, number),
+        f'routing.group_fanout_{GROUP_SIZE}': group_fanout(settings, scale),
+    }
+    server.storage.close()
+    return results
+
+
+def main():
+    print_results(run())
+
+
+if __name__ == '__main__':
+    main()
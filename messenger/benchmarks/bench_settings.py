@@ -0,0 +1,58 @@
+"""
+Микробенчмарк: стоимость отправки и приема одного сообщения при чтении .env
+на каждое сообщение (как было раньше) и с настройками, загруженными один раз.
+
+Запуск из корня репозитория: python -m messenger.benchmarks.bench_settings
+"""
+import json
+import os
+import timeit
+from dotenv import load_dotenv
+
+from messenger.common.common_functions import send_message, get_message
+from messenger.common.settings import ENV_PATH, load_settings
+from messenger.benchmarks.utils import FakeSocket
+
+MESSAGE = {'action': 'message', 'time': 1.1, 'from': 'client_1', 'to': 'client_2', 'mess_text': 'Привет!'}
+NUMBER = 20000
+# Прежняя реализация на порядки медленнее, для нее хватает меньшего числа повторов
+LEGACY_NUMBER = 500
+
+
+def legacy_send_message(sock, message):
+    """
+    Прежняя реализация: чтение .env и переменных окружения на каждое сообщение
+    """
+    load_dotenv(ENV_PATH)
+    sock.send(json.dumps(message).encode(os.environ.get("ENCODING")))
+
+
+def legacy_get_message(sock):
+    load_dotenv(ENV_PATH)
+    return json.loads(sock.recv(int(os.environ.get("MAX_PACKAGE_LENGTH"))).decode(os.environ.get("ENCODING")))
+
+
+def legacy_round_trip(sock):
+    legacy_send_message(sock, MESSAGE)
+    legacy_get_message(sock)
+
+
+def round_trip(sock, settings):
+    send_message(sock, MESSAGE, settings)
+    get_message(sock, settings)
+
+
+def main():
+    settings = load_settings(overrides={'framed_mode': False, 'wire_format': 'json'})
+    sock = FakeSocket()
+
+    legacy = timeit.timeit(lambda: legacy_round_trip(sock), number=LEGACY_NUMBER) / LEGACY_NUMBER
+    current = timeit.timeit(lambda: round_trip(sock, settings), number=NUMBER) / NUMBER
+
+    print(f'load_dotenv на каждое сообщение: {legacy * 1e6:.2f} мкс/сообщение')
+    print(f'Настройки загружены один раз:   {current * 1e6:.2f} мкс/сообщение')
+    print(f'Экономия: {(legacy - current) * 1e6:.2f} мкс/сообщение ({legacy / current:.0f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Микробенчмарк методов БД сервера (ServerStorage) и клиента (ClientDatabase)
+на временных файлах SQLite. Методы, изменяющие данные, замеряются парами
+(вход и выход, добавление и удаление), чтобы состояние БД не менялось между повторами.
+
+Запуск из корня репозитория: python -m messenger.benchmarks.bench_storage
+"""
+import os
+import tempfile
+
+from messenger.benchmarks.utils import measure, print_results, quiet_logging
+from messenger.database.client_database import ClientDatabase
+from messenger.database.storage import ServerStorage
+
+# Операции с фиксацией транзакции на диске на порядки дольше чтения
+WRITE_NUMBER = 200
+READ_NUMBER = 2000
+USERS = 100
+# Пачка сообщений истории клиента, записываемая одной транзакцией
+BATCH = 100
+
+
+def server_storage(directory, scale):
+    write_number = max(1, int(WRITE_NUMBER * scale))
+    read_number = max(1, int(READ_NUMBER * scale))
+    database = ServerStorage(path=os.path.join(directory, 'server.db'))
+    names = [f'user_{number}' for number in range(USERS)]
+    for name in names:
+        database.user_login(name, '127.0.0.1', 50000, b'hash')
+    for name in names[1:11]:
+        database.add_contact(names[0], name)
+
+    def login_logout():
+        database.user_logout('user_1')
+        database.user_login('user_1', '127.0.0.1', 50000, b'hash')
+
+    def add_remove_contact():
+        database.add_contact('user_0', 'user_50')
+        database.remove_contact('user_0', 'user_50')
+
+    def process_and_flush():
+        for name in names[:10]:
+            database.process_message(name, names[-1])
+        database.flush_stats()
+
+    return {
+        'server_storage.user_login_logout': measure(login_logout, write_number),
+        'server_storage.add_remove_contact': measure(add_remove_contact, write_number),
+        'server_storage.process_message': measure(lambda: database.process_message('user_0', 'user_1'),
+                                                  read_number),
+        'server_storage.flush_stats_10_users': measure(process_and_flush, write_number),
+        'server_storage.user_id': measure(lambda: database.user_id('user_42'), read_number),
+        'server_storage.get_contacts': measure(lambda: database.get_contacts('user_0'), read_number),
+        'server_storage.users_list': measure(database.users_list, read_number),
+        'server_storage.active_users_list': measure(database.active_users_list, read_number),
+        'server_storage.login_history': measure(lambda: database.login_history('user_0'), read_number),
+        'server_storage.message_history': measure(database.message_history, read_number),
+    }
+
+
+def client_database(directory, scale):
+    write_number = max(1, int(WRITE_NUMBER * scale))
+    read_number = max(1, int(READ_NUMBER * scale))
+    database = ClientDatabase('bench', path=os.path.join(directory, 'client.db3'))
+    names = [f'user_{number}' for number in range(USERS)]
+    database.add_users(names)
+    for name in names[1:11]:
+        database.add_contact(name)
+    for number in range(USERS):
+        database.save_message('user_0', names[number % 10], f'Сообщение {number}')
+
+    def add_del_contact():
+        database.add_contact('user_50')
+        database.del_contact('user_50')
+        database.session.commit()
+
+    def save_batch():
+        for number in range(BATCH):
+            database.save_message('user_0', 'user_1', 'Привет!')
+        database.flush_history()
+
+    results = {
+        'client_database.add_del_contact': measure(add_del_contact, write_number),
+        'client_database.add_users': measure(lambda: database.add_users(names), write_number),
+        'client_database.save_message': measure(lambda: database.save_message('user_0', 'user_1', 'Привет!'),
+                                                write_number),
+        f'client_database.save_message_{BATCH}_flush': measure(save_batch, write_number),
+        'client_database.get_contacts': measure(database.get_contacts, read_number),
+        'client_database.get_users': measure(database.get_users, read_number),
+        'client_database.check_user': measure(lambda: database.check_user('user_42'), read_number),
+        'client_database.check_contact': measure(lambda: database.check_contact('user_5'), read_number),
+        'client_database.get_history': measure(lambda: database.get_history(to_who='user_1'), read_number),
+        'client_database.search_history': measure(lambda: database.search_history('сообщение 42'), read_number),
+        'client_database.get_history_page': measure(lambda: database.get_history_page(to_who='user_1', before=USERS),
+                                                    read_number),
+    }
+    database.close()
+    return results
+
+
+def run(scale=1.0):
+    """
+    Функция запуска замеров, возвращает словарь результатов по именам
+    """
+    quiet_logging()
+    with tempfile.TemporaryDirectory() as directory:
+        results = server_storage(directory, scale)
+        results.update(client_database(directory, scale))
+    return results
+
+
+def main():
+    print_results(run())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Запуск всех микробенчмарков (кодек, обработка сообщений сервером, БД) с записью
+результатов в JSON. Если указан файл прошлого прогона, результаты сравниваются
+с ним, и замеры, замедлившиеся больше допустимого, считаются регрессией.
+
+Запуск из корня репозитория:
+python -m messenger.benchmarks.run_all -o bench.json --baseline prev.json --threshold 0.2
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+
+from messenger.benchmarks import bench_codec, bench_routing, bench_storage
+from messenger.benchmarks.utils import print_results
+
+SUITES = {
+    'codec': bench_codec,
+    'routing': bench_routing,
+    'storage': bench_storage,
+}
+
+
+def run_suites(names, scale=1.0):
+    """
+    Функция запуска выбранных наборов замеров, возвращает общий словарь результатов
+    """
+    results = {}
+    for name in names:
+        results.update(SUITES[name].run(scale))
+    return results
+
+
+def compare(results, baseline, threshold):
+    """
+    Функция сравнения с прошлым прогоном по лучшему времени.
+    Возвращает список регрессий: (имя, прежнее время, новое время).
+    """
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        if result['best_us'] > previous['best_us'] * (1 + threshold):
+            regressions.append((name, previous['best_us'], result['best_us']))
+    return regressions
+
+
+def arg_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', '--output', default='bench.json', help='файл для записи результатов')
+    parser.add_argument('-b', '--baseline', default=None, help='результаты прошлого прогона')
+    parser.add_argument('-t', '--threshold', default=0.2, type=float,
+                        help='допустимое замедление относительно прошлого прогона (0.2 = 20%%)')
+    parser.add_argument('-s', '--scale', default=1.0, type=float, help='множитель числа повторов')
+    parser.add_argument('suites', nargs='*', help=f'наборы замеров: {", ".join(SUITES)} (по умолчанию все)')
+    args = parser.parse_args()
+    unknown = set(args.suites) - set(SUITES)
+    if unknown:
+        parser.error(f'неизвестные наборы замеров: {", ".join(sorted(unknown))}')
+    return args
+
+
+def main():
+    args = arg_parser()
+    results = run_suites(args.suites or list(SUITES), args.scale)
+    print_results(results)
+
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump({
+            'created': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'scale': args.scale,
+            'results': results,
+        }, file, indent=2, ensure_ascii=False)
+    print(f'Результаты записаны в {args.output}')
+
+    if not args.baseline:
+        return
+    with open(args.baseline, encoding='utf-8') as file:
+        baseline = json.load(file)['results']
+    regressions = compare(results, baseline, args.threshold)
+    for name, previous, current in regressions:
+        print(f'Регрессия {name}: {previous:.2f} -> {current:.2f} мкс')
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Общие средства бенчмарков: сокет-заглушка, замер времени, отключение журнала.
+"""
+import itertools
+import logging
+import sys
+import timeit
+from os.path import abspath, dirname
+
+# server.py импортирует модули относительно каталога messenger
+MESSENGER_DIR = dirname(dirname(abspath(__file__)))
+if MESSENGER_DIR not in sys.path:
+    sys.path.insert(0, MESSENGER_DIR)
+
+# Число повторов замера, берется лучший результат
+REPEAT = 3
+
+_filenos = itertools.count(1000)
+
+
+class FakeSocket:
+    """
+    Сокет-заглушка: запоминает последние отправленные байты и возвращает их при чтении
+    """
+
+    def __init__(self, address=('127.0.0.1', 50000)):
+        self.data = b''
+        self.position = 0
+        self.address = address
+        self.number = next(_filenos)
+
+    def send(self, data):
+        self.sendall(data)
+        return len(data)
+
+    def sendall(self, data):
+        self.data = data
+        self.position = 0
+
+    def recv(self, max_len):
+        chunk = self.data[self.position:self.position + max_len]
+        self.position += len(chunk)
+        return chunk
+
+    def fileno(self):
+        return self.number
+
+    def getpeername(self):
+        return self.address
+
+    def close(self):
+        pass
+
+
+def measure(function, number, repeat=REPEAT):
+    """
+    Функция замера: function вызывается number раз, замер повторяется repeat раз.
+    Возвращает словарь с лучшим и средним временем одного вызова в микросекундах.
+    """
+    times = timeit.repeat(function, number=number, repeat=repeat)
+    return {
+        'number': number,
+        'repeat': repeat,
+        'best_us': min(times) / number * 1e6,
+        'mean_us': sum(times) / len(times) / number * 1e6,
+    }
+
+
+def quiet_logging():
+    """
+    Функция отключения журнала сервера и клиента ниже WARNING:
+    замеряется обработка сообщений, а не запись журнала в файл и на экран
+    """
+    for name in ('server', 'client'):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+
+def print_results(results):
+    for name, result in results.items():
+        print(f'{name:45} {result["best_us"]:12.2f} мкс')
@@ -1,13 +1,17 @@
 import argparse
 import os
+import random
+import selectors
 import sys
-import json
 import socket
 import threading
 import time
-from os.path import join, dirname
-from dotenv import load_dotenv
+from dataclasses import replace
+from common.binary_codec import JSON_FORMAT
+from common.compression import ZLIB, MessageCompression
+from common.channel import Channel
 from common.common_functions import get_message, send_message
+from common.settings import load_settings
 from log.client_log_config import LOGGER
 from common.jim_variables import *
 from messenger.common.wrap import log
@@ -17,17 +21,22 @@ from database.client_database import ClientDatabase
 # Инициализация логгера
 CLIENT_LOGGER = LOGGER
 
-# Функции будут принимать ответы самостоятельно, поэтому нужно под них блокировать сокет и БД для транзакций.
-sock_lock = threading.Lock()
+# Сокет читает только ClientReader, ответы на запросы он передает ожидающим потокам через Channel.
+# БД используется из нескольких потоков, поэтому транзакции выполняются под блокировкой.
 database_lock = threading.Lock()
+# Контакты в сети: ответ на подписку на присутствие и изменения, присланные сервером
+online_contacts = set()
 
 class ClientSender(threading.Thread, metaclass=ClientMaker):
     # """
     # Класс, отвечающий за реализацию действий пользователя - отправка, запросы
     # """
-    def __init__(self, account_name, sock, database):
+    # Число сообщений на странице истории
+    history_page_size = 20
+
+    def __init__(self, account_name, channel, database):
         self.account_name = account_name
-        self.sock = sock
+        self.channel = channel
         self.database = database
         super().__init__()
 
@@ -63,26 +72,33 @@ class ClientSender(threading.Thread, metaclass=ClientMaker):
         }
         CLIENT_LOGGER.debug(f'Сформирован словарь сообщения: {message_dict}')
 
-        # Сохранение сообщения в истории
-        with database_lock:
-            self.database.save_message(self.account_name, to_user, message)
-
-        # Дожидаемся сокет и отправляем сообщение
-        with sock_lock:
-            try:
-                send_message(self.sock, message_dict)
-                CLIENT_LOGGER.info(f'Отпрвлено сообщение для {to_user}')
-            except OSError as e:
-                if e.errno:
-                    CLIENT_LOGGER.critical(f'Потеряно соединение с сервером. {e}')
-                    sys.exit(1)
-                else:
-                    CLIENT_LOGGER.error('Не удалось передать сообщение. Таймаут соединения')
+        # Сохранение сообщения в истории (фоновая запись, блокировка БД не нужна)
+        self.database.save_message(self.account_name, to_user, message)
+
+        # Отправляем сообщение, ответ на него не ожидается
+        try:
+            self.channel.send(message_dict)
+            CLIENT_LOGGER.info(f'Отпрвлено сообщение для {to_user}')
+        except OSError as e:
+            if e.errno:
+                CLIENT_LOGGER.critical(f'Потеряно соединение с сервером. {e}')
+                sys.exit(1)
+            else:
+                CLIENT_LOGGER.error('Не удалось передать сообщение. Таймаут соединения')
 
     def run(self):
         """
         Главная функция, запрашивает команды и запускает соответствующие функции
         """
+        try:
+            self.command_loop()
+        finally:
+            self.channel.close()
+
+    def command_loop(self):
+        """
+        Цикл обработки команд пользователя, завершается командой exit
+        """
         self.print_help()
         while True:
             command = input('Введите команду: ')
@@ -96,13 +112,12 @@ class ClientSender(threading.Thread, metaclass=ClientMaker):
 
             # Корректный Выход. Отправляем сообщение серверу о выходе.
             elif command == 'exit':
-                with sock_lock:
-                    try:
-                        send_message(self.sock, self.create_exit_message)
-                    except:
-                        pass
-                    print('Завершение соединения.')
-                    CLIENT_LOGGER.info('Завершение работы по команде пользователя.')
+                try:
+                    self.channel.send(self.create_exit_message())
+                except:
+                    pass
+                print('Завершение соединения.')
+                CLIENT_LOGGER.info('Завершение работы по команде пользователя.')
                 # Задержка для отправки сообщения до выхода
                 time.sleep(1)
                 break
@@ -112,16 +127,26 @@ class ClientSender(threading.Thread, metaclass=ClientMaker):
                 with database_lock:
                     contacts_list = self.database.get_contacts()
                 for contact in contacts_list:
-                    print(contact)
+                    print(f'{contact} (в сети)' if contact in online_contacts else contact)
 
             # Редактирование контактов
             elif command == 'edit':
                 self.edit_contacts()
+                # Подписка на присутствие следует за списком контактов
+                update_presence(self.channel, self.database, self.account_name)
 
             # история сообщений.
             elif command == 'history':
                 self.print_history()
 
+            # Поиск по тексту сообщений
+            elif command == 'search':
+                self.print_search()
+
+            # Группы: создание, вступление, выход, сообщение в группу
+            elif command == 'group':
+                self.edit_groups()
+
             else:
                 print('Команда не распознана, попробойте снова. help - вывести поддерживаемые команды.')
 
@@ -132,32 +157,60 @@ class ClientSender(threading.Thread, metaclass=ClientMaker):
         print('Поддерживаемые команды:')
         print('message - отправить сообщение. Кому и текст будет запрошены отдельно.')
         print('history - история сообщений')
+        print('search - поиск по тексту сообщений')
         print('contacts - список контактов')
         print('edit - редактирование списка контактов')
+        print('group - группы: создать, вступить, выйти, написать в группу')
         print('help - вывести подсказки по командам')
         print('exit - выход из программы')
 
     def print_history(self):
         '''
         Функция выводит сообщения из локальной базы данных пользователя.
+        Сообщения выводятся страницами, начиная с новых.
         '''
         ask = input('Показать входящие сообщения - in, исходящие - out, все - просто Enter: ')
-        with database_lock:
-            if ask == 'in':
-                history_list = self.database.get_history(to_who=self.account_name)
-                for message in history_list:
-                    print(f'\nСообщение от пользователя: {message[0]} от {message[3]}:\n{message[2]}')
-            elif ask == 'out':
-                history_list = self.database.get_history(from_who=self.account_name)
-                for message in history_list:
-                    print(f'\nСообщение пользователю: {message[1]} от {message[3]}:\n{message[2]}')
-            else:
-                history_list = self.database.get_history()
-                for message in history_list:
-                    print(f'\nСообщение от пользователя: {message[0]}, пользователю {message[1]}\
-                        от {message[3]}\n{message[2]}')
+        filters = {'in': {'to_who': self.account_name}, 'out': {'from_who': self.account_name}}.get(ask, {})
+        before = None
+        while True:
+            # Блокировка нужна только на время выборки страницы, не на ожидание ввода
+            with database_lock:
+                page = self.database.get_history_page(before=before, limit=self.history_page_size, **filters)
+            for message in page:
+                if ask == 'in':
+                    print(f'\nСообщение от пользователя: {message[1]} от {message[4]}:\n{message[3]}')
+                elif ask == 'out':
+                    print(f'\nСообщение пользователю: {message[2]} от {message[4]}:\n{message[3]}')
+                else:
+                    print(f'\nСообщение от пользователя: {message[1]}, пользователю {message[2]}\
+                        от {message[4]}\n{message[3]}')
+            if len(page) < self.history_page_size:
+                break
+            if input('Показать более ранние сообщения - Enter, закончить - q: ') == 'q':
+                break
+            before = page[-1][0]
 
 
+    def print_search(self):
+        '''
+        Функция выводит сообщения, найденные по словам, страницами: самые подходящие первыми.
+        '''
+        words = input('Введите слова для поиска: ')
+        offset = 0
+        while True:
+            with database_lock:
+                found = self.database.search_history(words, limit=self.history_page_size, offset=offset)
+            if not found and not offset:
+                print('Ничего не найдено.')
+            for message in found:
+                print(f'\nСообщение от пользователя: {message[1]}, пользователю {message[2]}\
+                    от {message[4]}\n{message[3]}')
+            if len(found) < self.history_page_size:
+                break
+            if input('Показать следующие результаты - Enter, закончить - q: ') == 'q':
+                break
+            offset += len(found)
+
     def edit_contacts(self):
         """
         Функция изменеия контактов. Позволяет добавить или удалить контакт.
@@ -166,75 +219,133 @@ class ClientSender(threading.Thread, metaclass=ClientMaker):
         if ans == 'del':
             edit = input('Введите имя удаляемного контакта: ')
             with database_lock:
-                if self.database.check_contact(edit):
+                exists = self.database.check_contact(edit)
+                if exists:
                     self.database.del_contact(edit)
-                else:
-                    CLIENT_LOGGER.error('Попытка удаления несуществующего контакта.')
+            if not exists:
+                CLIENT_LOGGER.error('Попытка удаления несуществующего контакта.')
+                return
+            # Контакты хранятся между запусками, поэтому удаление выполняется и на сервере
+            try:
+                remove_contact(self.channel, self.account_name, edit)
+            except Exception as e:
+                CLIENT_LOGGER.error(f'Не удалось отправить информацию на сервер. {e}')
         elif ans == 'add':
             # Проверка на возможность такого контакта
             edit = input('Введите имя создаваемого контакта: ')
             if self.database.check_user(edit):
                 with database_lock:
                     self.database.add_contact(edit)
-                with sock_lock:
-                    try:
-                        add_contact(self.sock, self.account_name, edit)
-                    except Exception as e:
-                        CLIENT_LOGGER.error(f'Не удалось отправить информацию на сервер. {e}')
+                try:
+                    add_contact(self.channel, self.account_name, edit)
+                except Exception as e:
+                    CLIENT_LOGGER.error(f'Не удалось отправить информацию на сервер. {e}')
+
+
+    def edit_groups(self):
+        """
+        Функция работы с группами. Позволяет создать группу, вступить в нее, выйти из нее
+        или отправить сообщение ее участникам.
+        """
+        ans = input('Создать группу - new, вступить - join, выйти - leave, написать в группу - message: ')
+        actions = {'new': CREATE_GROUP, 'join': JOIN_GROUP, 'leave': LEAVE_GROUP}
+        group = input('Введите имя группы: ')
+        if ans in actions:
+            try:
+                if group_request(self.channel, self.account_name, actions[ans], group):
+                    print('Удачно.')
+            except Exception as e:
+                CLIENT_LOGGER.error(f'Не удалось отправить информацию на сервер. {e}')
+        elif ans == 'message':
+            message = input('Введите сообщение для отправки: ')
+            message_dict = {
+                ACTION: GROUP_MESSAGE,
+                TIME: time.time(),
+                SENDER: self.account_name,
+                GROUP: group,
+                MESSAGE_TEXT: message
+            }
+            self.database.save_message(self.account_name, group, message)
+            try:
+                self.channel.send(message_dict)
+                CLIENT_LOGGER.info(f'Отправлено сообщение в группу {group}')
+            except OSError as e:
+                CLIENT_LOGGER.error(f'Не удалось передать сообщение. {e}')
 
 
 class ClientReader(threading.Thread, metaclass=ClientMaker):
     # """
     # Класс, отвечающий за прием сообщений с сервера. Принимает сообщения, выводит в консоль , сохраняет в базу.
     # """
-    def __init__(self, account_name, sock, database):
+    def __init__(self, account_name, channel, database):
         self.account_name = account_name
-        self.sock = sock
+        self.channel = channel
         self.database = database
         super().__init__()
 
     def run(self):
         """
-        Основной цикл приёмника сообщений, принимает сообщения, выводит в консоль. Завершается при потере соединения.
+        Основной цикл приёмника сообщений. Поток ждет готовности сокета без таймаута
+        и обрабатывает сообщения сразу после поступления. Ответы на запросы передаются
+        ожидающим потокам, сообщения выводятся в консоль и сохраняются в базу.
+        Завершается при закрытии канала или потере соединения.
         """
-        while True:
-            time.sleep(1)
-            with sock_lock:
-                try:
-                    message = get_message(self.sock)
-
-                # Вышел таймаут соединения если errno = None, иначе обрыв соединения.
-                except OSError as err:
-                    if err.errno:
-                        CLIENT_LOGGER.critical(f'Потеряно соединение с сервером.')
-                        break
-                # Проблемы с соединением
-                except (ConnectionError, ConnectionAbortedError, ConnectionResetError, json.JSONDecodeError):
-                    CLIENT_LOGGER.critical(f'Потеряно соединение с сервером.')
-                    break
-                # Если пакет корретно получен выводим в консоль и записываем в базу.
-                else:
-                    if ACTION in message and message[
-                        ACTION] == MESSAGE and SENDER in message and DESTINATION in message \
-                            and MESSAGE_TEXT in message and message[DESTINATION] == self.account_name:
-                        print(f'\nПолучено сообщение от пользователя {message[SENDER]}:\n{message[MESSAGE_TEXT]}')
-                        # Захватываем работу с базой данных и сохраняем в неё сообщение
-                        with database_lock:
-                            try:
-                                self.database.save_message(message[SENDER], self.account_name,
-                                                           message[MESSAGE_TEXT])
-                            except Exception as e:
-                                CLIENT_LOGGER.error(f'Ошибка взаимодействия с базой данных {e}')
-
-                        CLIENT_LOGGER.info(
-                            f'Получено сообщение от пользователя {message[SENDER]}:\n{message[MESSAGE_TEXT]}')
-                    else:
-                        CLIENT_LOGGER.error(f'Получено некорректное сообщение с сервера: {message}')
+        selector = selectors.DefaultSelector()
+        selector.register(self.channel.sock, selectors.EVENT_READ)
+        selector.register(self.channel.wakeup, selectors.EVENT_READ)
+        try:
+            while not self.channel.closed.is_set():
+                for key, _ in selector.select():
+                    if key.fileobj is not self.channel.sock:
+                        continue
+                    for message in self.channel.read_ready():
+                        if not self.channel.dispatch(message):
+                            self.process_message(message)
+        # Обрыв соединения или некорректные данные от сервера
+        except (OSError, ValueError) as err:
+            CLIENT_LOGGER.critical(f'Потеряно соединение с сервером. {err}')
+        finally:
+            selector.close()
+            self.channel.close()
+
+    def process_message(self, message):
+        """
+        Функция обработки входящего сообщения: выводит в консоль и записывает в базу
+        """
+        if ACTION in message and message[
+            ACTION] == MESSAGE and SENDER in message and DESTINATION in message \
+                and MESSAGE_TEXT in message and message[DESTINATION] == self.account_name:
+            print(f'\nПолучено сообщение от пользователя {message[SENDER]}:\n{message[MESSAGE_TEXT]}')
+            # Сообщение ставится в очередь фоновой записи в базу, читатель не ждет диска
+            self.database.save_message(message[SENDER], self.account_name, message[MESSAGE_TEXT])
+
+            CLIENT_LOGGER.info(
+                f'Получено сообщение от пользователя {message[SENDER]}:\n{message[MESSAGE_TEXT]}')
+        elif message.get(ACTION) == GROUP_MESSAGE and SENDER in message and GROUP in message \
+                and MESSAGE_TEXT in message:
+            print(f'\nСообщение в группе {message[GROUP]} от пользователя {message[SENDER]}:\n'
+                  f'{message[MESSAGE_TEXT]}')
+            self.database.save_message(message[SENDER], message[GROUP], message[MESSAGE_TEXT])
+        # Проверка связи: сервер отключает клиентов, которые долго не присылают данных
+        elif message.get(ACTION) == PING:
+            self.channel.send({ACTION: PONG, TIME: time.time()})
+        elif message.get(ACTION) == PONG:
+            pass
+        # Изменения присутствия контактов, накопленные сервером
+        elif message.get(ACTION) == PRESENCE_UPDATE and isinstance(message.get(ONLINE), list) \
+                and isinstance(message.get(OFFLINE), list):
+            online_contacts.update(message[ONLINE])
+            online_contacts.difference_update(message[OFFLINE])
+            CLIENT_LOGGER.debug(f'В сети: {message[ONLINE]}, не в сети: {message[OFFLINE]}')
+        else:
+            CLIENT_LOGGER.error(f'Получено некорректное сообщение с сервера: {message}')
 
 @log
-def create_presence(account_name, password):
+def create_presence(account_name, password, wire_format=JSON_FORMAT, compression=False):
     """
-    Функция генерирует запрос о присутствии клиента
+    Функция генерирует запрос о присутствии клиента.
+    В FORMATS - форматы сообщений в порядке предпочтения, JSON поддерживается всегда,
+    в COMPRESSION - поддерживаемые алгоритмы сжатия.
     """
     out = {
         ACTION: PRESENCE,
@@ -242,11 +353,22 @@ def create_presence(account_name, password):
         CHAT_USER: {
             ACCOUNT_NAME: account_name
         },
-        PASSWORD: password
+        PASSWORD: password,
+        FORMATS: list(dict.fromkeys((wire_format, JSON_FORMAT))),
+        COMPRESSION: [ZLIB] if compression else []
     }
     CLIENT_LOGGER.debug(f'Сформировано {PRESENCE} сообщение для пользователя {account_name}')
     return out
 
+class RetryLater(Exception):
+    """
+    Исключение - сервер перегружен входами и просит повторить попытку через delay секунд
+    """
+
+    def __init__(self, delay):
+        super().__init__(f'Повторите вход через {delay} с.')
+        self.delay = delay
+
 @log
 def process_response_ans(message):
     """
@@ -257,6 +379,9 @@ def process_response_ans(message):
     if RESPONSE in message:
         if message[RESPONSE] == 200:
             return '200 : OK'
+        elif message[RESPONSE] == 429:
+            retry_after = message.get(RETRY_AFTER)
+            raise RetryLater(retry_after if isinstance(retry_after, (int, float)) else 1)
         elif message[RESPONSE] == 400:
             CLIENT_LOGGER.critical(f'Ошибка сервера 400 : {message[ERROR]}')
     raise ValueError(RESPONSE)
@@ -266,11 +391,11 @@ def arg_parser():
     """
     Парсер аргументов коммандной строки
     """
-    dotenv_path = join(dirname(__file__), '.env')
-    load_dotenv(dotenv_path)
+    # Настройки загружаются один раз и дальше передаются явно
+    settings = load_settings()
     parser = argparse.ArgumentParser()
-    parser.add_argument('addr', default=os.environ.get("DEFAULT_IP_ADDRESS"), nargs='?')
-    parser.add_argument('port', default=os.environ.get("DEFAULT_PORT"), type=int, nargs='?')
+    parser.add_argument('addr', default=settings.default_ip_address, nargs='?')
+    parser.add_argument('port', default=settings.default_port, type=int, nargs='?')
     parser.add_argument('-n', '--name', default=None, nargs='?')
     parser.add_argument('-p', '--password', default=None, nargs='?')
     namespace = parser.parse_args(sys.argv[1:])
@@ -285,9 +410,9 @@ def arg_parser():
             f'Попытка запуска клиента с неподходящим номером порта: {server_port}. Допустимы адреса с 1024 до 65535. Клиент завершается.')
         exit(1)
 
-    return server_address, server_port, client_name, password
+    return server_address, server_port, client_name, password, settings
 
-def contacts_list_request(sock, name):
+def contacts_list_request(channel, name):
     """
     Функция, выполняющая запрос контакт-листа
     """
@@ -298,8 +423,7 @@ def contacts_list_request(sock, name):
         CHAT_USER: name
     }
     CLIENT_LOGGER.debug(f'Сформирован запрос {req}')
-    send_message(sock, req)
-    ans = get_message(sock)
+    ans = channel.request(req)
     CLIENT_LOGGER.debug(f'Получен ответ {ans}')
     if RESPONSE in ans and ans[RESPONSE] == 202:
         return ans[LIST_INFO]
@@ -307,7 +431,7 @@ def contacts_list_request(sock, name):
         CLIENT_LOGGER.critical(f'Получен некорректный ответ на запрос контакт листа')
         sys.exit(1)
 
-def add_contact(sock, username, contact):
+def add_contact(channel, username, contact):
     """
     Функция добавления пользователя в контакт лист
     """
@@ -318,8 +442,7 @@ def add_contact(sock, username, contact):
         CHAT_USER: username,
         ACCOUNT_NAME: contact
     }
-    send_message(sock, req)
-    ans = get_message(sock)
+    ans = channel.request(req)
     if RESPONSE in ans and ans[RESPONSE] == 200:
         pass
     else:
@@ -328,7 +451,7 @@ def add_contact(sock, username, contact):
     print('Удачное создание контакта.')
 
 # Функция запроса списка известных пользователей
-def user_list_request(sock, username):
+def user_list_request(channel, username):
     """
     Функция добавления пользователя в контакт лист
     """
@@ -338,15 +461,14 @@ def user_list_request(sock, username):
         TIME: time.time(),
         ACCOUNT_NAME: username
     }
-    send_message(sock, req)
-    ans = get_message(sock)
+    ans = channel.request(req)
     if RESPONSE in ans and ans[RESPONSE] == 202:
         return ans[LIST_INFO]
     else:
         CLIENT_LOGGER.critical(f'Получен некорректный ответ на запрос списка известных пользователей')
         sys.exit(1)
 
-def remove_contact(sock, username, contact):
+def remove_contact(channel, username, contact):
     """
     Функция удаления пользователя из контакт листа
     """
@@ -357,8 +479,7 @@ def remove_contact(sock, username, contact):
         CHAT_USER: username,
         ACCOUNT_NAME: contact
     }
-    send_message(sock, req)
-    ans = get_message(sock)
+    ans = channel.request(req)
     if RESPONSE in ans and ans[RESPONSE] == 200:
         pass
     else:
@@ -366,26 +487,95 @@ def remove_contact(sock, username, contact):
         sys.exit(1)
     print('Удачное удаление')
 
-def database_load(sock, database, username):
+def group_request(channel, username, group_action, group):
+    """
+    Функция запроса создания группы, вступления в нее или выхода. Возвращает True при успехе.
+    """
+    CLIENT_LOGGER.debug(f'Запрос {group_action} для группы {group}')
+    req = {
+        ACTION: group_action,
+        TIME: time.time(),
+        ACCOUNT_NAME: username,
+        GROUP: group
+    }
+    ans = channel.request(req)
+    if RESPONSE in ans and ans[RESPONSE] == 200:
+        return True
+    print(ans.get(ERROR, 'Запрос отклонен сервером.'))
+    return False
+
+def sync_request(channel, req, version):
+    """
+    Функция запроса изменений списка с версии version. Сервер прежней версии
+    не знает VERSION и присылает полный список - он применяется как полный.
+    """
+    req[TIME] = time.time()
+    req[VERSION] = version
+    ans = channel.request(req)
+    if RESPONSE in ans and ans[RESPONSE] == 202 and isinstance(ans.get(LIST_INFO), list):
+        return ans
+    raise ValueError(ans.get(ERROR, RESPONSE))
+
+def subscribe_presence(channel, username, contacts):
+    """
+    Функция подписки на вход и выход контактов, возвращает список контактов в сети.
+    Дальше сервер сам присылает изменения (PRESENCE_UPDATE).
+    """
+    CLIENT_LOGGER.debug(f'Подписка на присутствие контактов {username}')
+    req = {
+        ACTION: SUBSCRIBE,
+        TIME: time.time(),
+        ACCOUNT_NAME: username,
+        LIST_INFO: contacts
+    }
+    ans = channel.request(req)
+    if RESPONSE in ans and ans[RESPONSE] == 202:
+        return ans[LIST_INFO]
+    raise ValueError(ans.get(ERROR, RESPONSE))
+
+def update_presence(channel, database, username):
+    """
+    Функция обновления подписки на присутствие по текущему списку контактов
+    """
+    with database_lock:
+        contacts_list = database.get_contacts()
+    try:
+        online = subscribe_presence(channel, username, contacts_list)
+    except Exception as e:
+        CLIENT_LOGGER.error(f'Ошибка подписки на присутствие контактов. {e}')
+        return
+    online_contacts.clear()
+    online_contacts.update(online)
+
+def database_load(channel, database, username):
     """
     Функция инициализатор базы данных. Запускается при запуске, загружает данные в базу с сервера.
     """
-    # Загружаем список известных пользователей
+    # Загружаем изменения списка известных пользователей с прошлого запуска
+    with database_lock:
+        users_version = database.get_version('users')
     try:
-        users_list = user_list_request(sock, username)
+        ans = sync_request(channel, {ACTION: USERS_REQUEST, ACCOUNT_NAME: username}, users_version)
     except Exception as e:
         CLIENT_LOGGER.error(f'Ошибка запроса списка известных пользователей. {e}')
     else:
-        database.add_users(users_list)
+        with database_lock:
+            database.apply_users(ans[LIST_INFO], ans.get(VERSION, 0), ans.get(FULL, True))
+        CLIENT_LOGGER.debug(f'Синхронизирован список пользователей, новых: {len(ans[LIST_INFO])}')
 
-    # Загружаем список контактов
+    # Загружаем изменения списка контактов
+    with database_lock:
+        contacts_version = database.get_version('contacts')
     try:
-        contacts_list = contacts_list_request(sock, username)
+        ans = sync_request(channel, {ACTION: GET_CONTACTS, CHAT_USER: username}, contacts_version)
     except Exception as e:
         CLIENT_LOGGER.error(f'Ошибка запроса списка контактов {e}')
     else:
-        for contact in contacts_list:
-            database.add_contact(contact)
+        with database_lock:
+            database.apply_contacts(ans[LIST_INFO], ans.get(REMOVED, []), ans.get(VERSION, 0), ans.get(FULL, True))
+
+    # Подписываемся на вход и выход контактов вместо периодических запросов списков
+    update_presence(channel, database, username)
 
 def main():
     """
@@ -395,7 +585,7 @@ def main():
     print('Консольный месседжер. Клиентский модуль.')
 
     # Загружаем параметы коммандной строки
-    server_address, server_port, client_name, password = arg_parser()
+    server_address, server_port, client_name, password, settings = arg_parser()
 
     # Если имя пользователя не было задано, необходимо запросить пользователя.
     if not client_name:
@@ -409,45 +599,76 @@ def main():
     CLIENT_LOGGER.info(
         f'Запущен клиент с парамертами: адрес сервера: {server_address} , порт: {server_port}, имя пользователя: {client_name}')
 
-    # Инициализация сокета и сообщение серверу о нашем появлении
-    try:
+    # Инициализация сокета и сообщение серверу о нашем появлении.
+    # Перегруженный входами сервер просит повторить попытку позже: пауза увеличивается
+    # случайной добавкой, чтобы переподключающиеся клиенты не приходили снова одновременно.
+    for attempt in range(1, settings.login_attempts + 1):
         transport = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-
-        # Таймаут 1 секунда, необходим для освобождения сокета.
-        transport.settimeout(1)
-
-        transport.connect((server_address, server_port))
-        send_message(transport, create_presence(client_name, password))
-        answer = process_response_ans(get_message(transport))
-        CLIENT_LOGGER.info(f'Установлено соединение с сервером. Ответ сервера: {answer}')
-        print(f'Установлено соединение с сервером.')
-    except Exception as e:
-        CLIENT_LOGGER.error('Возникла ошибка при подключении к серверу')
-        exit(1)
+        try:
+            # Таймаут подключения 1 секунда, необходим для освобождения сокета.
+            transport.settimeout(1)
+
+            transport.connect((server_address, server_port))
+            # Ответ на вход приходит после хеширования пароля и записи в БД сервера,
+            # при массовом переподключении - после очереди входов, поэтому ждем его как ответ на запрос
+            transport.settimeout(settings.request_timeout)
+            # Запрос о присутствии - в JSON, его понимает сервер любой версии
+            # Сжатие предлагается только в режиме кадров
+            presence = create_presence(client_name, password, settings.wire_format,
+                                       settings.compression and settings.framed_mode)
+            send_message(transport, presence, settings, wire_format=JSON_FORMAT)
+            response = get_message(transport, settings)
+            answer = process_response_ans(response)
+        except RetryLater as e:
+            transport.close()
+            delay = e.delay * random.uniform(1, 2)
+            CLIENT_LOGGER.warning(f'Сервер перегружен входами, попытка {attempt}, повтор через {delay:.1f} с.')
+            print(f'Сервер перегружен, повторное подключение через {delay:.1f} с.')
+            time.sleep(delay)
+            continue
+        except Exception as e:
+            CLIENT_LOGGER.error('Возникла ошибка при подключении к серверу')
+            exit(1)
+        break
     else:
+        CLIENT_LOGGER.error(f'Сервер не принял вход за {settings.login_attempts} попыток')
+        exit(1)
 
-        # Инициализация БД
-        database = ClientDatabase(client_name)
-        database_load(transport, database, client_name)
-
-        # Если соединение с сервером установлено корректно, запускаем поток взаимодействия с пользователем
-        module_sender = ClientSender(client_name, transport, database)
-        module_sender.daemon = True
-        module_sender.start()
-        CLIENT_LOGGER.debug('Запущены процессы')
-
-        # затем запускаем поток - приёмник сообщений.
-        module_receiver = ClientReader(client_name, transport, database)
-        module_receiver.daemon = True
-        module_receiver.start()
-
-        # Watchdog основной цикл, если один из потоков завершён, то значит или потеряно соединение или пользователь
-        # ввёл exit. Поскольку все события обработываются в потоках, достаточно просто завершить цикл.
-        while True:
-            time.sleep(1)
-            if module_receiver.is_alive() and module_sender.is_alive():
-                continue
-            break
+    # Дальше сообщения отправляются в формате и со сжатием, выбранными сервером
+    settings = replace(settings, wire_format=response.get(FORMAT, JSON_FORMAT))
+    compression = MessageCompression(settings.compression_threshold, settings.compression_level) \
+        if response.get(COMPRESSION) == ZLIB else None
+    CLIENT_LOGGER.info(f'Установлено соединение с сервером. Ответ сервера: {answer}')
+    print(f'Установлено соединение с сервером.')
+
+    # Инициализация БД
+    database = ClientDatabase(client_name, history_flush_interval=settings.history_flush_interval,
+                              history_batch_size=settings.history_batch_size)
+    # После входа таймаут ограничивает только зависшую отправку: читатель ждет готовности сокета
+    transport.settimeout(settings.request_timeout)
+    channel = Channel(transport, settings, compression)
+
+    # Сначала запускаем поток - приёмник сообщений: он же принимает ответы на запросы
+    module_receiver = ClientReader(client_name, channel, database)
+    module_receiver.daemon = True
+    module_receiver.start()
+
+    database_load(channel, database, client_name)
+
+    # Если соединение с сервером установлено корректно, запускаем поток взаимодействия с пользователем
+    module_sender = ClientSender(client_name, channel, database)
+    module_sender.daemon = True
+    module_sender.start()
+    CLIENT_LOGGER.debug('Запущены процессы')
+
+    # Канал закрывается, если потеряно соединение или пользователь ввёл exit.
+    # Поскольку все события обработываются в потоках, достаточно дождаться закрытия.
+    channel.closed.wait()
+    # Сообщения, ожидающие записи в историю, сохраняются перед выходом
+    with database_lock:
+        database.close()
+    if compression:
+        CLIENT_LOGGER.info(f'Статистика сжатия сообщений: {compression.stats()}')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,112 @@
+import time
+
+
+class TokenBucket:
+    """
+    Класс - ведро токенов: в среднем rate событий в секунду, подряд - не больше burst.
+    """
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst, now):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = now
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """
+        Функция, возвращающая время до появления токена (0 - токен есть)
+        """
+        self.refill(now)
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def is_full(self, now):
+        self.refill(now)
+        return self.tokens >= self.burst
+
+
+class LoginAdmission:
+    """
+    Класс - допуск входов на сервер. Вход (PRESENCE) стоит хеширования PBKDF2 и записи в БД,
+    поэтому при массовом переподключении входы допускаются не чаще, чем позволяют общее
+    ведро токенов и ведро адреса клиента, и не больше max_pending одновременно
+    (от приема PRESENCE до ответа). Остальные получают отказ с подсказкой, через сколько
+    секунд повторить попытку, а обычные сообщения обрабатываются без задержек.
+    """
+
+    def __init__(self, rate, burst, ip_rate, ip_burst, max_pending, prune_interval=10.0):
+        # Паузы до повтора считаются делением на скорость, пустое ведро никогда не пополнится
+        if rate <= 0 or ip_rate <= 0:
+            raise ValueError(f'Скорость входов должна быть больше нуля: {rate}, {ip_rate}')
+        if burst < 1 or ip_burst < 1 or max_pending < 1:
+            raise ValueError(f'Размер ведра и предел входов должны быть не меньше 1: '
+                             f'{burst}, {ip_burst}, {max_pending}')
+        self.rate = rate
+        self.ip_rate = ip_rate
+        self.ip_burst = ip_burst
+        self.max_pending = max_pending
+        self.bucket = TokenBucket(rate, burst, time.monotonic())
+        self.ip_buckets = {}
+        self.prune_interval = prune_interval
+        self.pruned_at = time.monotonic()
+        self.pending = 0
+        # Счетчики для мониторинга
+        self.admitted = 0
+        self.rejected = 0
+
+    def admit(self, ip):
+        """
+        Функция допуска входа с адреса ip. Возвращает 0, если вход допущен
+        (тогда по его завершении нужно вызвать finished), иначе - рекомендуемую паузу в секундах.
+        """
+        now = time.monotonic()
+        ip_bucket = self.ip_buckets.get(ip)
+        if ip_bucket is None:
+            ip_bucket = self.ip_buckets[ip] = TokenBucket(self.ip_rate, self.ip_burst, now)
+        # Пауза - до появления токенов в обоих ведрах, при полной очереди - до ее разбора
+        retry_after = max(ip_bucket.wait_time(now), self.bucket.wait_time(now))
+        if self.pending >= self.max_pending:
+            retry_after = max(retry_after, self.pending / self.rate)
+        if retry_after:
+            self.rejected += 1
+            return retry_after
+        ip_bucket.take()
+        self.bucket.take()
+        self.pending += 1
+        self.admitted += 1
+        return 0
+
+    def finished(self):
+        """
+        Функция завершения допущенного входа (успешного или нет)
+        """
+        self.pending -= 1
+
+    def prune(self):
+        """
+        Функция удаления ведер адресов, которые успели заполниться: они не отличаются
+        от новых, а их число иначе растет с числом адресов клиентов
+        """
+        now = time.monotonic()
+        for ip in [ip for ip, bucket in self.ip_buckets.items() if bucket.is_full(now)]:
+            del self.ip_buckets[ip]
+
+    def prune_if_due(self):
+        """
+        Функция удаления заполнившихся ведер адресов, если с прошлого удаления
+        прошло prune_interval секунд: просмотр всех ведер не нужен на каждом шаге цикла
+        """
+        if time.monotonic() - self.pruned_at >= self.prune_interval:
+            self.prune()
+            self.pruned_at = time.monotonic()
+
+    def stats(self):
+        return {'pending': self.pending, 'admitted': self.admitted, 'rejected': self.rejected,
+                'addresses': len(self.ip_buckets)}
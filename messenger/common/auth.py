@@ -0,0 +1,65 @@
+import binascii
+import hashlib
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+# Число итераций PBKDF2, должно совпадать с тем, которым получены хеши в БД
+PBKDF2_ITERATIONS = 100000
+
+
+def hash_password(password, salt):
+    """
+    Функция получения хеша пароля. Соль - имя пользователя.
+    """
+    return binascii.hexlify(
+        hashlib.pbkdf2_hmac('sha256', bytes(password, 'utf-8'), bytes(salt, 'utf-8'), PBKDF2_ITERATIONS))
+
+
+class AuthPool:
+    """
+    Класс - пул проверки паролей.
+    Хеширование PBKDF2 выполняется в отдельных потоках (hashlib отпускает GIL
+    на время вычисления), основной цикл сервера забирает готовые результаты
+    и тем временем продолжает обрабатывать сообщения. Очередь ограничена:
+    при переполнении submit возвращает False.
+    """
+
+    def __init__(self, workers, max_pending, notify=None):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='auth')
+        self.max_pending = max_pending
+        self.pending = 0
+        self.results = queue.SimpleQueue()
+        # Вызывается из потока пула после каждого результата (например, чтобы разбудить цикл событий)
+        self.notify = notify
+
+    def submit(self, password, salt, context):
+        """
+        Функция постановки пароля в очередь на хеширование.
+        context возвращается вместе с результатом.
+        """
+        if self.pending >= self.max_pending:
+            return False
+        self.pending += 1
+        future = self.executor.submit(hash_password, password, salt)
+        future.add_done_callback(lambda done: self.done(context, done))
+        return True
+
+    def done(self, context, future):
+        self.results.put((context, future))
+        if self.notify:
+            self.notify()
+
+    def completed(self):
+        """
+        Генератор готовых результатов: тройки (context, хеш пароля, ошибка).
+        Если пароль не удалось хешировать (например, его нельзя закодировать в UTF-8),
+        хеш - None, а ошибка - исключение, иначе ошибка - None.
+        """
+        while True:
+            try:
+                context, future = self.results.get_nowait()
+            except queue.Empty:
+                return
+            self.pending -= 1
+            error = future.exception()
+            yield context, None if error is not None else future.result(), error
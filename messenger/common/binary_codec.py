@@ -0,0 +1,186 @@
+import struct
+
+from .jim_variables import *
+
+# Форматы сообщений на проводе. Клиент предлагает форматы в PRESENCE (FORMATS),
+# сервер выбирает первый поддерживаемый и сообщает его в ответе 200 (FORMAT).
+JSON_FORMAT = 'json'
+BINARY_FORMAT = 'binary'
+WIRE_FORMATS = (BINARY_FORMAT, JSON_FORMAT)
+
+# Первый байт бинарного сообщения. JSON-сообщение всегда начинается с '{',
+# поэтому формат полученного сообщения определяется без учета состояния соединения.
+BINARY_MAGIC = 0xB1
+
+# Строки JIM, которые передаются одним байтом - номером в таблице: ключи и значения ACTION.
+# Таблицу можно только дополнять в конце, иначе разойдутся клиенты и серверы разных версий.
+JIM_STRINGS = (
+    ACTION, TIME, CHAT_USER, ACCOUNT_NAME, PASSWORD, SENDER, DESTINATION,
+    PRESENCE, RESPONSE, ERROR, MESSAGE, MESSAGE_TEXT, EXIT,
+    GET_CONTACTS, ADD_CONTACT, DEL_CONTACT, ALERT, TARGET_USER, LIST_INFO, USERS_REQUEST,
+    WORKER, WORKER_JOIN, WORKER_LEAVE, FORMATS, FORMAT, COMPRESSION,
+    GROUP, CREATE_GROUP, JOIN_GROUP, LEAVE_GROUP, GROUP_MESSAGE, GROUP_UPDATE, REQUEST_ID,
+    SUBSCRIBE, PRESENCE_UPDATE, ONLINE, OFFLINE, VERSION, REMOVED, FULL,
+    RETRY_AFTER, PING, PONG,
+)
+STRING_TAGS = {string: tag for tag, string in enumerate(JIM_STRINGS)}
+
+# Типы значений
+T_NONE = 0
+T_TRUE = 1
+T_FALSE = 2
+T_INT8 = 3
+T_INT32 = 4
+T_INT64 = 5
+T_FLOAT = 6
+T_JIM = 7
+T_STR8 = 8
+T_STR32 = 9
+T_LIST = 10
+T_DICT = 11
+
+INT8 = struct.Struct('>b')
+INT32 = struct.Struct('>i')
+INT64 = struct.Struct('>q')
+FLOAT = struct.Struct('>d')
+UINT32 = struct.Struct('>I')
+
+
+def encode_value(value, out, encoding):
+    """
+    Функция записи одного значения в буфер out
+    """
+    # bool - подкласс int, поэтому проверяется первым
+    if value is None:
+        out.append(T_NONE)
+    elif value is True:
+        out.append(T_TRUE)
+    elif value is False:
+        out.append(T_FALSE)
+    elif isinstance(value, str):
+        tag = STRING_TAGS.get(value)
+        if tag is not None:
+            out += bytes((T_JIM, tag))
+            return
+        data = value.encode(encoding)
+        if len(data) < 256:
+            out += bytes((T_STR8, len(data)))
+        else:
+            out.append(T_STR32)
+            out += UINT32.pack(len(data))
+        out += data
+    elif isinstance(value, int):
+        if -128 <= value < 128:
+            out.append(T_INT8)
+            out += INT8.pack(value)
+        elif -2 ** 31 <= value < 2 ** 31:
+            out.append(T_INT32)
+            out += INT32.pack(value)
+        else:
+            out.append(T_INT64)
+            out += INT64.pack(value)
+    elif isinstance(value, float):
+        out.append(T_FLOAT)
+        out += FLOAT.pack(value)
+    elif isinstance(value, dict):
+        out.append(T_DICT)
+        out += UINT32.pack(len(value))
+        for key, item in value.items():
+            if not isinstance(key, str):
+                raise TypeError(f'Ключ сообщения должен быть строкой, получен {type(key).__name__}')
+            encode_value(key, out, encoding)
+            encode_value(item, out, encoding)
+    elif isinstance(value, (list, tuple)):
+        out.append(T_LIST)
+        out += UINT32.pack(len(value))
+        for item in value:
+            encode_value(item, out, encoding)
+    else:
+        raise TypeError(f'Тип {type(value).__name__} не поддерживается бинарным форматом')
+
+
+def decode_value(data, offset, encoding):
+    """
+    Функция чтения одного значения, возвращает значение и смещение следующего
+    """
+    kind = data[offset]
+    offset += 1
+    if kind == T_JIM:
+        return JIM_STRINGS[data[offset]], offset + 1
+    if kind == T_STR8:
+        end = offset + 1 + data[offset]
+        return data[offset + 1:end].decode(encoding), end
+    if kind == T_INT8:
+        return INT8.unpack_from(data, offset)[0], offset + 1
+    if kind == T_FLOAT:
+        return FLOAT.unpack_from(data, offset)[0], offset + 8
+    if kind == T_DICT:
+        count, = UINT32.unpack_from(data, offset)
+        offset += 4
+        result = {}
+        for _ in range(count):
+            key, offset = decode_value(data, offset, encoding)
+            result[key], offset = decode_value(data, offset, encoding)
+        return result, offset
+    if kind == T_LIST:
+        count, = UINT32.unpack_from(data, offset)
+        offset += 4
+        result = []
+        for _ in range(count):
+            item, offset = decode_value(data, offset, encoding)
+            result.append(item)
+        return result, offset
+    if kind == T_STR32:
+        length, = UINT32.unpack_from(data, offset)
+        end = offset + 4 + length
+        return data[offset + 4:end].decode(encoding), end
+    if kind == T_INT32:
+        return INT32.unpack_from(data, offset)[0], offset + 4
+    if kind == T_INT64:
+        return INT64.unpack_from(data, offset)[0], offset + 8
+    if kind == T_NONE:
+        return None, offset
+    if kind == T_TRUE:
+        return True, offset
+    if kind == T_FALSE:
+        return False, offset
+    raise ValueError(f'Неизвестный тип значения {kind}')
+
+
+def encode_binary(message, encoding='utf-8'):
+    """
+    Функция преобразования словаря сообщения JIM в бинарный формат
+    """
+    if not isinstance(message, dict):
+        raise TypeError('Сообщение JIM должно быть словарем')
+    out = bytearray((BINARY_MAGIC,))
+    encode_value(message, out, encoding)
+    return bytes(out)
+
+
+def decode_binary(data, encoding='utf-8'):
+    """
+    Функция разбора сообщения в бинарном формате. При ошибке формата - ValueError.
+    """
+    try:
+        message, end = decode_value(data, 1, encoding)
+    except (IndexError, struct.error, UnicodeDecodeError) as e:
+        raise ValueError(f'Некорректное бинарное сообщение: {e}')
+    if end != len(data) or not isinstance(message, dict):
+        raise ValueError('Некорректное бинарное сообщение')
+    return message
+
+
+def is_binary(data):
+    return bool(data) and data[0] == BINARY_MAGIC
+
+
+def choose_format(offered):
+    """
+    Функция выбора формата из предложенных клиентом, по порядку предпочтения клиента
+    """
+    if isinstance(offered, list):
+        for wire_format in offered:
+            if wire_format in WIRE_FORMATS:
+                return wire_format
+    return JSON_FORMAT
@@ -0,0 +1,75 @@
+from collections import deque
+
+
+class OutboundBuffer:
+    """
+    Класс - ограниченный буфер исходящих данных одного соединения.
+    Сообщения складываются в буфер и отправляются, когда сокет готов к записи;
+    неотправленный остаток после частичной записи остается в начале очереди.
+    Пороги high/low используются для приостановки чтения от отправителей,
+    пишущих перегруженному получателю, limit - предельный размер буфера.
+    """
+
+    def __init__(self, high_watermark, low_watermark, limit):
+        self.chunks = deque()
+        self.size = 0
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.limit = limit
+        # Счетчики для мониторинга
+        self.bytes_queued = 0
+        self.bytes_sent = 0
+        self.peak = 0
+        self.partial_writes = 0
+
+    def __len__(self):
+        return self.size
+
+    def write(self, data):
+        """
+        Функция постановки данных в очередь на отправку
+        """
+        if self.size + len(data) > self.limit:
+            raise BufferError(f'Переполнен буфер исходящих сообщений: {self.size} байт')
+        self.chunks.append(memoryview(data))
+        self.size += len(data)
+        self.bytes_queued += len(data)
+        self.peak = max(self.peak, self.size)
+
+    def flush(self, sock):
+        """
+        Функция отправки данных из буфера в неблокирующий сокет.
+        Отправляет столько, сколько сокет примет, возвращает True, если буфер опустел.
+        """
+        while self.chunks:
+            chunk = self.chunks[0]
+            try:
+                sent = sock.send(chunk)
+            except (BlockingIOError, InterruptedError):
+                return False
+            self.size -= sent
+            self.bytes_sent += sent
+            if sent < len(chunk):
+                self.chunks[0] = chunk[sent:]
+                self.partial_writes += 1
+                return False
+            self.chunks.popleft()
+        return True
+
+    def is_congested(self):
+        return self.size >= self.high_watermark
+
+    def is_drained(self):
+        return self.size <= self.low_watermark
+
+    def stats(self):
+        """
+        Функция, возвращающая счетчики буфера
+        """
+        return {
+            'depth': self.size,
+            'peak': self.peak,
+            'bytes_queued': self.bytes_queued,
+            'bytes_sent': self.bytes_sent,
+            'partial_writes': self.partial_writes,
+        }
@@ -0,0 +1,161 @@
+import itertools
+import socket
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from .common_functions import decode_message, send_message
+from .framing import FrameDecoder
+from .jim_variables import RESPONSE, REQUEST_ID
+
+
+class PendingRequests:
+    """
+    Класс - запросы клиента, ожидающие ответа сервера.
+    Каждому запросу присваивается REQUEST_ID, ответ с тем же ID завершает его Future.
+    Ответ без ID (сервер старой версии) относится к самому раннему из ожидающих
+    запросов: такой сервер отвечает на запросы строго по порядку.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.waiting = OrderedDict()
+
+    def __len__(self):
+        return len(self.waiting)
+
+    def register(self):
+        """
+        Функция регистрации нового запроса, возвращает его ID и Future для ответа
+        """
+        future = Future()
+        with self.lock:
+            request_id = next(self.ids)
+            self.waiting[request_id] = future
+        return request_id, future
+
+    def cancel(self, request_id):
+        with self.lock:
+            self.waiting.pop(request_id, None)
+
+    def resolve(self, response):
+        """
+        Функция передачи ответа ожидающему запросу. Возвращает False, если запрос не найден
+        (например, его ожидание уже истекло).
+        """
+        with self.lock:
+            if REQUEST_ID in response:
+                future = self.waiting.pop(response[REQUEST_ID], None)
+            elif self.waiting:
+                future = self.waiting.popitem(last=False)[1]
+            else:
+                future = None
+        if future is None:
+            return False
+        future.set_result(response)
+        return True
+
+    def fail_all(self, error):
+        """
+        Функция завершения всех ожидающих запросов ошибкой, например при потере соединения
+        """
+        with self.lock:
+            waiting, self.waiting = self.waiting, OrderedDict()
+        for future in waiting.values():
+            future.set_exception(error)
+
+
+class Channel:
+    """
+    Класс - соединение клиента с сервером.
+    Сообщения отправляются из любых потоков под общей блокировкой отправки,
+    читает сокет только один поток, который передает ответы ожидающим запросам
+    (dispatch), а остальные сообщения обрабатывает сам. Поэтому несколько запросов
+    могут ожидать ответа одновременно, и чужой ответ не может быть прочитан вместо своего.
+    Читатель ждет готовности сокета (или пробуждения при закрытии) и не использует
+    блокировку отправки.
+    """
+
+    def __init__(self, sock, settings, compression=None):
+        self.sock = sock
+        self.settings = settings
+        self.compression = compression
+        self.send_lock = threading.Lock()
+        self.pending = PendingRequests()
+        # Режим ответов сервера совпадает с режимом клиента, поэтому задается явно
+        self.decoder = FrameDecoder()
+        self.decoder.framed = settings.framed_mode
+        # Закрытие канала будит читателя через пару сокетов
+        self.closed = threading.Event()
+        self.wakeup, self.wakeup_writer = socket.socketpair()
+
+    def send(self, message):
+        """
+        Функция отправки сообщения без ожидания ответа
+        """
+        with self.send_lock:
+            send_message(self.sock, message, self.settings, compression=self.compression)
+
+    def request_async(self, message):
+        """
+        Функция отправки запроса, возвращает Future с ответом сервера
+        """
+        request_id, future = self.pending.register()
+        message[REQUEST_ID] = request_id
+        try:
+            self.send(message)
+        except Exception:
+            self.pending.cancel(request_id)
+            raise
+        return future
+
+    def request(self, message, timeout=None):
+        """
+        Функция отправки запроса и ожидания ответа.
+        По истечении таймаута - concurrent.futures.TimeoutError.
+        """
+        future = self.request_async(message)
+        try:
+            return future.result(self.settings.request_timeout if timeout is None else timeout)
+        except FutureTimeoutError:
+            self.pending.cancel(message[REQUEST_ID])
+            raise
+
+    def read_ready(self):
+        """
+        Функция чтения готовых данных из сокета, возвращает список полностью
+        полученных сообщений. Вызывается только потоком-читателем, когда сокет готов
+        к чтению, поэтому recv не блокируется.
+        """
+        data = self.sock.recv(self.settings.recv_buffer_length)
+        if not data:
+            raise ConnectionError('Сервер закрыл соединение')
+        messages = []
+        for payload in self.decoder.feed(data):
+            if self.compression:
+                payload = self.compression.decompress(payload)
+            messages.append(decode_message(payload, self.settings))
+        return messages
+
+    def dispatch(self, message):
+        """
+        Функция передачи ответа ожидающему запросу. Возвращает True, если сообщение -
+        ответ на запрос, иначе его должен обработать читатель.
+        """
+        if RESPONSE not in message:
+            return False
+        return self.pending.resolve(message)
+
+    def close(self, error=None):
+        """
+        Функция закрытия канала: ожидающие запросы завершаются ошибкой, читатель просыпается
+        """
+        if self.closed.is_set():
+            return
+        self.closed.set()
+        self.pending.fail_all(error or ConnectionError('Соединение с сервером закрыто'))
+        try:
+            self.wakeup_writer.send(b'\0')
+        except OSError:
+            pass
@@ -1,18 +1,19 @@
-import os
 import json
-from os.path import join, dirname
-from dotenv import load_dotenv
+from .binary_codec import BINARY_FORMAT, BINARY_MAGIC, encode_binary, decode_binary
+from .framing import pack_frame, recv_frame
+from .settings import get_settings
 
 
-def get_message(client):
+def decode_message(encoded_response, settings=None):
     """
-    Функция принимающая сообщения от сервера
+    Функция преобразующая полученные байты в словарь сообщения JIM.
+    Формат (JSON или бинарный) определяется по первому байту.
     """
-    dotenv_path = join(dirname(__file__), '../.env')
-    load_dotenv(dotenv_path)
-    encoded_response = client.recv(int(os.environ.get("MAX_PACKAGE_LENGTH")))
+    settings = settings or get_settings()
     if isinstance(encoded_response, bytes):
-        json_response = encoded_response.decode(os.environ.get("ENCODING"))
+        if encoded_response[:1] == bytes((BINARY_MAGIC,)):
+            return decode_binary(encoded_response, settings.encoding)
+        json_response = encoded_response.decode(settings.encoding)
         response = json.loads(json_response)
         if isinstance(response, dict):
             return response
@@ -20,12 +21,47 @@ def get_message(client):
     raise ValueError
 
 
-def send_message(sock, message):
+def encode_message(message, settings=None, wire_format=None):
     """
-    Функция посылающая сообщения на сервер
+    Функция преобразующая словарь сообщения JIM в байты для отправки.
+    Формат по умолчанию - из настроек.
     """
-    dotenv_path = join(dirname(__file__), '../.env')
-    load_dotenv(dotenv_path)
+    settings = settings or get_settings()
+    if (wire_format or settings.wire_format) == BINARY_FORMAT:
+        return encode_binary(message, settings.encoding)
     js_message = json.dumps(message)
-    encoded_message = js_message.encode(os.environ.get("ENCODING"))
-    sock.send(encoded_message)
+    return js_message.encode(settings.encoding)
+
+
+def get_message(client, settings=None, framed=None, compression=None):
+    """
+    Функция принимающая сообщения от сервера.
+    В режиме кадров читает ровно одно сообщение с заголовком длины,
+    иначе - одно чтение из сокета как одно сообщение.
+    compression - сжатие, согласованное для соединения (MessageCompression).
+    """
+    settings = settings or get_settings()
+    if framed is None:
+        framed = settings.framed_mode
+    if framed:
+        encoded_response = recv_frame(client)
+    else:
+        encoded_response = client.recv(settings.max_package_length)
+    if compression:
+        encoded_response = compression.decompress(encoded_response)
+    return decode_message(encoded_response, settings)
+
+
+def send_message(sock, message, settings=None, framed=None, wire_format=None, compression=None):
+    """
+    Функция посылающая сообщения на сервер
+    """
+    settings = settings or get_settings()
+    if framed is None:
+        framed = settings.framed_mode
+    encoded_message = encode_message(message, settings, wire_format)
+    if compression:
+        encoded_message = compression.compress(encoded_message)
+    if framed:
+        encoded_message = pack_frame(encoded_message)
+    sock.sendall(encoded_message)
@@ -0,0 +1,86 @@
+import time
+import zlib
+
+from .framing import MAX_FRAME_LENGTH
+
+# Алгоритм сжатия. Клиент предлагает его в PRESENCE (COMPRESSION),
+# сервер подтверждает в ответе 200, если сжатие включено и у него.
+ZLIB = 'zlib'
+
+# Первый байт сжатого сообщения: не совпадает ни с '{' (JSON), ни с маркером бинарного формата
+COMPRESSED_MAGIC = 0xC1
+
+
+class MessageCompression:
+    """
+    Класс - сжатие сообщений одного соединения.
+    Контексты deflate сохраняются между сообщениями (словарь предыдущих сообщений
+    помогает сжимать похожие), каждое сообщение завершается Z_SYNC_FLUSH.
+    Поэтому сжатые сообщения должны разжиматься строго в порядке отправки,
+    и сжатие согласуется только для соединений в режиме кадров.
+    Сообщения короче threshold отправляются без сжатия.
+    """
+
+    def __init__(self, threshold, level=6):
+        self.threshold = threshold
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        self.decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        # Счетчики для мониторинга
+        self.compressed_messages = 0
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        self.compress_time = 0.0
+        self.decompress_time = 0.0
+
+    def compress(self, data):
+        """
+        Функция сжатия исходящего сообщения, короткие сообщения возвращаются как есть
+        """
+        if len(data) < self.threshold:
+            return data
+        start = time.perf_counter()
+        compressed = bytes((COMPRESSED_MAGIC,)) + self.compressor.compress(data) + \
+            self.compressor.flush(zlib.Z_SYNC_FLUSH)
+        self.compress_time += time.perf_counter() - start
+        self.compressed_messages += 1
+        self.raw_bytes += len(data)
+        self.compressed_bytes += len(compressed)
+        return compressed
+
+    def decompress(self, data):
+        """
+        Функция разжатия входящего сообщения, несжатые сообщения возвращаются как есть.
+        Размер разжатого сообщения ограничен максимальным размером кадра.
+        """
+        if not data or data[0] != COMPRESSED_MAGIC:
+            return data
+        start = time.perf_counter()
+        try:
+            message = self.decompressor.decompress(data[1:], MAX_FRAME_LENGTH)
+        except zlib.error as e:
+            raise ValueError(f'Некорректное сжатое сообщение: {e}')
+        if self.decompressor.unconsumed_tail:
+            raise ValueError(f'Размер разжатого сообщения превышает {MAX_FRAME_LENGTH}')
+        self.decompress_time += time.perf_counter() - start
+        return message
+
+    def stats(self):
+        """
+        Функция, возвращающая счетчики сжатия
+        """
+        return {
+            'compressed_messages': self.compressed_messages,
+            'bytes_saved': self.raw_bytes - self.compressed_bytes,
+            'compress_seconds': self.compress_time,
+            'decompress_seconds': self.decompress_time,
+        }
+
+
+def negotiate_compression(offered, settings):
+    """
+    Функция выбора сжатия по предложению клиента.
+    Возвращает MessageCompression или None, если сжатие не используется.
+    """
+    if not settings.compression or not isinstance(offered, list) or ZLIB not in offered:
+        return None
+    return MessageCompression(settings.compression_threshold, settings.compression_level)
@@ -0,0 +1,149 @@
+import time
+
+from .binary_codec import JSON_FORMAT
+
+# Состояния соединения: подключен, ожидает проверки пароля, вошел под именем
+CONNECTED = 'connected'
+AUTHENTICATING = 'authenticating'
+ACTIVE = 'active'
+
+
+class Connection:
+    """
+    Класс - состояние одного соединения с клиентом.
+    Объектов столько же, сколько соединений, поэтому атрибуты заданы в __slots__.
+    """
+    __slots__ = ('sock', 'fileno', 'address', 'name', 'state', 'decoder', 'buffer', 'wire_format', 'compression',
+                 'paused', 'blocked', 'congested', 'messages_in', 'messages_out', 'bytes_in', 'last_seen',
+                 'events')
+
+    def __init__(self, sock, address, decoder, buffer=None):
+        self.sock = sock
+        self.fileno = sock.fileno()
+        self.address = address
+        self.name = None
+        self.state = CONNECTED
+        # Декодер входящего потока и буфер исходящих данных (у asyncio буфер в транспорте)
+        self.decoder = decoder
+        self.buffer = buffer
+        # Формат исходящих сообщений, согласованный при входе
+        self.wire_format = JSON_FORMAT
+        # Сжатие сообщений (MessageCompression), если согласовано при входе
+        self.compression = None
+        # Обратное давление: отправители, чтение от которых приостановлено из-за этого
+        # получателя, и число перегруженных получателей, из-за которых приостановлено
+        # чтение от этого клиента. В asyncio - получатели, разгрузки которых надо дождаться.
+        self.paused = set()
+        self.blocked = 0
+        self.congested = set()
+        # Счетчики для мониторинга
+        self.messages_in = 0
+        self.messages_out = 0
+        self.bytes_in = 0
+        # Время последних данных от клиента (time.monotonic), по нему проверяется, жив ли клиент
+        self.last_seen = time.monotonic()
+        # События сокета, на которые он зарегистрирован в селекторе сервера (0 - не зарегистрирован)
+        self.events = 0
+
+    def stats(self):
+        """
+        Функция, возвращающая счетчики соединения
+        """
+        return {
+            'messages_in': self.messages_in,
+            'messages_out': self.messages_out,
+            'bytes_in': self.bytes_in,
+            'paused': bool(self.blocked or self.congested),
+            'compression': self.compression.stats() if self.compression else None,
+        }
+
+
+class ConnectionRegistry:
+    """
+    Класс - реестр соединений сервера.
+    Соединение находится за O(1) по сокету, номеру дескриптора, адресу клиента
+    и имени пользователя (в том числе зарезервированному на время проверки пароля).
+    """
+
+    def __init__(self):
+        self.by_sock = {}
+        self.by_fileno = {}
+        self.by_address = {}
+        self.by_name = {}
+
+    def __len__(self):
+        return len(self.by_sock)
+
+    def __iter__(self):
+        return iter(list(self.by_sock.values()))
+
+    def __contains__(self, sock):
+        return sock in self.by_sock
+
+    def add(self, sock, address, decoder, buffer=None):
+        """
+        Функция регистрации нового соединения
+        """
+        connection = Connection(sock, address, decoder, buffer)
+        self.by_sock[sock] = connection
+        self.by_fileno[connection.fileno] = connection
+        self.by_address[address] = connection
+        return connection
+
+    def get(self, sock):
+        return self.by_sock.get(sock)
+
+    def get_by_fileno(self, fileno):
+        return self.by_fileno.get(fileno)
+
+    def get_by_address(self, address):
+        return self.by_address.get(address)
+
+    def find(self, name):
+        """
+        Функция поиска соединения по имени, включая ожидающие проверки пароля
+        """
+        return self.by_name.get(name)
+
+    def active(self, name):
+        """
+        Функция поиска соединения пользователя, завершившего вход
+        """
+        connection = self.by_name.get(name)
+        if connection is not None and connection.state == ACTIVE:
+            return connection
+        return None
+
+    def reserve(self, connection, name):
+        """
+        Функция резервирования имени на время проверки пароля.
+        Прежнее имя соединения, если оно было, освобождается.
+        """
+        if connection.name is not None and self.by_name.get(connection.name) is connection:
+            del self.by_name[connection.name]
+        connection.name = name
+        connection.state = AUTHENTICATING
+        self.by_name[name] = connection
+
+    def activate(self, connection):
+        connection.state = ACTIVE
+
+    def remove(self, sock):
+        """
+        Функция удаления соединения из всех индексов. Возвращает удаленное соединение или None.
+        """
+        connection = self.by_sock.pop(sock, None)
+        if connection is None:
+            return None
+        self.by_fileno.pop(connection.fileno, None)
+        if self.by_address.get(connection.address) is connection:
+            del self.by_address[connection.address]
+        if connection.name is not None and self.by_name.get(connection.name) is connection:
+            del self.by_name[connection.name]
+        return connection
+
+    def names(self):
+        """
+        Функция, возвращающая имена пользователей, завершивших вход
+        """
+        return [name for name, connection in self.by_name.items() if connection.state == ACTIVE]
@@ -0,0 +1,67 @@
+# Тип числовых полей (например, времени): JSON и бинарный формат дают int или float
+NUMBER = (int, float)
+
+
+def matches(value, kind):
+    """
+    Функция проверки значения поля по описанию типа: тип или кортеж типов,
+    словарь {поле: тип} - вложенный объект с этими полями, список [тип] - список таких значений
+    """
+    if isinstance(kind, dict):
+        return isinstance(value, dict) and all(field in value and matches(value[field], sub)
+                                               for field, sub in kind.items())
+    if isinstance(kind, list):
+        return isinstance(value, list) and all(matches(item, kind[0]) for item in value)
+    return isinstance(value, kind)
+
+
+class Handler:
+    """
+    Класс - обработчик одного действия JIM.
+    required - поля, без которых запрос некорректен (проверка - одно сравнение множеств),
+    types - типы полей, поле owner всегда строка,
+    owner - поле с именем пользователя, который должен совпадать с вошедшим с этого соединения.
+    """
+    __slots__ = ('action', 'method', 'required', 'types', 'owner')
+
+    def __init__(self, action, method, required, owner=None, types=None):
+        self.action = action
+        self.method = method
+        self.required = frozenset(required)
+        types = dict(types or {})
+        if owner:
+            types[owner] = str
+        self.types = tuple(types.items())
+        self.owner = owner
+
+    def accepts(self, message):
+        return message.keys() >= self.required and all(matches(message[field], kind) for field, kind in self.types)
+
+
+def action(name, *fields, owner=None):
+    """
+    Декоратор метода сервера - обработчика действия name.
+    Поле задается именем или парой (имя, тип), см. matches.
+    Обработчики собирает метакласс сервера в словарь handlers класса.
+    """
+    def decorator(method):
+        required = [field[0] if isinstance(field, tuple) else field for field in fields]
+        types = dict(field for field in fields if isinstance(field, tuple))
+        method.jim_handler = Handler(name, method, required, owner, types)
+        return method
+    return decorator
+
+
+def collect_handlers(bases, clsdict):
+    """
+    Функция сборки словаря обработчиков класса: обработчики базовых классов
+    дополняются и переопределяются обработчиками самого класса
+    """
+    handlers = {}
+    for base in reversed(bases):
+        handlers.update(getattr(base, 'handlers', {}))
+    for value in clsdict.values():
+        handler = getattr(value, 'jim_handler', None)
+        if isinstance(handler, Handler):
+            handlers[handler.action] = handler
+    return handlers
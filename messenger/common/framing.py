@@ -0,0 +1,88 @@
+import socket
+import struct
+
+# Заголовок кадра - длина сообщения, 4 байта big-endian.
+# Старший байт длины зарезервирован (кадр не больше 16 МБ), поэтому кадр
+# всегда начинается с нулевого байта и его нельзя спутать с сырым JSON ('{').
+FRAME_HEADER = struct.Struct('>I')
+MAX_FRAME_LENGTH = 0xFFFFFF
+RAW_JSON_START = ord('{')
+
+
+def pack_frame(payload):
+    """
+    Функция упаковки сообщения в кадр с заголовком длины
+    """
+    if len(payload) > MAX_FRAME_LENGTH:
+        raise ValueError(f'Размер сообщения {len(payload)} превышает допустимый {MAX_FRAME_LENGTH}')
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+
+def recv_exactly(sock, size):
+    """
+    Функция чтения из сокета ровно size байт.
+    Таймаут сокета пробрасывается, только если не было прочитано ни одного байта,
+    иначе начатый кадр дочитывается, чтобы не потерять границы сообщений.
+    """
+    data = bytearray()
+    while len(data) < size:
+        try:
+            chunk = sock.recv(size - len(data))
+        except socket.timeout:
+            if not data:
+                raise
+            continue
+        if not chunk:
+            raise ConnectionError('Соединение закрыто во время чтения кадра')
+        data += chunk
+    return bytes(data)
+
+
+def recv_frame(sock):
+    """
+    Функция чтения одного кадра из блокирующего сокета
+    """
+    header = recv_exactly(sock, FRAME_HEADER.size)
+    length, = FRAME_HEADER.unpack(header)
+    if length > MAX_FRAME_LENGTH:
+        raise ValueError(f'Некорректная длина кадра {length}')
+    return recv_exactly(sock, length)
+
+
+class FrameDecoder:
+    """
+    Класс - инкрементальный декодер входящего потока одного соединения.
+    Накапливает прочитанные байты и возвращает все полностью полученные сообщения,
+    недочитанный хвост остается в буфере до следующего чтения.
+    Режим соединения определяется по первому байту: кадры или сырой JSON
+    старых клиентов (одно чтение - одно сообщение).
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        # None - режим еще не известен
+        self.framed = None
+
+    def feed(self, data):
+        """
+        Функция добавления прочитанных байт, возвращает список готовых сообщений
+        """
+        if self.framed is None and data:
+            self.framed = data[0] != RAW_JSON_START
+        if not self.framed:
+            return [data] if data else []
+
+        self.buffer += data
+        messages = []
+        offset = 0
+        while len(self.buffer) - offset >= FRAME_HEADER.size:
+            length, = FRAME_HEADER.unpack_from(self.buffer, offset)
+            if length > MAX_FRAME_LENGTH:
+                raise ValueError(f'Некорректная длина кадра {length}')
+            end = offset + FRAME_HEADER.size + length
+            if len(self.buffer) < end:
+                break
+            messages.append(bytes(self.buffer[offset + FRAME_HEADER.size:end]))
+            offset = end
+        del self.buffer[:offset]
+        return messages
@@ -14,6 +14,21 @@ MESSAGE: str = 'message'
 MESSAGE_TEXT: str = 'mess_text'
 EXIT: str = 'exit'
 
+# wire format negotiation
+FORMATS: str = 'formats'
+FORMAT: str = 'format'
+COMPRESSION: str = 'compression'
+
+# heartbeats
+PING: str = 'ping'
+PONG: str = 'pong'
+
+# login admission: seconds to wait before reconnecting
+RETRY_AFTER: str = 'retry_after'
+
+# request/response correlation
+REQUEST_ID: str = 'request_id'
+
 # contacts list
 GET_CONTACTS: str = 'get_contacts'
 ADD_CONTACT: str = 'add_contact'
@@ -23,4 +38,26 @@ TARGET_USER: str = 'target_user'
 LIST_INFO: str = 'list_info'
 USERS_REQUEST: str = 'users_request'
 
+# incremental sync of users and contacts lists
+VERSION: str = 'version'
+REMOVED: str = 'removed'
+FULL: str = 'full'
+
+# presence subscriptions
+SUBSCRIBE: str = 'subscribe'
+PRESENCE_UPDATE: str = 'presence_update'
+ONLINE: str = 'online'
+OFFLINE: str = 'offline'
+
+# group chats
+GROUP: str = 'group'
+CREATE_GROUP: str = 'create_group'
+JOIN_GROUP: str = 'join_group'
+LEAVE_GROUP: str = 'leave_group'
+GROUP_MESSAGE: str = 'group_message'
 
+# server workers
+WORKER: str = 'worker'
+WORKER_JOIN: str = 'worker_join'
+WORKER_LEAVE: str = 'worker_leave'
+GROUP_UPDATE: str = 'group_update'
@@ -1,4 +1,5 @@
 import dis
+from .dispatch import collect_handlers
 
 
 class ServerMaker(type):
@@ -24,4 +25,6 @@ class ServerMaker(type):
             raise TypeError('Использование метода connect недопустимо в серверном классе')
         if not ('SOCK_STREAM' in attrs and 'AF_INET' in attrs):
             raise TypeError('Некорректная инициализация сокета.')
+        # Обработчики действий JIM: action -> Handler, выбор обработчика - один поиск в словаре
+        self.handlers = collect_handlers(bases, clsdict)
         super().__init__(clsname, bases, clsdict)
@@ -0,0 +1,97 @@
+import time
+
+
+class PresenceHub:
+    """
+    Класс - подписки на присутствие пользователей.
+    Клиент подписывается на список имен (обычно свои контакты) и получает от сервера
+    только изменения: кто вошел и кто вышел. Изменения для подписчика копятся
+    window секунд с первого из них и отправляются одним сообщением; если пользователь
+    за это время вышел и снова вошел, подписчик ничего не получает.
+    """
+
+    def __init__(self, window, limit):
+        self.window = window
+        self.limit = limit
+        # Имя -> подписчики на него и подписчик -> известное ему состояние каждого из его имен
+        self.watchers = {}
+        self.known = {}
+        # Подписчик -> накопленные изменения {имя: в сети} и срок их отправки.
+        # Интервал накопления у всех одинаковый, поэтому сроки добавляются в словарь
+        # по возрастанию и ближайший срок - первый.
+        self.pending = {}
+        self.deadlines = {}
+        # Счетчики для мониторинга
+        self.changes = 0
+        self.pushes = 0
+
+    def subscribe(self, subscriber, names, is_online):
+        """
+        Функция замены подписки subscriber на имена names (не больше limit).
+        Возвращает список имен, которые сейчас в сети.
+        """
+        self.unsubscribe(subscriber)
+        known = self.known[subscriber] = {name: is_online(name) for name in names[:self.limit]
+                                          if name != subscriber}
+        for name in known:
+            self.watchers.setdefault(name, set()).add(subscriber)
+        return [name for name, online in known.items() if online]
+
+    def unsubscribe(self, subscriber):
+        """
+        Функция удаления всех подписок subscriber, например при его выходе
+        """
+        for name in self.known.pop(subscriber, ()):
+            watchers = self.watchers.get(name)
+            if watchers is not None:
+                watchers.discard(subscriber)
+                if not watchers:
+                    del self.watchers[name]
+        self.pending.pop(subscriber, None)
+        self.deadlines.pop(subscriber, None)
+
+    def changed(self, name, online):
+        """
+        Функция регистрации входа или выхода пользователя name.
+        Возвращает True, если у кого-то из подписчиков начат новый интервал накопления.
+        """
+        armed = False
+        now = time.monotonic()
+        for subscriber in self.watchers.get(name, ()):
+            self.pending.setdefault(subscriber, {})[name] = online
+            if subscriber not in self.deadlines:
+                self.deadlines[subscriber] = now + self.window
+                armed = True
+        self.changes += 1
+        return armed
+
+    def due(self):
+        """
+        Генератор изменений, срок отправки которых наступил: тройки
+        (подписчик, вошедшие, вышедшие). Отменившие друг друга изменения пропускаются.
+        """
+        now = time.monotonic()
+        for subscriber, deadline in list(self.deadlines.items()):
+            if deadline > now:
+                break
+            del self.deadlines[subscriber]
+            known = self.known[subscriber]
+            online, offline = [], []
+            for name, state in self.pending.pop(subscriber).items():
+                if known.get(name) == state:
+                    continue
+                known[name] = state
+                (online if state else offline).append(name)
+            if online or offline:
+                self.pushes += 1
+                yield subscriber, online, offline
+
+    def next_due(self):
+        """
+        Функция, возвращающая ближайший срок отправки изменений (time.monotonic) или None
+        """
+        return next(iter(self.deadlines.values()), None)
+
+    def stats(self):
+        return {'subscribers': len(self.known), 'watched': len(self.watchers),
+                'changes': self.changes, 'pushes': self.pushes}
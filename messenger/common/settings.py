@@ -0,0 +1,100 @@
+import os
+from dataclasses import dataclass, fields
+from os.path import join, dirname
+from dotenv import dotenv_values
+
+ENV_PATH = join(dirname(__file__), '../.env')
+TRUE_VALUES = ('1', 'true', 'yes', 'on')
+
+
+@dataclass(frozen=True)
+class Settings:
+    """
+    Класс - настройки приложения.
+    Загружаются один раз при запуске и передаются серверу, клиенту и функциям
+    работы с сообщениями явно, вместо чтения .env на каждое сообщение.
+    """
+    default_port: int = 7777
+    default_ip_address: str = '127.0.0.1'
+    max_connections: int = 5
+    max_package_length: int = 1024
+    recv_buffer_length: int = 65536
+    encoding: str = 'utf-8'
+    framed_mode: bool = True
+    wire_format: str = 'json'
+    compression: bool = False
+    compression_threshold: int = 512
+    compression_level: int = 6
+    request_timeout: float = 10.0
+    history_flush_interval: float = 0.5
+    history_batch_size: int = 100
+    server_engine: str = 'select'
+    server_workers: int = 1
+    outbound_high_watermark: int = 256 * 1024
+    outbound_low_watermark: int = 64 * 1024
+    outbound_limit: int = 4 * 1024 * 1024
+    auth_workers: int = 4
+    auth_queue_size: int = 256
+    login_rate: float = 50.0
+    login_burst: int = 100
+    login_ip_rate: float = 1.0
+    login_ip_burst: int = 5
+    login_pending_limit: int = 256
+    login_attempts: int = 5
+    stats_flush_interval: float = 1.0
+    stats_flush_messages: int = 500
+    offline_queue_limit: int = 100
+    offline_retention: float = 7 * 24 * 3600
+    heartbeat_interval: float = 30.0
+    idle_timeout: float = 90.0
+    presence_window: float = 0.5
+    presence_subscription_limit: int = 1000
+    db_mmap_size: int = 256 * 1024 * 1024
+    storage_report_interval: float = 60.0
+
+    def __post_init__(self):
+        # Ошибка в .env обнаруживается при запуске, а не при первом отказе во входе
+        if self.login_rate <= 0 or self.login_ip_rate <= 0:
+            raise ValueError('LOGIN_RATE и LOGIN_IP_RATE должны быть больше нуля')
+        if self.login_burst < 1 or self.login_ip_burst < 1 or self.login_pending_limit < 1:
+            raise ValueError('LOGIN_BURST, LOGIN_IP_BURST и LOGIN_PENDING_LIMIT должны быть не меньше 1')
+
+
+def convert_value(field_type, value):
+    """
+    Функция приведения строкового значения из .env или окружения к типу поля
+    """
+    if field_type is bool:
+        return str(value).lower() in TRUE_VALUES
+    return field_type(value)
+
+
+def load_settings(env_path=ENV_PATH, overrides=None):
+    """
+    Функция загрузки настроек. Приоритет источников: параметры командной строки
+    (overrides), переменные окружения, файл .env, значения по умолчанию.
+    """
+    file_values = dotenv_values(env_path) if env_path and os.path.exists(env_path) else {}
+    values = {}
+    for field in fields(Settings):
+        key = field.name.upper()
+        value = os.environ.get(key, file_values.get(key))
+        if value is not None:
+            values[field.name] = convert_value(field.type, value)
+    if overrides:
+        values.update({name: value for name, value in overrides.items() if value is not None})
+    return Settings(**values)
+
+
+# Настройки по умолчанию для вызовов, которым настройки не переданы явно
+DEFAULT_SETTINGS = None
+
+
+def get_settings():
+    """
+    Функция, возвращающая настройки по умолчанию. Загружает их при первом обращении.
+    """
+    global DEFAULT_SETTINGS
+    if DEFAULT_SETTINGS is None:
+        DEFAULT_SETTINGS = load_settings()
+    return DEFAULT_SETTINGS
@@ -0,0 +1,56 @@
+import math
+
+
+class TimerWheel:
+    """
+    Класс - колесо таймеров: slots ячеек по resolution секунд.
+    Таймер попадает в ячейку, в которой истекает его срок (дальние сроки - с числом
+    оставшихся оборотов), поэтому постановка и отмена таймера - O(1), а на каждом шаге
+    колеса просматривается только одна ячейка, а не все таймеры.
+    Срок срабатывания округляется вверх до resolution.
+    """
+
+    def __init__(self, resolution, slots, now):
+        self.resolution = resolution
+        self.slots = [{} for _ in range(slots)]
+        self.position = 0
+        # Время последнего шага колеса
+        self.turned_at = now
+        # Ключ -> номер ячейки, для отмены
+        self.timers = {}
+
+    def __len__(self):
+        return len(self.timers)
+
+    def schedule(self, key, delay):
+        """
+        Функция постановки таймера key через delay секунд. Прежний таймер key отменяется.
+        """
+        self.cancel(key)
+        ticks = max(1, math.ceil(delay / self.resolution))
+        index = (self.position + ticks) % len(self.slots)
+        self.slots[index][key] = (ticks - 1) // len(self.slots)
+        self.timers[key] = index
+
+    def cancel(self, key):
+        index = self.timers.pop(key, None)
+        if index is not None:
+            del self.slots[index][key]
+
+    def advance(self, now):
+        """
+        Функция поворота колеса до момента now, возвращает список ключей сработавших таймеров
+        """
+        expired = []
+        while now - self.turned_at >= self.resolution:
+            self.turned_at += self.resolution
+            self.position = (self.position + 1) % len(self.slots)
+            slot = self.slots[self.position]
+            for key, rounds in list(slot.items()):
+                if rounds:
+                    slot[key] = rounds - 1
+                else:
+                    del slot[key]
+                    del self.timers[key]
+                    expired.append(key)
+        return expired
@@ -0,0 +1,90 @@
+import os
+import socket
+import stat
+import tempfile
+
+from .common_functions import encode_message
+
+# Наибольший размер сообщения между воркерами. Датаграмма Unix-сокета не может быть больше
+# буфера отправки сокета (около 200 КБ по умолчанию в Linux), а больше буфера чтения она
+# обрезается. Более длинные сообщения не пересылаются: send возвращает False.
+DATAGRAM_LIMIT = 65536
+
+
+class WorkerLink:
+    """
+    Класс - канал связи между процессами-воркерами сервера.
+    Каждый воркер слушает свой Unix-сокет датаграмм, сообщения другим воркерам
+    отправляются на их сокеты. Также хранит, на каком воркере находится
+    пользователь, подключенный к другому процессу.
+    Сокеты создаются в закрытом каталоге (см. make_directory): иначе другой пользователь
+    системы мог бы занять их имена или отправлять воркерам свои датаграммы.
+    """
+
+    def __init__(self, worker_id, workers, port, settings, directory):
+        if stat.S_IMODE(os.stat(directory).st_mode) & 0o077:
+            raise PermissionError(f'Каталог сокетов воркеров {directory} доступен другим пользователям')
+        self.worker_id = worker_id
+        self.settings = settings
+        self.paths = [os.path.join(directory, f'messenger-{port}-{worker}.sock') for worker in range(workers)]
+        # Имя пользователя -> номер воркера, к которому он подключен
+        self.locations = {}
+
+        # Сокет мог остаться от предыдущего запуска
+        if os.path.exists(self.paths[worker_id]):
+            os.unlink(self.paths[worker_id])
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self.sock.bind(self.paths[worker_id])
+        self.sock.setblocking(False)
+
+    @staticmethod
+    def make_directory():
+        """
+        Функция создания каталога для сокетов воркеров, доступного только владельцу (0700).
+        Создается до запуска воркеров, удаляется после их остановки.
+        """
+        return tempfile.mkdtemp(prefix='messenger-link-')
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def send(self, worker, message):
+        """
+        Функция отправки сообщения воркеру с указанным номером.
+        Возвращает False, если сообщение не отправлено: тогда его нужно обработать
+        без пересылки (например, сохранить до подключения получателя).
+        """
+        data = encode_message(message, self.settings)
+        if len(data) > DATAGRAM_LIMIT:
+            return False
+        try:
+            self.sock.sendto(data, self.paths[worker])
+        except OSError:
+            # Воркер еще не запущен, уже завершен или не успевает читать
+            return False
+        return True
+
+    def broadcast(self, message):
+        """
+        Функция отправки сообщения всем остальным воркерам
+        """
+        for worker in range(len(self.paths)):
+            if worker != self.worker_id:
+                self.send(worker, message)
+
+    def receive(self):
+        """
+        Генератор, возвращающий все датаграммы, уже поступившие от других воркеров.
+        Разбирает их получатель, чтобы некорректная датаграмма не прерывала чтение.
+        """
+        while True:
+            try:
+                data = self.sock.recv(DATAGRAM_LIMIT)
+            except BlockingIOError:
+                return
+            yield data
+
+    def close(self):
+        self.sock.close()
+        if os.path.exists(self.paths[self.worker_id]):
+            os.unlink(self.paths[self.worker_id])
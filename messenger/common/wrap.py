@@ -3,6 +3,8 @@ import messenger.log.client_log_config as of_client
 import messenger.log.server_log_config as of_server
 import inspect
 
+# Если модули импортированы не из server.py или client.py (бенчмарки, тесты) - журнал сервера
+LOGGER = of_server.LOGGER
 if where_am_i.endswith('server.py'):
     LOGGER = of_server.LOGGER
 if where_am_i.endswith('client.py'):
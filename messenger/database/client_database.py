@@ -1,7 +1,128 @@
-from sqlalchemy import create_engine, Table, Column, Integer, String, Text, MetaData, DateTime
+from sqlalchemy import create_engine, event, text, Table, Column, Index, Integer, String, Text, MetaData, DateTime
+from sqlalchemy.exc import OperationalError
 from sqlalchemy.orm import mapper, sessionmaker
 from messenger.common.jim_variables import *
 import datetime
+import logging
+import queue
+import threading
+import time
+
+LOGGER = logging.getLogger('client')
+
+# Служебные элементы очереди записи истории
+FLUSH = object()
+STOP = object()
+
+
+# Ранжируются только столько самых новых совпадений: стоимость запроса с частыми словами
+# не растет с размером истории
+SEARCH_WINDOW = 2000
+
+# Полнотекстовый индекс истории: внешнее содержимое (текст хранится только в message_history),
+# индекс обновляется триггерами при каждой вставке пачки сообщений
+FTS_TABLE = 'message_history_fts'
+FTS_SCHEMA = (
+    f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(message, content='message_history', content_rowid='id')",
+    f"CREATE TRIGGER IF NOT EXISTS message_history_fts_insert AFTER INSERT ON message_history BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, message) VALUES (new.id, new.message); END",
+    f"CREATE TRIGGER IF NOT EXISTS message_history_fts_delete AFTER DELETE ON message_history BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, message) VALUES ('delete', old.id, old.message); END",
+)
+
+
+def fts_query(words):
+    """
+    Функция преобразования строки поиска в запрос FTS5: каждое слово берется в кавычки,
+    чтобы символы синтаксиса FTS5 во вводе пользователя не вызывали ошибок.
+    Должны встретиться все слова целиком: поиск по началу слова разворачивается
+    во все слова индекса с этим началом и на большой истории слишком медленный.
+    """
+    return ' '.join('"' + word.replace('"', '""') + '"' for word in words.split())
+
+
+def enable_wal(dbapi_connection, connection_record):
+    """
+    Обработчик подключения к SQLite: журнал WAL (читатели не ждут писателя)
+    и синхронизация с диском только при контрольных точках WAL
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.close()
+
+
+class HistoryWriter(threading.Thread):
+    """
+    Класс - фоновая запись истории сообщений.
+    save_message только ставит сообщение в очередь, поток записывает накопленные
+    сообщения одной транзакцией: когда их набралось batch_size или через flush_interval
+    секунд после первого из них. При аварийном завершении теряется не больше
+    batch_size сообщений, полученных за последние flush_interval секунд.
+    """
+
+    def __init__(self, engine, table, flush_interval, batch_size):
+        super().__init__(name='history-writer', daemon=True)
+        self.engine = engine
+        self.table = table
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.queue = queue.Queue()
+        # Счетчики для мониторинга
+        self.batches = 0
+        self.written = 0
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            batch = []
+            deadline = time.monotonic() + self.flush_interval
+            # Набираем пачку до заполнения, истечения интервала или служебного элемента
+            while item is not FLUSH and item is not STOP:
+                batch.append(item)
+                timeout = deadline - time.monotonic()
+                if len(batch) >= self.batch_size or timeout <= 0:
+                    item = None
+                    break
+                try:
+                    item = self.queue.get(timeout=timeout)
+                except queue.Empty:
+                    item = None
+                    break
+            self.write(batch)
+            for _ in range(len(batch) + (item is not None)):
+                self.queue.task_done()
+            if item is STOP:
+                return
+
+    def write(self, batch):
+        if not batch:
+            return
+        try:
+            with self.engine.begin() as connection:
+                connection.execute(self.table.insert(), batch)
+        except Exception as e:
+            LOGGER.error(f'Не удалось сохранить историю сообщений ({len(batch)} шт.): {e}')
+            return
+        self.batches += 1
+        self.written += len(batch)
+
+    def save(self, row):
+        self.queue.put(row)
+
+    def flush(self):
+        """
+        Функция немедленной записи очереди, возвращается после фиксации транзакции
+        """
+        self.queue.put(FLUSH)
+        self.queue.join()
+
+    def stop(self):
+        """
+        Функция записи очереди и остановки потока
+        """
+        self.queue.put(STOP)
+        self.join()
 
 
 class ClientDatabase:
@@ -38,13 +159,18 @@ class ClientDatabase:
             self.id = None
             self.name = contact
 
+    # Отображения классов на таблицы создаются один раз на процесс
+    mapped = False
+
     # Конструктор класса:
-    def __init__(self, name):
+    def __init__(self, name, path=None, history_flush_interval=0.5, history_batch_size=100):
         # У каждого клиента своя БД
         # Поскольку клиент мультипоточный необходимо отключить проверки на подключения с разных потоков,
         # иначе sqlite3.ProgrammingError
-        self.database_engine = create_engine(f'sqlite:///database/client_{name}.db3', echo=False, pool_recycle=7200,
+        path = path or f'database/client_{name}.db3'
+        self.database_engine = create_engine(f'sqlite:///{path}', echo=False, pool_recycle=7200,
                                              connect_args={'check_same_thread': False})
+        event.listen(self.database_engine, 'connect', enable_wal)
 
         # Создаём объект MetaData
         self.metadata = MetaData()
@@ -61,7 +187,11 @@ class ClientDatabase:
                         Column('from_user', String),
                         Column('to_user', String),
                         Column('message', Text),
-                        Column('date', DateTime)
+                        Column('date', DateTime),
+                        # Страницы истории выбираются по отправителю или получателю в порядке id,
+                        # индексы позволяют не просматривать всю таблицу
+                        Index('message_history_from_user', 'from_user', 'id'),
+                        Index('message_history_to_user', 'to_user', 'id')
                         )
 
         # Создаём таблицу контактов
@@ -70,21 +200,57 @@ class ClientDatabase:
                          Column('name', String, unique=True)
                          )
 
+        # Версии списков пользователей и контактов, полученные при последней синхронизации
+        self.sync_state = Table('sync_state', self.metadata,
+                                Column('name', String, primary_key=True),
+                                Column('version', Integer)
+                                )
+        self.users_table = users
+
         # Создаём таблицы
         self.metadata.create_all(self.database_engine)
+        # В БД, созданных прежними версиями, таблица уже есть, а индексов еще нет
+        for index in history.indexes:
+            index.create(self.database_engine, checkfirst=True)
+        self.full_text = self.create_full_text_index()
 
         # Создаём отображения
-        mapper(self.KnownUsers, users)
-        mapper(self.MessageHistory, history)
-        mapper(self.Contacts, contacts)
+        if not ClientDatabase.mapped:
+            mapper(self.KnownUsers, users)
+            mapper(self.MessageHistory, history)
+            mapper(self.Contacts, contacts)
+            ClientDatabase.mapped = True
 
         # Создаём сессию
         Session = sessionmaker(bind=self.database_engine)
         self.session = Session()
 
-        # Необходимо очистить таблицу контактов, т.к. при запуске они подгружаются с сервера.
-        self.session.query(self.Contacts).delete()
-        self.session.commit()
+        # Контакты и пользователи хранятся между запусками, при запуске с сервера
+        # загружаются только изменения с сохраненной версии (см. apply_users, apply_contacts)
+
+        # История сообщений записывается фоновым потоком пачками
+        self.history_writer = HistoryWriter(self.database_engine, history, history_flush_interval,
+                                            history_batch_size)
+        self.history_writer.start()
+
+    def create_full_text_index(self):
+        """
+        Функция создания полнотекстового индекса истории. В БД прежних версий
+        индекс один раз заполняется уже сохраненными сообщениями.
+        Возвращает False, если SQLite собран без FTS5: тогда поиск идет без индекса.
+        """
+        with self.database_engine.begin() as connection:
+            if connection.execute(text("SELECT 1 FROM sqlite_master WHERE name = :name"),
+                                  {'name': FTS_TABLE}).first():
+                return True
+            try:
+                for statement in FTS_SCHEMA:
+                    connection.execute(text(statement))
+            except OperationalError as e:
+                LOGGER.warning(f'Полнотекстовый поиск недоступен: {e}')
+                return False
+            connection.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+        return True
 
     def add_contact(self, contact):
         """
@@ -100,6 +266,7 @@ class ClientDatabase:
         Функция удаления контакта
         """
         self.session.query(self.Contacts).filter_by(name=contact).delete()
+        self.session.commit()
 
     def add_users(self, users_list):
         """
@@ -112,14 +279,67 @@ class ClientDatabase:
             self.session.add(user_row)
         self.session.commit()
 
-    def save_message(self, from_user, to_user, message):
+    def get_version(self, name):
+        """
+        Функция, возвращающая версию списка name с последней синхронизации (0 - не было)
+        """
+        version = self.session.execute(self.sync_state.select().where(self.sync_state.c.name == name)).first()
+        return version.version if version else 0
+
+    def set_version(self, name, version):
+        self.session.execute(self.sync_state.delete().where(self.sync_state.c.name == name))
+        self.session.execute(self.sync_state.insert(), {'name': name, 'version': version})
+
+    def apply_users(self, added, version, full=False):
+        """
+        Функция применения изменений списка известных пользователей и сохранения его версии.
+        Полный список (full) заменяет имеющийся. Вставка - одним запросом, одна транзакция.
         """
-        Функция локального сохрарнения сообщений
+        if full:
+            self.session.query(self.KnownUsers).delete()
+        if added:
+            self.session.execute(self.users_table.insert(), [{'username': user} for user in added])
+        self.set_version('users', version)
+        self.session.commit()
+
+    def apply_contacts(self, added, removed, version, full=False):
         """
-        message_row = self.MessageHistory(from_user, to_user, message)
-        self.session.add(message_row)
+        Функция применения изменений списка контактов и сохранения его версии
+        """
+        if full:
+            self.session.query(self.Contacts).delete()
+        if removed:
+            self.session.query(self.Contacts).filter(self.Contacts.name.in_(removed)) \
+                .delete(synchronize_session=False)
+        existing = set(self.get_contacts())
+        for contact in dict.fromkeys(added):
+            if contact not in existing:
+                self.session.add(self.Contacts(contact))
+        self.set_version('contacts', version)
         self.session.commit()
 
+    def save_message(self, from_user, to_user, message):
+        """
+        Функция локального сохрарнения сообщений. Сообщение ставится в очередь
+        фоновой записи, вызов не ждет диска и безопасен из любого потока.
+        """
+        self.history_writer.save({'from_user': from_user, 'to_user': to_user, 'message': message,
+                                  'date': datetime.datetime.now()})
+
+    def flush_history(self):
+        """
+        Функция записи сообщений, ожидающих в очереди
+        """
+        self.history_writer.flush()
+
+    def close(self):
+        """
+        Функция завершения работы с БД: запись очереди истории и закрытие сессии
+        """
+        self.history_writer.stop()
+        self.session.close()
+        self.database_engine.dispose()
+
     def get_contacts(self):
         """
         Функция возвращающяя контакты
@@ -154,6 +374,8 @@ class ClientDatabase:
         """
         Функция возвращающая историю переписки
         """
+        # Сообщения, еще не записанные фоновым потоком, тоже должны попасть в ответ
+        self.flush_history()
         query = self.session.query(self.MessageHistory)
         if from_who:
             query = query.filter_by(from_user=from_who)
@@ -161,3 +383,69 @@ class ClientDatabase:
             query = query.filter_by(to_user=to_who)
         return [(history_row.from_user, history_row.to_user, history_row.message, history_row.date)
                 for history_row in query.all()]
+
+    def get_history_page(self, from_who=None, to_who=None, before=None, after=None, limit=20):
+        """
+        Функция, возвращающая страницу истории переписки: не больше limit сообщений,
+        новые первыми. before и after - курсоры (id сообщения): страница содержит сообщения
+        старше before или ближайшие более новые, чем after. Каждое сообщение - кортеж
+        (id, отправитель, получатель, текст, дата), id последнего - курсор следующей страницы.
+        Выборка идет по индексу, поэтому ее стоимость зависит от размера страницы, а не истории.
+        """
+        if before is None:
+            self.flush_history()
+        table = self.MessageHistory
+        query = self.session.query(table.id, table.from_user, table.to_user, table.message, table.date)
+        if from_who:
+            query = query.filter(table.from_user == from_who)
+        if to_who:
+            query = query.filter(table.to_user == to_who)
+        if before is not None:
+            query = query.filter(table.id < before)
+        if after is not None:
+            # Ближайшие к курсору более новые сообщения, затем тот же порядок, что и у остальных страниц
+            rows = query.filter(table.id > after).order_by(table.id).limit(limit).all()
+            return [tuple(row) for row in reversed(rows)]
+        return [tuple(row) for row in query.order_by(table.id.desc()).limit(limit).all()]
+
+    def iter_history(self, from_who=None, to_who=None, page_size=20):
+        """
+        Генератор страниц истории переписки от новых сообщений к старым
+        """
+        before = None
+        while True:
+            page = self.get_history_page(from_who, to_who, before=before, limit=page_size)
+            if not page:
+                return
+            yield page
+            if len(page) < page_size:
+                return
+            before = page[-1][0]
+
+    def search_history(self, words, limit=20, offset=0):
+        """
+        Функция поиска по тексту сообщений. Возвращает не больше limit сообщений, начиная
+        с offset, самые подходящие первыми (ранжирование bm25 индекса FTS5), при равной
+        оценке - новые первыми. Ранжируются SEARCH_WINDOW самых новых совпадений.
+        Каждое сообщение - кортеж (id, отправитель, получатель, текст, дата).
+        """
+        query = fts_query(words)
+        if not query:
+            return []
+        self.flush_history()
+        if self.full_text:
+            rows = self.session.execute(text(
+                f"SELECT h.id, h.from_user, h.to_user, h.message, h.date FROM "
+                f"(SELECT rowid AS id, rank FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :query "
+                f"ORDER BY rowid DESC LIMIT :window) AS found "
+                f"JOIN message_history AS h ON h.id = found.id "
+                f"ORDER BY found.rank, h.id DESC LIMIT :limit OFFSET :offset")
+                .columns(id=Integer, from_user=String, to_user=String, message=Text, date=DateTime),
+                {'query': query, 'window': SEARCH_WINDOW, 'limit': limit, 'offset': offset})
+            return [tuple(row) for row in rows]
+        # Без индекса - поиск всех слов перебором, новые первыми
+        table = self.MessageHistory
+        result = self.session.query(table.id, table.from_user, table.to_user, table.message, table.date)
+        for word in words.split():
+            result = result.filter(table.message.contains(word, autoescape=True))
+        return [tuple(row) for row in result.order_by(table.id.desc()).limit(limit).offset(offset).all()]
@@ -0,0 +1,114 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+# Служебный элемент очереди: остановка потока
+STOP = object()
+
+
+class StorageExecutor:
+    """
+    Класс - поток работы с БД сервера.
+    Все обращения к ServerStorage выполняются в одном потоке по очереди запросов,
+    поэтому сессия SQLAlchemy используется только из него, а главный цикл сервера
+    не ждет диска. submit возвращает Future; если указан then, готовый результат
+    вместе с then передается главному циклу через completed (как в AuthPool).
+    После ошибки вызова прерванная транзакция хранилища отменяется.
+    Порядок выполнения запросов совпадает с порядком их постановки.
+    """
+
+    def __init__(self, storage, notify=None):
+        self.storage = storage
+        self.requests = queue.SimpleQueue()
+        self.results = queue.SimpleQueue()
+        # Вызывается из потока БД после каждого результата с then (например, чтобы разбудить цикл событий)
+        self.notify = notify
+        # Счетчики для мониторинга: глубина очереди и время вызовов по именам методов
+        self.depth_max = 0
+        self.calls = {}
+        self.thread = threading.Thread(target=self.run, name='storage', daemon=True)
+        self.thread.start()
+
+    def submit(self, method, *args, then=None):
+        """
+        Функция постановки вызова метода ServerStorage в очередь потока БД
+        """
+        future = Future()
+        self.requests.put((method, args, future, then, time.perf_counter()))
+        self.depth_max = max(self.depth_max, self.requests.qsize())
+        return future
+
+    def call(self, method, *args):
+        """
+        Функция вызова метода в потоке БД с ожиданием результата.
+        Только для запуска и остановки сервера, главный цикл ее не использует.
+        """
+        return self.submit(method, *args).result()
+
+    def run(self):
+        while True:
+            item = self.requests.get()
+            if item is STOP:
+                return
+            method, args, future, then, queued = item
+            started = time.perf_counter()
+            try:
+                future.set_result(getattr(self.storage, method)(*args))
+            except Exception as e:
+                future.set_exception(e)
+                self.rollback()
+            self.record(method, started - queued, time.perf_counter() - started)
+            if then is not None:
+                self.results.put((then, future))
+                if self.notify:
+                    self.notify()
+
+    def rollback(self):
+        # Хранилище с транзакциями (ServerStorage) отменяет прерванную транзакцию
+        rollback = getattr(self.storage, 'rollback', None)
+        if rollback is None:
+            return
+        try:
+            rollback()
+        except Exception:
+            pass
+
+    def record(self, method, waited, elapsed):
+        # Счетчики пишет только поток БД: число вызовов, суммарное и максимальное время, ожидание в очереди
+        counters = self.calls.get(method)
+        if counters is None:
+            counters = self.calls[method] = [0, 0.0, 0.0, 0.0]
+        counters[0] += 1
+        counters[1] += elapsed
+        counters[2] = max(counters[2], elapsed)
+        counters[3] += waited
+
+    def completed(self):
+        """
+        Генератор готовых результатов: пары (then, Future)
+        """
+        while True:
+            try:
+                yield self.results.get_nowait()
+            except queue.Empty:
+                return
+
+    def stats(self):
+        """
+        Функция, возвращающая глубину очереди и время вызовов в миллисекундах по методам
+        """
+        return {
+            'queue_depth': self.requests.qsize(),
+            'queue_depth_max': self.depth_max,
+            'calls': {method: {'count': count, 'mean_ms': total / count * 1000, 'max_ms': longest * 1000,
+                               'wait_mean_ms': waited / count * 1000}
+                      for method, (count, total, longest, waited) in list(self.calls.items())},
+        }
+
+    def close(self):
+        """
+        Функция остановки потока после выполнения всех поставленных запросов
+        """
+        self.requests.put(STOP)
+        self.thread.join()
@@ -1,11 +1,114 @@
 import datetime
+import json
+import time
+from collections import Counter
 
-from sqlalchemy import Table, create_engine, MetaData, Column, Integer, String, ForeignKey, DateTime, Text
+from sqlalchemy import Table, create_engine, event, func, inspect, MetaData, Column, Integer, String, ForeignKey, \
+    DateTime, Text, Boolean, literal, select
 from sqlalchemy.orm import sessionmaker, mapper
+from sqlalchemy.pool import StaticPool
 
 from messenger.common.jim_variables import *
 
 
+def sqlite_tuning(mmap_size):
+    """
+    Функция, возвращающая обработчик подключения к SQLite: журнал WAL (читатели
+    и другие воркеры не ждут писателя), синхронизация с диском только при
+    контрольных точках WAL и чтение файла БД через mmap
+    """
+    def tune(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.execute(f'PRAGMA mmap_size={int(mmap_size)}')
+        cursor.close()
+    return tune
+
+
+class UserDirectory:
+    """
+    Класс - кэш соответствия имен пользователей и их ID.
+    Пользователи не переименовываются и не удаляются, поэтому записи кэша
+    не устаревают; новые пользователи добавляются при регистрации.
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.names = {}
+        # Счетчики для мониторинга
+        self.hits = 0
+        self.misses = 0
+
+    def add(self, name, user_id):
+        self.ids[name] = user_id
+        self.names[user_id] = name
+
+    def get_id(self, name):
+        """
+        Функция поиска ID по имени. Возвращает None, если имени нет в кэше.
+        """
+        user_id = self.ids.get(name)
+        if user_id is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return user_id
+
+    def get_name(self, user_id):
+        """
+        Функция поиска имени по ID. Возвращает None, если ID нет в кэше.
+        """
+        name = self.names.get(user_id)
+        if name is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return name
+
+    def stats(self):
+        """
+        Функция, возвращающая счетчики кэша
+        """
+        return {'size': len(self.ids), 'hits': self.hits, 'misses': self.misses}
+
+
+class GroupDirectory:
+    """
+    Класс - индекс групп в памяти: имя группы -> ID и множество имен участников.
+    Рассылка сообщения в группу не обращается к БД.
+    Индекс изменяет поток БД, а читает главный цикл сервера, поэтому множество
+    участников не изменяется на месте, а заменяется новым: читатель, перебирающий
+    полученное множество, не видит изменений.
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.members = {}
+
+    def add(self, name, group_id, members=()):
+        self.ids[name] = group_id
+        self.members[name] = set(members)
+
+    def add_member(self, name, username):
+        self.members[name] = self.members[name] | {username}
+
+    def remove_member(self, name, username):
+        self.members[name] = self.members[name] - {username}
+
+    def __contains__(self, name):
+        return name in self.ids
+
+    def get_members(self, name):
+        """
+        Функция, возвращающая множество участников группы или None, если группы нет в индексе
+        """
+        return self.members.get(name)
+
+    def stats(self):
+        return {'groups': len(self.ids), 'memberships': sum(len(members) for members in self.members.values())}
+
+
 class ServerStorage:
     """
     Класс - Серверная БД. Реляционность необходима - является опорной и для клиентских БД
@@ -53,6 +156,18 @@ class ServerStorage:
             self.user = user
             self.contact = contact
 
+    class ContactChanges:
+        """
+        Класс - изменение списка контактов пользователя. ID последнего изменения -
+        версия списка, по которой клиент получает только изменения с прошлой синхронизации.
+        """
+
+        def __init__(self, user, contact, added):
+            self.id = None
+            self.user = user
+            self.contact = contact
+            self.added = added
+
     class UsersHistory:
         """
         Класс, описывающий статистику отправленных и принятых сообщений пользователем
@@ -64,9 +179,51 @@ class ServerStorage:
             self.sent = 0
             self.accepted = 0
 
-    def __init__(self):
-        self.database_engine = create_engine('sqlite:///database/main.db', echo=False, pool_recycle=7200,
-                                             connect_args={'check_same_thread': False})
+    class OfflineMessages:
+        """
+        Класс - сообщение, ожидающее подключения получателя
+        """
+
+        def __init__(self, recipient, created, payload):
+            self.id = None
+            self.recipient = recipient
+            self.created = created
+            self.payload = payload
+
+    class ChatGroups:
+        """
+        Класс - группа пользователей
+        """
+
+        def __init__(self, name, owner):
+            self.id = None
+            self.name = name
+            self.owner = owner
+            self.created = datetime.datetime.now()
+
+    class GroupMembers:
+        """
+        Класс - участие пользователя в группе
+        """
+
+        def __init__(self, group, user):
+            self.id = None
+            self.group = group
+            self.user = user
+
+    # Отображения классов на таблицы создаются один раз на процесс
+    mapped = False
+
+    def __init__(self, clear_active=True, stats_flush_interval=1.0, stats_flush_messages=500, path='database/main.db',
+                 offline_limit=100, offline_retention=7 * 24 * 3600, offline_purge_interval=60.0,
+                 mmap_size=256 * 1024 * 1024):
+        # timeout - ожидание блокировки БД, если сервер запущен в несколько процессов.
+        # Сервер работает с БД из потока StorageExecutor, а создает ее в главном потоке.
+        # БД в памяти существует только в своем подключении, поэтому оно одно на все потоки.
+        self.database_engine = create_engine(f'sqlite:///{path}', echo=False, pool_recycle=7200,
+                                             connect_args={'check_same_thread': False, 'timeout': 30},
+                                             poolclass=StaticPool if path == ':memory:' else None)
+        event.listen(self.database_engine, 'connect', sqlite_tuning(mmap_size))
         self.metadata = MetaData()
 
         # Таблица пользователей
@@ -102,6 +259,14 @@ class ServerStorage:
                          Column('contact', ForeignKey('Users.id'))
                          )
 
+        # Журнал изменений контактов
+        contact_changes = Table('Contact_changes', self.metadata,
+                                Column('id', Integer, primary_key=True),
+                                Column('user', ForeignKey('Users.id'), index=True),
+                                Column('contact', ForeignKey('Users.id')),
+                                Column('added', Boolean)
+                                )
+
         # Таблица истории пользователей
         users_history_table = Table('History', self.metadata,
                                     Column('id', Integer, primary_key=True),
@@ -110,22 +275,121 @@ class ServerStorage:
                                     Column('accepted', Integer)
                                     )
 
-        self.metadata.create_all(self.database_engine)
+        # Таблица сообщений для пользователей, которые не в сети
+        offline_messages_table = Table('Offline_messages', self.metadata,
+                                       Column('id', Integer, primary_key=True),
+                                       Column('recipient', ForeignKey('Users.id'), index=True),
+                                       Column('created', DateTime),
+                                       Column('payload', Text)
+                                       )
+
+        # Таблицы групп и их участников
+        groups_table = Table('Groups', self.metadata,
+                             Column('id', Integer, primary_key=True),
+                             Column('name', String(50), unique=True),
+                             Column('owner', ForeignKey('Users.id')),
+                             Column('created', DateTime)
+                             )
+        group_members_table = Table('Group_members', self.metadata,
+                                    Column('id', Integer, primary_key=True),
+                                    Column('group', ForeignKey('Groups.id'), index=True),
+                                    Column('user', ForeignKey('Users.id'))
+                                    )
 
-        # Отображения
-        mapper(self.AllUsers, users_table)
-        mapper(self.ActiveUsers, active_users_table)
-        mapper(self.LoginHistory, user_login_history)
-        mapper(self.UsersContacts, contacts)
-        mapper(self.UsersHistory, users_history_table)
+        # Журнал появился позже таблицы контактов: в существующей БД он начинается с текущих контактов
+        backfill_changes = inspect(self.database_engine).has_table('Contacts') and \
+            not inspect(self.database_engine).has_table('Contact_changes')
+        self.metadata.create_all(self.database_engine)
+        if backfill_changes:
+            with self.database_engine.begin() as connection:
+                connection.execute(contact_changes.insert().from_select(
+                    ['user', 'contact', 'added'],
+                    select(contacts.c.user, contacts.c.contact, literal(True)).order_by(contacts.c.id)))
+
+        # Отображения. Дочерние процессы воркеров получают их уже созданными
+        if not ServerStorage.mapped:
+            mapper(self.AllUsers, users_table)
+            mapper(self.ActiveUsers, active_users_table)
+            mapper(self.LoginHistory, user_login_history)
+            mapper(self.UsersContacts, contacts)
+            mapper(self.ContactChanges, contact_changes)
+            mapper(self.UsersHistory, users_history_table)
+            mapper(self.OfflineMessages, offline_messages_table)
+            mapper(self.ChatGroups, groups_table)
+            mapper(self.GroupMembers, group_members_table)
+            ServerStorage.mapped = True
 
         # Сессия
         Session = sessionmaker(bind=self.database_engine)
         self.session = Session()
 
+        # Статистика сообщений копится в памяти и записывается одной транзакцией
+        # раз в stats_flush_interval секунд или каждые stats_flush_messages сообщений.
+        # При аварийном завершении теряется не больше этого объема статистики.
+        self.stats_flush_interval = stats_flush_interval
+        self.stats_flush_messages = stats_flush_messages
+        self.sent_stats = Counter()
+        self.accepted_stats = Counter()
+        self.unflushed_messages = 0
+        self.stats_flushed_at = time.monotonic()
+        self.stats_flushes = 0
+
+        # Очередь сообщений каждого пользователя ограничена offline_limit сообщениями
+        # (при переполнении удаляются самые старые) и offline_retention секундами хранения.
+        # Просроченные сообщения удаляются раз в offline_purge_interval секунд.
+        self.offline_limit = offline_limit
+        self.offline_retention = datetime.timedelta(seconds=offline_retention)
+        self.offline_purge_interval = offline_purge_interval
+        self.offline_purged_at = time.monotonic()
+        self.offline_counters = Counter()
+        self.offline_latency_max = 0.0
+
+        # Кэш имен пользователей загружается один раз при запуске
+        self.directory = UserDirectory()
+        for name, user_id in self.session.query(self.AllUsers.name, self.AllUsers.id):
+            self.directory.add(name, user_id)
+
+        # Индекс групп загружается один раз при запуске
+        self.groups = GroupDirectory()
+        for group in self.session.query(self.ChatGroups):
+            self.reload_group(group.name)
+
         # Сервер запускается раньше клиентов, при запуске активных пользователей быть не должно.
-        self.session.query(self.ActiveUsers).delete()
-        self.session.commit()
+        # Воркеры не очищают таблицу: это делает основной процесс до их запуска.
+        if clear_active:
+            self.session.query(self.ActiveUsers).delete()
+            self.session.commit()
+
+    def user_id(self, username):
+        """
+        Функция получения ID пользователя по имени. Сначала ищет в кэше,
+        затем в БД (пользователя мог зарегистрировать другой воркер).
+        """
+        user_id = self.directory.get_id(username)
+        if user_id is None:
+            user = self.session.query(self.AllUsers.id).filter_by(name=username).first()
+            if user:
+                user_id = user.id
+                self.directory.add(username, user_id)
+        return user_id
+
+    def user_name(self, user_id):
+        """
+        Функция получения имени пользователя по ID, аналогично user_id
+        """
+        name = self.directory.get_name(user_id)
+        if name is None:
+            user = self.session.query(self.AllUsers.name).filter_by(id=user_id).first()
+            if user:
+                name = user.name
+                self.directory.add(name, user_id)
+        return name
+
+    def directory_stats(self):
+        """
+        Функция, возвращающая счетчики кэша имен пользователей
+        """
+        return self.directory.stats()
 
     def user_login(self, username, ip_address, port, password_hash):
         """
@@ -134,11 +398,10 @@ class ServerStorage:
         # считаем пользователя "хорошим", пока не сравинли пароли
         drop_user = False
         # Есть ли у нас такой пользователь
-        result = self.session.query(self.AllUsers).filter_by(name=username)
+        user = self.session.query(self.AllUsers).filter_by(name=username).first()
 
         # Если есть, добавляем время последнего входа
-        if result.count():
-            user = result.first()
+        if user:
             # сравниваем пароли
             if user.password_hash == password_hash:
                 print(f"пароли {username} совпадают")
@@ -155,6 +418,7 @@ class ServerStorage:
             self.session.add(user)
             # Коммитим, чтобы получить присвоенный ID
             self.session.commit()
+            self.directory.add(username, user.id)
             user_in_history = self.UsersHistory(user.id)
             self.session.add(user_in_history)
 
@@ -171,15 +435,18 @@ class ServerStorage:
 
         return drop_user
 
+    def rollback(self):
+        """
+        Функция отмены транзакции, прерванной ошибкой, чтобы следующие запросы к сессии выполнялись
+        """
+        self.session.rollback()
+
     def user_logout(self, username):
         """
         Функция выхода клиента из сессии
         """
-        # Изем выходящего в общей базе пользователей
-        user = self.session.query(self.AllUsers).filter_by(name=username).first()
-
-        # Удаляем его из таблицы активных пользователей.
-        self.session.query(self.ActiveUsers).filter_by(user=user.id).delete()
+        # Удаляем выходящего из таблицы активных пользователей.
+        self.session.query(self.ActiveUsers).filter_by(user=self.user_id(username)).delete()
 
         # Применяем изменения
         self.session.commit()
@@ -187,17 +454,207 @@ class ServerStorage:
     def process_message(self, sender, recipient):
         """
         Фиксация статистики отправки и получения сообщений.
+        Счетчики увеличиваются в памяти, в БД они попадают при сбросе (flush_stats).
+        """
+        self.sent_stats[sender] += 1
+        self.accepted_stats[recipient] += 1
+        self.unflushed_messages += 1
+        if self.unflushed_messages >= self.stats_flush_messages:
+            self.flush_stats()
+
+    def flush_stats_if_due(self):
+        """
+        Функция сброса статистики, если с прошлого сброса прошел заданный интервал
+        """
+        if self.unflushed_messages and time.monotonic() - self.stats_flushed_at >= self.stats_flush_interval:
+            self.flush_stats()
+
+    def flush_stats(self):
+        """
+        Функция записи накопленной статистики сообщений в БД одной транзакцией
+        """
+        if self.unflushed_messages:
+            # Приращение в самом UPDATE: воркеры, пишущие в ту же БД, не затирают счетчики друг друга
+            for name in set(self.sent_stats) | set(self.accepted_stats):
+                user_id = self.user_id(name)
+                if user_id is None:
+                    continue
+                self.session.query(self.UsersHistory).filter_by(user=user_id).update({
+                    self.UsersHistory.sent: self.UsersHistory.sent + self.sent_stats[name],
+                    self.UsersHistory.accepted: self.UsersHistory.accepted + self.accepted_stats[name],
+                }, synchronize_session=False)
+            self.session.commit()
+            self.sent_stats.clear()
+            self.accepted_stats.clear()
+            self.unflushed_messages = 0
+            self.stats_flushes += 1
+        self.stats_flushed_at = time.monotonic()
+
+    def store_offline(self, recipient, message):
+        """
+        Функция сохранения сообщения для пользователя, который не в сети.
+        Возвращает False, если такого пользователя нет.
+        """
+        recipient_id = self.user_id(recipient)
+        if recipient_id is None:
+            return False
+        self.session.add(self.OfflineMessages(recipient_id, datetime.datetime.now(),
+                                              json.dumps(message, ensure_ascii=False)))
+        self.trim_offline(recipient_id)
+        self.session.commit()
+        self.offline_counters['stored'] += 1
+        return True
+
+    def requeue_offline(self, recipient, entries):
+        """
+        Функция возврата невыданных сообщений в очередь пользователя. entries - пары
+        (время сохранения, сообщение) из take_offline: сообщения сохраняются с прежним временем,
+        поэтому срок хранения не продлевается, а порядок очереди не меняется.
         """
-        # Получаем ID отправителя и получателя
-        sender = self.session.query(self.AllUsers).filter_by(name=sender).first().id
-        recipient = self.session.query(self.AllUsers).filter_by(name=recipient).first().id
-        # Увеличиваем флаги сообщений
-        sender_row = self.session.query(self.UsersHistory).filter_by(user=sender).first()
-        sender_row.sent += 1
-        recipient_row = self.session.query(self.UsersHistory).filter_by(user=recipient).first()
-        recipient_row.accepted += 1
+        recipient_id = self.user_id(recipient)
+        if recipient_id is None:
+            return False
+        for created, message in entries:
+            self.session.add(self.OfflineMessages(recipient_id, created, json.dumps(message, ensure_ascii=False)))
+        self.trim_offline(recipient_id)
+        self.session.commit()
+        self.offline_counters['requeued'] += len(entries)
+        return True
+
+    def trim_offline(self, recipient_id):
+        # Переполненная очередь теряет самые старые сообщения
+        self.session.flush()
+        queue = self.session.query(self.OfflineMessages.id).filter_by(recipient=recipient_id)
+        overflow = queue.count() - self.offline_limit
+        if overflow > 0:
+            oldest = [row.id for row in queue.order_by(self.OfflineMessages.created, self.OfflineMessages.id)
+                      .limit(overflow)]
+            self.session.query(self.OfflineMessages).filter(self.OfflineMessages.id.in_(oldest)) \
+                .delete(synchronize_session=False)
+            self.offline_counters['dropped'] += overflow
+
+    def take_offline(self, username):
+        """
+        Функция выдачи сохраненных сообщений пользователя в порядке получения:
+        пары (время сохранения, сообщение), время нужно для возврата в очередь (requeue_offline).
+        Выданные и просроченные сообщения удаляются из БД.
+        """
+        recipient_id = self.user_id(username)
+        if recipient_id is None:
+            return []
+        now = datetime.datetime.now()
+        # Возвращенные в очередь сообщения получают новые id, порядок задает время сохранения
+        rows = self.session.query(self.OfflineMessages).filter_by(recipient=recipient_id) \
+            .order_by(self.OfflineMessages.created, self.OfflineMessages.id).all()
+        if not rows:
+            return []
+        messages = []
+        for row in rows:
+            if now - row.created > self.offline_retention:
+                self.offline_counters['expired'] += 1
+                continue
+            messages.append((row.created, json.loads(row.payload)))
+            # Задержка доставки - время от сохранения до выдачи
+            waited = (now - row.created).total_seconds()
+            self.offline_counters['delivered'] += 1
+            self.offline_counters['latency_total'] += waited
+            self.offline_latency_max = max(self.offline_latency_max, waited)
+        self.session.query(self.OfflineMessages).filter(
+            self.OfflineMessages.id.in_([row.id for row in rows])).delete(synchronize_session=False)
+        self.session.commit()
+        return messages
+
+    def purge_offline_if_due(self):
+        """
+        Функция удаления просроченных сообщений, если с прошлой очистки прошел заданный интервал
+        """
+        if time.monotonic() - self.offline_purged_at < self.offline_purge_interval:
+            return
+        expired = self.session.query(self.OfflineMessages).filter(
+            self.OfflineMessages.created < datetime.datetime.now() - self.offline_retention
+        ).delete(synchronize_session=False)
+        self.session.commit()
+        self.offline_counters['expired'] += expired
+        self.offline_purged_at = time.monotonic()
+
+    def offline_stats(self):
+        """
+        Функция, возвращающая счетчики очередей сообщений и задержку доставки в секундах
+        """
+        delivered = self.offline_counters['delivered']
+        return {
+            'stored': self.offline_counters['stored'],
+            'delivered': delivered,
+            'dropped': self.offline_counters['dropped'],
+            'requeued': self.offline_counters['requeued'],
+            'expired': self.offline_counters['expired'],
+            'latency_mean': self.offline_counters['latency_total'] / delivered if delivered else 0.0,
+            'latency_max': self.offline_latency_max,
+        }
+
+    def reload_group(self, name):
+        """
+        Функция загрузки группы и ее участников из БД в индекс
+        (группу мог создать или изменить другой воркер). Возвращает множество участников или None.
+        """
+        group = self.session.query(self.ChatGroups).filter_by(name=name).first()
+        if group is None:
+            return None
+        members = [self.user_name(member.user)
+                   for member in self.session.query(self.GroupMembers.user).filter_by(group=group.id)]
+        self.groups.add(name, group.id, members)
+        return self.groups.get_members(name)
+
+    def group_members(self, name):
+        """
+        Функция, возвращающая множество имен участников группы или None, если группы нет
+        """
+        members = self.groups.get_members(name)
+        if members is None:
+            members = self.reload_group(name)
+        return members
 
+    def create_group(self, name, owner):
+        """
+        Функция создания группы, создатель становится ее участником.
+        Возвращает False, если группа с таким именем уже есть.
+        """
+        if self.group_members(name) is not None:
+            return False
+        group = self.ChatGroups(name, self.user_id(owner))
+        self.session.add(group)
+        self.session.flush()
+        self.session.add(self.GroupMembers(group.id, self.user_id(owner)))
         self.session.commit()
+        self.groups.add(name, group.id, (owner,))
+        return True
+
+    def join_group(self, name, username):
+        """
+        Функция добавления пользователя в группу. Возвращает False, если группы нет.
+        """
+        members = self.group_members(name)
+        if members is None:
+            return False
+        if username not in members:
+            self.session.add(self.GroupMembers(self.groups.ids[name], self.user_id(username)))
+            self.session.commit()
+            self.groups.add_member(name, username)
+        return True
+
+    def leave_group(self, name, username):
+        """
+        Функция выхода пользователя из группы. Возвращает False, если группы нет.
+        """
+        members = self.group_members(name)
+        if members is None:
+            return False
+        if username in members:
+            self.session.query(self.GroupMembers).filter_by(
+                group=self.groups.ids[name], user=self.user_id(username)).delete()
+            self.session.commit()
+            self.groups.remove_member(name, username)
+        return True
 
     def add_contact(self, user, contact):
         """
@@ -205,16 +662,17 @@ class ServerStorage:
 
         """
         # Получаем ID участников операции
-        user = self.session.query(self.AllUsers).filter_by(name=user).first()
-        contact = self.session.query(self.AllUsers).filter_by(name=contact).first()
+        user = self.user_id(user)
+        contact = self.user_id(contact)
 
         # Проверяем что цель добавления существует
-        if not contact or self.session.query(self.UsersContacts).filter_by(user=user.id, contact=contact.id).count():
+        if not contact or self.session.query(self.UsersContacts).filter_by(user=user, contact=contact).count():
             return
 
         # Создаём объект и заносим его в базу
-        contact_row = self.UsersContacts(user.id, contact.id)
+        contact_row = self.UsersContacts(user, contact)
         self.session.add(contact_row)
+        self.session.add(self.ContactChanges(user, contact, True))
         self.session.commit()
 
     def remove_contact(self, user, contact):
@@ -222,18 +680,19 @@ class ServerStorage:
         Удаление контакта из БД
         """
         # Получаем ID
-        user = self.session.query(self.AllUsers).filter_by(name=user).first()
-        contact = self.session.query(self.AllUsers).filter_by(name=contact).first()
+        user = self.user_id(user)
+        contact = self.user_id(contact)
 
         # Проверяем что они на самом деле в контакте.
         if not contact:
             return
 
         # Удаляем требуемое
-        print(self.session.query(self.UsersContacts).filter(
-            self.UsersContacts.user == user.id,
-            self.UsersContacts.contact == contact.id
-        ).delete())
+        if self.session.query(self.UsersContacts).filter(
+            self.UsersContacts.user == user,
+            self.UsersContacts.contact == contact
+        ).delete():
+            self.session.add(self.ContactChanges(user, contact, False))
         self.session.commit()
 
     def users_list(self):
@@ -280,19 +739,51 @@ class ServerStorage:
         """
         Список контактов пользователя.
         """
-        user = self.session.query(self.AllUsers).filter_by(name=username).one()
-
-        query = self.session.query(self.UsersContacts, self.AllUsers.name). \
-            filter_by(user=user.id). \
-            join(self.AllUsers, self.UsersContacts.contact == self.AllUsers.id)
+        query = self.session.query(self.UsersContacts.contact).filter_by(user=self.user_id(username))
 
         # выбираем только имена пользователей (БД клиента не реляционная) и возвращаем их.
-        return [contact[1] for contact in query.all()]
+        return [self.user_name(contact.contact) for contact in query.all()]
+
+    def users_since(self, version):
+        """
+        Функция синхронизации списка пользователей. Пользователи не удаляются, а их ID растут,
+        поэтому версия списка - наибольший ID, а изменения с версии - пользователи с большим ID.
+        Возвращает (имена, новая версия, полный ли список). Полный список отдается клиенту
+        без версии или с версией, которой нет на сервере (например, после пересоздания БД).
+        """
+        latest = self.session.query(func.max(self.AllUsers.id)).scalar() or 0
+        full = not isinstance(version, int) or version <= 0 or version > latest
+        query = self.session.query(self.AllUsers.name)
+        if not full:
+            query = query.filter(self.AllUsers.id > version)
+        return [user.name for user in query.order_by(self.AllUsers.id)], latest, full
+
+    def contacts_since(self, username, version):
+        """
+        Функция синхронизации списка контактов по журналу изменений.
+        Возвращает (добавленные, удаленные, новая версия, полный ли список);
+        полный список - в тех же случаях, что и в users_since.
+        """
+        user_id = self.user_id(username)
+        latest = self.session.query(func.max(self.ContactChanges.id)) \
+            .filter(self.ContactChanges.user == user_id).scalar() or 0
+        if not isinstance(version, int) or version <= 0 or version > latest:
+            return self.get_contacts(username), [], latest, True
+        # Несколько изменений одного контакта сворачиваются в последнее
+        state = {}
+        for change in self.session.query(self.ContactChanges.contact, self.ContactChanges.added).filter(
+                self.ContactChanges.user == user_id, self.ContactChanges.id > version).order_by(self.ContactChanges.id):
+            state[change.contact] = change.added
+        added = [self.user_name(contact) for contact, is_added in state.items() if is_added]
+        removed = [self.user_name(contact) for contact, is_added in state.items() if not is_added]
+        return added, removed, latest, False
 
     def message_history(self):
         """
         Показывает историю сообщений для всех пользователей
         """
+        # Статистика, еще не записанная в БД, тоже должна попасть в ответ
+        self.flush_stats()
         query = self.session.query(
             self.AllUsers.name,
             self.AllUsers.last_login,
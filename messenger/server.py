@@ -2,28 +2,45 @@ import socket
 import sys
 import os
 import argparse
+import asyncio
+import multiprocessing
 import json
 import logging
-import select
+import selectors
+import shutil
+import signal
 import time
 import threading
 import configparser
-import hashlib
-import binascii
-from os.path import join, dirname
-from dotenv import load_dotenv
-from common.common_functions import get_message, send_message
+from collections import Counter
+from common.common_functions import encode_message, decode_message
+from common.binary_codec import JSON_FORMAT, choose_format
+from common.compression import ZLIB, negotiate_compression
+from common.framing import FrameDecoder, pack_frame
+from common.buffers import OutboundBuffer
+from common.auth import AuthPool
+from common.admission import LoginAdmission
+from common.presence import PresenceHub
+from common.timer_wheel import TimerWheel
+from common.connections import ConnectionRegistry, CONNECTED, AUTHENTICATING, ACTIVE
+from common.settings import load_settings
 from log.server_log_config import LOGGER
 from messenger.common.wrap import log
 from messenger.common.metaclass_server import ServerMaker
+from messenger.common.dispatch import action, NUMBER
 from messenger.database.storage import ServerStorage
+from messenger.database.executor import StorageExecutor
 from common.jim_variables import *
+from common.worker_link import WorkerLink
 
 SERVER_LOGGER = LOGGER
 
-# Оптимизация запросов к БД
-NEW_CONNECTION = False
-conflag_lock = threading.Lock()
+# Период служебных задач сервера (tick), секунды
+TICK_INTERVAL = 0.5
+
+# Колесо таймеров проверки активности клиентов: шаг в секундах и число ячеек
+WHEEL_RESOLUTION = 1.0
+WHEEL_SLOTS = 128
 
 
 class Port:
@@ -48,16 +65,45 @@ class Server(threading.Thread, metaclass=ServerMaker):
     # """
     port = Port()
 
-    def __init__(self, listen_address, listen_port, database):
+    def __init__(self, listen_address, listen_port, database, settings, link=None):
         # Параметры подключения
         self.addr = listen_address
         self.port = listen_port
-        # Очередь клиентов, сообщений, словарь сопоставления сокета и имени.
-        # Можно было брать активных пользователей для отправки клиенту из names
-        self.clients = []
+        self.settings = settings
+        # Реестр соединений: состояние каждого клиента с поиском по сокету, имени и адресу.
+        # Очередь сообщений для доставки.
+        self.connections = ConnectionRegistry()
         self.messages = []
-        self.names = {}
+        # Клиенты, у которых есть неотправленные данные
+        self.pending_output = set()
+        # Селектор цикла select создается в main_loop
+        self.selector = None
+        # Проверка паролей выполняется в пуле потоков. Пока она идет, соединение
+        # находится в состоянии ожидания входа, а имя пользователя зарезервировано.
+        self.auth_pool = AuthPool(settings.auth_workers, settings.auth_queue_size)
+        # Допуск входов: общее ведро токенов, ведра адресов и предел одновременных входов
+        self.admission = LoginAdmission(settings.login_rate, settings.login_burst, settings.login_ip_rate,
+                                        settings.login_ip_burst, settings.login_pending_limit)
+        # С БД работает отдельный поток, главный цикл только ставит запросы в его очередь
+        # и получает результаты через process_storage. Сам ServerStorage цикл не вызывает,
+        # читается только индекс групп (см. GroupDirectory).
         self.database = database
+        self.storage = StorageExecutor(database)
+        self.storage_reported_at = time.monotonic()
+        # Канал связи с другими воркерами, если сервер запущен в несколько процессов.
+        # В этом случае все воркеры слушают один порт (SO_REUSEPORT).
+        self.link = link
+        # Число доставленных сообщений групп, для оценки пропускной способности рассылки
+        self.group_deliveries = 0
+        # Подписки клиентов на вход и выход их контактов
+        self.presence = PresenceHub(settings.presence_window, settings.presence_subscription_limit)
+        # Проверка активности: у каждого соединения таймер в колесе. Данные от клиента только
+        # обновляют время last_seen, таймер проверяет его при срабатывании и переставляется.
+        self.liveness = TimerWheel(WHEEL_RESOLUTION, WHEEL_SLOTS, time.monotonic())
+        self.pings_sent = 0
+        self.evicted = 0
+        # Счетчики сжатия закрытых соединений, счетчики открытых добавляет compression_stats
+        self.compression_totals = Counter()
 
         super().__init__()
 
@@ -68,209 +114,1290 @@ class Server(threading.Thread, metaclass=ServerMaker):
 
         # Подготовка сокета
         transport = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if self.link:
+            transport.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
         transport.bind((self.addr, int(self.port)))
-        transport.settimeout(0.5)
+        transport.setblocking(False)
 
         # Прослушивание порта
         self.sock = transport
-        self.sock.listen(int(os.environ.get("MAX_CONNECTIONS")))
+        self.sock.listen(self.settings.max_connections)
 
     def main_loop(self):
         """
         Функция, осуществляющая главный цикл работы сервера
         """
         self.init_socket()
+        # Пул проверки паролей будит цикл через пару сокетов, чтобы ответ на вход
+        # не ждал истечения таймаута accept
+        self.wakeup, self.wakeup_writer = socket.socketpair()
+        self.wakeup_writer.setblocking(False)
+        self.auth_pool.notify = self.wake
+        self.storage.notify = self.wake
+        # Селектор (epoll в Linux) хранит интерес к событиям каждого сокета между итерациями,
+        # поэтому ожидание не зависит от числа соединений и номеров дескрипторов
+        self.selector = selectors.DefaultSelector()
+        self.selector.register(self.sock, selectors.EVENT_READ)
+        self.selector.register(self.wakeup, selectors.EVENT_READ)
+        if self.link:
+            self.selector.register(self.link, selectors.EVENT_READ)
         # Главный цикл программы.
+        ticked_at = time.monotonic()
+        while True:
+            # Ожидание любого события: нового соединения, данных от клиентов и других воркеров,
+            # результата проверки пароля или запроса к БД, готовности к записи клиентов
+            # с неотправленными данными (см. watch). Ожидание заканчивается к следующему шагу
+            # служебных задач или к сроку отправки изменений присутствия, если он раньше.
+            wake_at = ticked_at + TICK_INTERVAL
+            presence_due = self.presence.next_due()
+            if presence_due is not None:
+                wake_at = min(wake_at, presence_due)
+            timeout = max(0.0, wake_at - time.monotonic())
+            readable, writable = [], []
+            for key, events in self.selector.select(timeout):
+                if key.fileobj is self.sock:
+                    self.accept_clients()
+                elif key.fileobj is self.wakeup:
+                    self.wakeup.recv(4096)
+                elif key.fileobj is self.link:
+                    self.process_link()
+                else:
+                    if events & selectors.EVENT_READ:
+                        readable.append(key.fileobj)
+                    if events & selectors.EVENT_WRITE:
+                        writable.append(key.fileobj)
+
+            # Завершенные проверки паролей и запросы к БД
+            self.process_auth()
+            self.process_storage()
+
+            # Прием сообщений. Клиент мог быть отключен обработкой предыдущих событий.
+            for client_with_message in readable:
+                if client_with_message not in self.connections:
+                    continue
+                try:
+                    self.feed_client(client_with_message,
+                                     client_with_message.recv(self.settings.recv_buffer_length))
+                except Exception as e:
+                    print(e, 'строка 88')  # какая ошибка
+                    SERVER_LOGGER.info(f'{client_with_message.getpeername()} отключился.')
+                    self.remove_client(client_with_message)
+
+            # Обработка сообщений и накопленные изменения присутствия
+            self.route_messages()
+            self.push_presence()
+
+            # Отправка накопленных данных сокетам, готовым к записи. Сокеты, получившие данные
+            # на этой итерации, становятся готовыми к записи сразу, на следующем ожидании.
+            # Неблокирующий сокет принимает столько, сколько может.
+            for client in writable:
+                self.flush_client(client)
+
+            # Служебные задачи - раз в TICK_INTERVAL, сколько бы событий ни пришло
+            if time.monotonic() - ticked_at >= TICK_INTERVAL:
+                self.tick()
+                ticked_at = time.monotonic()
+
+    def accept_clients(self):
+        """
+        Функция приема всех ожидающих соединений
+        """
         while True:
             try:
                 client, client_address = self.sock.accept()
             except OSError:
+                return
+            SERVER_LOGGER.info(f'Соединение {client_address} с установлено')
+            client.setblocking(False)
+            self.add_client(client, client_address, OutboundBuffer(self.settings.outbound_high_watermark,
+                                                                   self.settings.outbound_low_watermark,
+                                                                   self.settings.outbound_limit))
+
+    def add_client(self, client, address, buffer=None):
+        """
+        Функция регистрации нового соединения: реестр, таймер проверки активности, селектор
+        """
+        connection = self.connections.add(client, address, FrameDecoder(), buffer)
+        self.liveness.schedule(client, self.settings.heartbeat_interval)
+        self.watch(connection)
+        return connection
+
+    def watch(self, connection):
+        """
+        Функция обновления событий сокета клиента в селекторе: чтение, если чтение от клиента
+        не приостановлено из-за перегруженных получателей, запись, если есть неотправленные
+        данные. Без селектора (asyncio, бенчмарки) ничего не делает.
+        """
+        if self.selector is None or self.connections.get(connection.sock) is not connection:
+            return
+        events = (0 if connection.blocked else selectors.EVENT_READ) | \
+            (selectors.EVENT_WRITE if connection.sock in self.pending_output else 0)
+        if events == connection.events:
+            return
+        if not connection.events:
+            self.selector.register(connection.sock, events)
+        elif not events:
+            self.selector.unregister(connection.sock)
+        else:
+            self.selector.modify(connection.sock, events)
+        connection.events = events
+
+    def tick(self):
+        """
+        Функция периодических служебных задач сервера
+        """
+        # Отложенная запись статистики сообщений
+        self.storage.submit('flush_stats_if_due')
+        # Удаление просроченных сообщений для пользователей не в сети
+        self.storage.submit('purge_offline_if_due')
+        self.admission.prune_if_due()
+        # Клиенты, от которых давно не было данных
+        self.check_liveness()
+        # Отчет о работе сервера
+        if self.settings.storage_report_interval and \
+                time.monotonic() - self.storage_reported_at >= self.settings.storage_report_interval:
+            self.report()
+            self.storage_reported_at = time.monotonic()
+
+    def report(self):
+        """
+        Функция периодического отчета о работе сервера в журнал.
+        Счетчики по пользователям выводятся только при отладке.
+        """
+        SERVER_LOGGER.info(f'Поток БД: {self.storage.stats()}')
+        SERVER_LOGGER.info(f'Допуск входов: {self.admission.stats()}')
+        # Счетчики хранилища пишет поток БД, поэтому они читаются через его очередь
+        self.storage.submit('offline_stats',
+                            then=lambda stats, error: self.report_stored('Сообщения, полученные не в сети',
+                                                                         stats, error))
+        self.storage.submit('directory_stats',
+                            then=lambda stats, error: self.report_stored('Кэш имен пользователей', stats, error))
+        connections = self.connection_stats()
+        SERVER_LOGGER.info(f'Соединения: {len(self.connections)}, вошли: {len(connections)}, '
+                           f'приостановлены: {sum(stats["paused"] for stats in connections.values())}, '
+                           f'в буферах: {sum(stats["depth"] for stats in connections.values())} байт')
+        SERVER_LOGGER.debug(f'Соединения по пользователям: {connections}')
+        SERVER_LOGGER.info(f'Сжатие: {self.compression_stats() or "сжатых соединений не было"}')
+        SERVER_LOGGER.info(f'Доставлено сообщений групп: {self.group_deliveries}')
+        SERVER_LOGGER.info(f'Подписки на присутствие: {self.presence.stats()}')
+        SERVER_LOGGER.info(f'Проверка активности: отправлено PING {self.pings_sent}, '
+                           f'отключено молчащих клиентов {self.evicted}')
+
+    @staticmethod
+    def report_stored(title, stats, error):
+        """
+        Функция записи в журнал счетчиков, полученных из потока БД
+        """
+        if error is None:
+            SERVER_LOGGER.info(f'{title}: {stats}')
+
+    def feed_client(self, client, data):
+        """
+        Функция разбора прочитанных от клиента байт. Обрабатывает все полностью
+        полученные сообщения, неполное сообщение дочитывается при следующем событии.
+        """
+        if not data:
+            raise ConnectionError('Клиент закрыл соединение')
+        connection = self.connections.get(client)
+        connection.bytes_in += len(data)
+        connection.last_seen = time.monotonic()
+        for payload in connection.decoder.feed(data):
+            # Клиент мог быть отключен обработкой предыдущего сообщения
+            if client not in self.connections:
+                break
+            connection.messages_in += 1
+            if connection.compression:
+                payload = connection.compression.decompress(payload)
+            # Сообщение больше буфера исходящих данных не может быть доставлено ни одному получателю
+            if len(payload) > self.settings.outbound_limit:
+                SERVER_LOGGER.warning(f'Сообщение {len(payload)} байт от {connection.name or connection.address} '
+                                      f'отклонено: больше предела {self.settings.outbound_limit}.')
+                self.respond(client, {}, {RESPONSE: 413, ERROR: 'Сообщение слишком велико.'})
+                continue
+            self.process_client_message(decode_message(payload, self.settings), client)
+
+    def send_to(self, client, message):
+        """
+        Функция отправки сообщения клиенту в том же режиме (кадры или сырой JSON),
+        в котором клиент передает сообщения серверу, и в согласованном при входе формате
+        """
+        connection = self.connections.get(client)
+        self.write_to(client, self.encode_for(connection, message))
+        if connection:
+            connection.messages_out += 1
+
+    def respond(self, client, request, response):
+        """
+        Функция отправки ответа на запрос. Ответ повторяет REQUEST_ID запроса,
+        чтобы клиент мог сопоставить его с запросом, не дожидаясь ответов по порядку.
+        """
+        # Клиент мог отключиться, пока выполнялся запрос к БД
+        if client not in self.connections:
+            return
+        if REQUEST_ID in request:
+            response[REQUEST_ID] = request[REQUEST_ID]
+        self.send_to(client, response)
+
+    def encode_for(self, connection, message):
+        """
+        Функция кодирования сообщения для соединения: формат, сжатие и кадр
+        """
+        data = encode_message(message, self.settings, connection.wire_format if connection else JSON_FORMAT)
+        if connection and connection.compression:
+            data = connection.compression.compress(data)
+        if connection and connection.decoder.framed:
+            data = pack_frame(data)
+        return data
+
+    def encode_shared(self, connection, message, cache):
+        """
+        Функция кодирования сообщения для рассылки многим получателям. Сообщение
+        сериализуется один раз на формат, и всем получателям с одинаковым форматом
+        и режимом кадров пишутся одни и те же байты. Сжатие выполняется для каждого
+        получателя отдельно: у каждого соединения свой контекст deflate.
+        """
+        payload = cache.get(connection.wire_format)
+        if payload is None:
+            payload = cache[connection.wire_format] = encode_message(message, self.settings, connection.wire_format)
+        if connection.compression:
+            data = connection.compression.compress(payload)
+            return pack_frame(data) if connection.decoder.framed else data
+        key = (connection.wire_format, connection.decoder.framed)
+        data = cache.get(key)
+        if data is None:
+            data = cache[key] = pack_frame(payload) if connection.decoder.framed else payload
+        return data
+
+    def with_group(self, name, then):
+        """
+        Функция передачи then множества участников группы. Индекс групп читается
+        без обращения к потоку БД, группу, которой еще нет в индексе, загружает поток БД.
+        """
+        members = self.database.groups.get_members(name)
+        if members is not None:
+            then(members)
+        else:
+            self.storage.submit('group_members', name, then=lambda members, error: then(members or set()))
+
+    def deliver_group(self, message, members):
+        """
+        Функция рассылки сообщения группы участникам, подключенным к этому воркеру.
+        Возвращает число получателей.
+        """
+        cache = {}
+        delivered = 0
+        for name in members:
+            if name == message[SENDER]:
+                continue
+            recipient = self.connections.active(name)
+            if recipient is None:
+                continue
+            try:
+                self.write_to(recipient.sock, self.encode_shared(recipient, message, cache))
+            except BufferError as e:
+                # Не доставлено только это сообщение, соединение получателя остается
+                SERVER_LOGGER.warning(f'Сообщение группы {message[GROUP]} не помещается в буфер {name}: {e}')
+                continue
+            except Exception as e:
+                SERVER_LOGGER.info(f'Связь с {name} была потеряна. Ошибка: {e}')
+                self.remove_client(recipient.sock)
+                recipient.sock.close()
+                continue
+            recipient.messages_out += 1
+            delivered += 1
+            self.throttle(message[SENDER], recipient.sock)
+        self.group_deliveries += delivered
+        return delivered
+
+    def process_group_message(self, message):
+        """
+        Функция обработки сообщения группы: рассылка своим участникам и пересылка
+        по одному разу каждому воркеру, к которому подключены другие участники.
+        Участники не в сети сообщение группы не получают.
+        """
+        def fan_out(members):
+            delivered = self.deliver_group(message, members)
+            if self.link:
+                workers = {self.link.locations[name] for name in members if name in self.link.locations}
+                for worker in workers:
+                    if not self.link.send(worker, message):
+                        SERVER_LOGGER.warning(f'Сообщение группы {message[GROUP]} не передано воркеру {worker}.')
+            SERVER_LOGGER.debug(f'Сообщение группы {message[GROUP]} от {message[SENDER]} '
+                                f'доставлено участникам: {delivered}')
+
+        self.with_group(message[GROUP], fan_out)
+
+    def deliver_offline(self, connection, entries):
+        """
+        Функция доставки сообщений, сохраненных, пока пользователь был не в сети
+        (entries - пары (время сохранения, сообщение) из take_offline).
+        Все сообщения кодируются в кадры и ставятся в буфер одной записью.
+        Невыданные сообщения (клиент отключился или буфер переполнен) возвращаются в очередь в БД.
+        """
+        if not entries:
+            return
+        # Пользователь мог отключиться, пока сообщения выбирались из БД - они возвращаются в очередь
+        if self.connections.get(connection.sock) is not connection:
+            self.store_offline_again(connection.name, entries)
+            return
+        messages = [message for created, message in entries]
+        if connection.decoder.framed:
+            try:
+                self.write_to(connection.sock, b''.join(self.encode_for(connection, message) for message in messages))
+            except BufferError:
+                # Одной записью не помещаются - ставятся по одному, сколько поместится
                 pass
             else:
-                SERVER_LOGGER.info(f'Соединение {client_address} с установлено')
-                self.clients.append(client)
+                connection.messages_out += len(messages)
+                SERVER_LOGGER.info(f'Пользователю {connection.name} доставлено сообщений, '
+                                   f'полученных не в сети: {len(messages)}')
+                return
+        # Без кадров границы сообщений теряются, такие клиенты получают по одному сообщению за запись.
+        # Не поместившиеся в буфер сообщения остаются в БД до следующего входа.
+        for number, message in enumerate(messages):
+            try:
+                self.send_to(connection.sock, message)
+            except BufferError as e:
+                SERVER_LOGGER.warning(f'Сообщения, полученные не в сети, не помещаются в буфер {connection.name}: {e}')
+                self.store_offline_again(connection.name, entries[number:])
+                return
+        SERVER_LOGGER.info(f'Пользователю {connection.name} доставлено сообщений, '
+                           f'полученных не в сети: {len(messages)}')
 
-            # Списки клиентов в очереди
-            recv_data_list = []
-            send_data_list = []
-            error_list = []
+    def store_offline_again(self, name, entries):
+        """
+        Функция возврата невыданных сообщений в очередь пользователя в БД
+        с прежним временем сохранения и на прежнее место в очереди
+        """
+        SERVER_LOGGER.info(f'Пользователю {name} возвращено в очередь сообщений: {len(entries)}')
+        self.storage.submit('requeue_offline', name, entries)
 
-            # Есть ли клиенты в состоянии ожидания
-            try:
-                if self.clients:
-                    recv_data_list, send_data_list, error_list = select.select(self.clients, self.clients, [], 0)
-            except OSError as e:
-                SERVER_LOGGER.error(f'Ошибка работы с сокетами: {e}')
-
-            # Прием сообщений.
-            if recv_data_list:
-                for client_with_message in recv_data_list:
-                    try:
-                        self.process_client_message(get_message(client_with_message), client_with_message)
-                    except Exception as e:
-                        print(e, 'строка 88')  # какая ошибка
-                        SERVER_LOGGER.info(f'{client_with_message.getpeername()} отключился.')
-
-                        # Удаляем клиента из базы активных пользователей
-                        for name in self.names:
-                            if self.names[name] == client_with_message:
-                                self.database.user_logout(name)
-                                del self.names[name]
-                                break
-
-                        self.clients.remove(client_with_message)
-
-            # Обработка сообщений
-            for message in self.messages:
+    def write_to(self, client, data):
+        """
+        Функция постановки данных в буфер исходящих сообщений клиента.
+        При переполнении буфера выбрасывает BufferError.
+        """
+        connection = self.connections.get(client)
+        connection.buffer.write(data)
+        if client not in self.pending_output:
+            self.pending_output.add(client)
+            self.watch(connection)
+
+    def flush_client(self, client):
+        """
+        Функция отправки накопленных данных клиенту. Когда буфер получателя
+        разгружается ниже нижнего порога, чтение от его отправителей возобновляется.
+        """
+        connection = self.connections.get(client)
+        if connection is None:
+            self.pending_output.discard(client)
+            return
+        try:
+            if connection.buffer.flush(client):
+                self.pending_output.discard(client)
+                self.watch(connection)
+        except OSError as e:
+            SERVER_LOGGER.info(f'Связь с клиентом потеряна при отправке. Ошибка: {e}')
+            self.remove_client(client)
+            client.close()
+            return
+        if connection.buffer.is_drained():
+            self.resume_senders(connection)
+
+    def throttle(self, sender_name, recipient):
+        """
+        Функция приостановки чтения от отправителя, если буфер получателя
+        превысил верхний порог
+        """
+        recipient = self.connections.get(recipient)
+        sender = self.connections.active(sender_name)
+        if not recipient.buffer.is_congested() or sender is None:
+            return
+        if sender not in recipient.paused:
+            recipient.paused.add(sender)
+            sender.blocked += 1
+            self.watch(sender)
+            SERVER_LOGGER.debug(f'Чтение от {sender_name} приостановлено: получатель не успевает принимать.')
+
+    def resume_senders(self, recipient):
+        """
+        Функция возобновления чтения от отправителей, приостановленных из-за получателя
+        """
+        for sender in recipient.paused:
+            sender.blocked -= 1
+            self.watch(sender)
+        recipient.paused.clear()
+
+    def connection_stats(self):
+        """
+        Функция, возвращающая счетчики соединений по именам пользователей
+        """
+        return {connection.name: dict(connection.buffer.stats(), **connection.stats())
+                for connection in self.connections if connection.state == ACTIVE}
+
+    def compression_stats(self):
+        """
+        Функция, возвращающая счетчики сжатия сервера: закрытых и открытых соединений
+        """
+        totals = Counter(self.compression_totals)
+        for connection in self.connections:
+            if connection.compression:
+                totals.update(connection.compression.stats())
+        return dict(totals)
+
+    def forget_client(self, client):
+        """
+        Функция удаления служебных данных клиента: записи в реестре, приостановок
+        """
+        connection = self.connections.remove(client)
+        self.pending_output.discard(client)
+        self.liveness.cancel(client)
+        if connection is not None:
+            if connection.compression:
+                self.compression_totals.update(connection.compression.stats())
+            if connection.events:
+                self.selector.unregister(client)
+                connection.events = 0
+            self.resume_senders(connection)
+
+    def check_liveness(self):
+        """
+        Функция проверки клиентов, таймеры которых сработали. Клиенту, молчащему
+        heartbeat_interval секунд, отправляется PING (любой ответ подтверждает, что он жив),
+        клиент, молчащий idle_timeout секунд, отключается, а его выход записывается в БД.
+        Просматриваются только сработавшие таймеры, а не все соединения.
+        """
+        now = time.monotonic()
+        for client in self.liveness.advance(now):
+            connection = self.connections.get(client)
+            if connection is None:
+                continue
+            idle = now - connection.last_seen
+            if idle >= self.settings.idle_timeout:
+                SERVER_LOGGER.info(f'Клиент {connection.name or connection.address} не отвечает '
+                                   f'{idle:.0f} с. и отключен.')
+                self.evicted += 1
+                self.remove_client(client)
+                client.close()
+                continue
+            if idle >= self.settings.heartbeat_interval and connection.state == ACTIVE:
                 try:
-                    self.process_message(message, send_data_list)
-                except Exception as e:
-                    SERVER_LOGGER.info(f'Связь с {message[DESTINATION]} была потеряна. Ошибка: {e}')
-                    self.clients.remove(self.names[message[DESTINATION]])
-                    del self.names[message[DESTINATION]]
-            self.messages.clear()
+                    self.send_to(client, {ACTION: PING, TIME: time.time()})
+                except BufferError:
+                    # Буфер переполнен - клиент все равно не принимает данные
+                    self.remove_client(client)
+                    client.close()
+                    continue
+                self.pings_sent += 1
+            # Следующая проверка - когда истечет интервал с последних данных или срок отключения
+            deadline = self.settings.heartbeat_interval if idle >= self.settings.heartbeat_interval \
+                else self.settings.heartbeat_interval - idle
+            self.liveness.schedule(client, min(deadline, self.settings.idle_timeout - idle))
+
+    def close_client(self, client):
+        """
+        Функция закрытия соединения с клиентом по инициативе сервера.
+        Перед закрытием отправляется то, что осталось в буфере (например, ответ с ошибкой).
+        """
+        connection = self.connections.get(client)
+        if connection is not None and connection.buffer is not None:
+            try:
+                connection.buffer.flush(client)
+            except OSError:
+                pass
+        self.forget_client(client)
+        client.close()
+
+    def remove_client(self, client):
+        """
+        Функция удаления отключившегося клиента из очереди и из базы активных пользователей
+        """
+        connection = self.connections.get(client)
+        if connection is not None and connection.state == ACTIVE:
+            self.storage.submit('user_logout', connection.name)
+            self.announce(WORKER_LEAVE, connection.name)
+            self.presence.unsubscribe(connection.name)
+            self.presence_changed(connection.name, False)
+        self.forget_client(client)
+
+    def route_messages(self):
+        """
+        Функция постановки накопленных сообщений в буферы получателей
+        """
+        for message in self.messages:
+            if message[ACTION] == GROUP_MESSAGE:
+                self.process_group_message(message)
+                continue
+            try:
+                self.process_message(message)
+            except Exception as e:
+                SERVER_LOGGER.info(f'Связь с {message[DESTINATION]} была потеряна. Ошибка: {e}')
+                recipient = self.connections.active(message[DESTINATION])
+                if recipient is not None:
+                    self.remove_client(recipient.sock)
+                    recipient.sock.close()
+        self.messages.clear()
+
+    def wake(self):
+        """
+        Функция пробуждения главного цикла из потока пула проверки паролей
+        """
+        try:
+            self.wakeup_writer.send(b'\0')
+        except BlockingIOError:
+            pass
+
+    def process_auth(self):
+        """
+        Функция завершения входа пользователей, пароли которых уже проверены пулом.
+        Ошибка обработки одного входа не прерывает главный цикл.
+        """
+        for context, password_hash, error in self.auth_pool.completed():
+            try:
+                if error is not None:
+                    self.reject_login(context[0], context[1], context[6], error)
+                else:
+                    self.finish_login(*context, password_hash)
+            except Exception as e:
+                SERVER_LOGGER.error(f'Ошибка завершения входа {context[0]}: {e}')
+
+    def reject_login(self, name, client, request, error):
+        """
+        Функция отказа во входе, пароль которого не удалось хешировать: ответ 400
+        и закрытие соединения, если клиент еще ожидает входа
+        """
+        self.admission.finished()
+        SERVER_LOGGER.error(f'Пароль клиента {name} не удалось проверить: {error}')
+        connection = self.connections.find(name)
+        if connection is None or connection.sock is not client or connection.state != AUTHENTICATING:
+            return
+        self.respond(client, request, {RESPONSE: 400, ERROR: 'Некорректный пароль.'})
+        self.close_client(client)
+
+    def process_storage(self):
+        """
+        Функция передачи готовых результатов запросов к БД ожидающим их обработчикам.
+        Обработчик получает результат и ошибку: при ошибке БД - None и исключение,
+        иначе - результат и None. Ошибка обработчика не прерывает главный цикл.
+        """
+        for then, future in self.storage.completed():
+            error = future.exception()
+            if error is not None:
+                SERVER_LOGGER.error(f'Ошибка работы с БД: {error}')
+            try:
+                then(None if error is not None else future.result(), error)
+            except Exception as e:
+                SERVER_LOGGER.error(f'Ошибка обработки результата запроса к БД: {e}')
+
+    def respond_stored(self, client, request, error, response):
+        """
+        Функция ответа на запрос, выполненный в потоке БД. При ошибке БД клиент
+        получает ответ 500 вместо response.
+        """
+        if error is not None:
+            response = {RESPONSE: 500, ERROR: 'Ошибка сервера, повторите запрос позже.'}
+        self.respond(client, request, response)
+
+    def finish_login(self, name, client, client_ip, client_port, wire_format, compression, request,
+                     password_hash):
+        """
+        Функция регистрации входа пользователя после хеширования пароля
+        """
+        # Клиент мог отключиться, пока проверялся пароль
+        connection = self.connections.find(name)
+        if connection is None or connection.sock is not client or connection.state != AUTHENTICATING:
+            self.admission.finished()
+            return
+        # Сравнение с хешем в БД и запись входа - в потоке БД, соединение пока ожидает входа
+        self.storage.submit('user_login', name, client_ip, client_port, password_hash,
+                            then=lambda drop_user, error: self.complete_login(connection, wire_format, compression,
+                                                                              request, drop_user, error))
+
+    def complete_login(self, connection, wire_format, compression, request, drop_user, error):
+        """
+        Функция завершения входа после записи в БД: ответ клиенту и выдача сообщений,
+        полученных, пока пользователь был не в сети. При ошибке БД вход не выполняется.
+        """
+        self.admission.finished()
+        name, client = connection.name, connection.sock
+        # Клиент мог отключиться, пока выполнялась запись входа
+        if self.connections.get(client) is not connection:
+            if error is not None or not drop_user:
+                self.storage.submit('user_logout', name)
+            return
+        if error is not None:
+            self.respond(client, request, {RESPONSE: 500, ERROR: 'Ошибка сервера, повторите вход позже.'})
+            self.close_client(client)
+            SERVER_LOGGER.error(f'Вход клиента {name} не выполнен из-за ошибки БД, клиент отключен.')
+            return
+        if drop_user:
+            response = {RESPONSE: 400, ERROR: 'Неверный пароль! Вы будете отключены.'}
+            self.respond(client, request, response)
+            self.close_client(client)
+            SERVER_LOGGER.error(f'Клиент {name} неправильно ввел пароль и был отключен.')
+            return
+        SERVER_LOGGER.info(f"В базе данных зарегистрирован пользователь {client}")
+
+        self.connections.activate(connection)
+        self.announce(WORKER_JOIN, name)
+        self.presence_changed(name, True)
+        # Ответ на вход еще в JSON и без сжатия, следующие сообщения - в выбранном формате
+        self.respond(client, request, {RESPONSE: 200, FORMAT: wire_format,
+                                       COMPRESSION: ZLIB if compression else None})
+        connection.wire_format = wire_format
+        connection.compression = compression
+        # Сообщения, сохраненные до активации соединения, выбираются после них (очередь БД упорядочена)
+        self.storage.submit('take_offline', name,
+                            then=lambda entries, error: self.deliver_offline(connection, entries))
+
+    def announce(self, action, name):
+        """
+        Функция оповещения других воркеров о входе или выходе пользователя этого воркера
+        """
+        if self.link:
+            self.link.broadcast({ACTION: action, ACCOUNT_NAME: name, WORKER: self.link.worker_id})
+
+    def announce_group(self, name):
+        """
+        Функция оповещения других воркеров об изменении состава группы
+        """
+        if self.link:
+            self.link.broadcast({ACTION: GROUP_UPDATE, GROUP: name})
+
+    def is_online(self, name):
+        """
+        Функция проверки, что пользователь в сети на этом или другом воркере
+        """
+        return self.connections.active(name) is not None or bool(self.link and name in self.link.locations)
+
+    def presence_changed(self, name, online):
+        """
+        Функция регистрации входа или выхода пользователя для его подписчиков
+        """
+        if self.presence.changed(name, online):
+            self.schedule_presence()
+
+    def schedule_presence(self):
+        # Цикл select проверяет накопленные изменения на каждой итерации
+        # и ждет событий не дольше срока их отправки (PresenceHub.next_due)
+        pass
+
+    def push_presence(self):
+        """
+        Функция отправки подписчикам изменений присутствия, интервал накопления которых истек
+        """
+        for subscriber, online, offline in self.presence.due():
+            connection = self.connections.active(subscriber)
+            if connection is None:
+                continue
+            try:
+                self.send_to(connection.sock, {ACTION: PRESENCE_UPDATE, TIME: time.time(),
+                                               ONLINE: online, OFFLINE: offline})
+            except BufferError as e:
+                SERVER_LOGGER.info(f'Связь с {subscriber} была потеряна. Ошибка: {e}')
+                self.remove_client(connection.sock)
+                connection.sock.close()
+
+    def process_link(self):
+        """
+        Функция обработки сообщений от других воркеров: входы и выходы пользователей,
+        а также пересланные сообщения для пользователей этого воркера.
+        """
+        for data in self.link.receive():
+            try:
+                message = decode_message(data, self.settings)
+                message[ACTION]
+            except (ValueError, TypeError, KeyError) as e:
+                SERVER_LOGGER.error(f'Получено некорректное сообщение от другого воркера: {e}')
+                continue
+            if message[ACTION] == WORKER_JOIN:
+                self.link.locations[message[ACCOUNT_NAME]] = message[WORKER]
+                self.presence_changed(message[ACCOUNT_NAME], True)
+            elif message[ACTION] == WORKER_LEAVE:
+                if self.link.locations.get(message[ACCOUNT_NAME]) == message[WORKER]:
+                    del self.link.locations[message[ACCOUNT_NAME]]
+                    self.presence_changed(message[ACCOUNT_NAME], False)
+            elif message[ACTION] == MESSAGE and self.connections.active(message[DESTINATION]):
+                self.messages.append(message)
+            elif message[ACTION] == GROUP_MESSAGE:
+                self.with_group(message[GROUP], lambda members, message=message: self.deliver_group(message, members))
+            # Группу изменили на другом воркере
+            elif message[ACTION] == GROUP_UPDATE:
+                self.storage.submit('reload_group', message[GROUP])
+            # Получатель успел отключиться от этого воркера
+            elif message[ACTION] == MESSAGE:
+                self.storage.submit('store_offline', message[DESTINATION], message)
+            else:
+                SERVER_LOGGER.error(f'Получено некорректное сообщение от другого воркера: {message}')
 
     @log
-    def process_message(self, message, listen_socks):
+    def process_message(self, message):
         '''
         Функкция обработки сообщений между клиентами. Является фильтром-фалибатором операции.
         '''
-        if message[DESTINATION] in self.names and self.names[message[DESTINATION]] in listen_socks:
-            send_message(self.names[message[DESTINATION]], message)
-            SERVER_LOGGER.info(f'Отправлено сообщение пользователю {message[DESTINATION]}\
+        recipient = self.connections.active(message[DESTINATION])
+        # Получатель подключен к другому воркеру - пересылаем сообщение ему
+        if recipient is None and self.link and message[DESTINATION] in self.link.locations:
+            worker = self.link.locations[message[DESTINATION]]
+            if self.link.send(worker, message):
+                SERVER_LOGGER.info(f'Сообщение пользователю {message[DESTINATION]} передано воркеру {worker}.')
+                return
+            # Сообщение слишком велико или воркер не принимает - доставка при следующем входе
+            SERVER_LOGGER.warning(f'Сообщение пользователю {message[DESTINATION]} не передано воркеру '
+                                  f'{worker} и будет сохранено.')
+        if recipient is not None:
+            try:
+                self.send_to(recipient.sock, message)
+            except BufferError as e:
+                # Не доставлено только это сообщение: оно сохраняется до следующего входа получателя,
+                # соединение получателя остается
+                SERVER_LOGGER.warning(f'Сообщение пользователю {message[DESTINATION]} не помещается '
+                                      f'в буфер и будет сохранено: {e}')
+            else:
+                SERVER_LOGGER.info(f'Отправлено сообщение пользователю {message[DESTINATION]}\
             от пользователя {message[SENDER]}.')
-        if message[DESTINATION] in self.names and self.names[message[DESTINATION]] not in listen_socks:
-            raise ConnectionError
+                self.throttle(message[SENDER], recipient.sock)
+                return
+        # Получатель не в сети (или сообщение не доставлено) - доставка при его следующем входе
+        self.storage.submit('store_offline', message[DESTINATION], message,
+                            then=lambda stored, error: self.log_offline(message, stored, error))
+
+    def log_offline(self, message, stored, error):
+        if error is not None:
+            SERVER_LOGGER.error(f'Сообщение пользователю {message[DESTINATION]} от {message[SENDER]} '
+                                f'не сохранено из-за ошибки БД.')
+        elif stored:
+            SERVER_LOGGER.info(f'Пользователь {message[DESTINATION]} не в сети, сообщение от '
+                               f'{message[SENDER]} сохранено до его подключения.')
         else:
             SERVER_LOGGER.error(
                 f'Пользователь {message[DESTINATION]} не зарегистрирован на сервере, '
                 f'отправка сообщения невозможна.')
 
+    def is_user(self, client, name):
+        """
+        Функция проверки, что пользователь name вошел именно с этого соединения
+        """
+        connection = self.connections.active(name)
+        return connection is not None and connection.sock is client
+
     @log
     def process_client_message(self, message, client):
         '''
-        Обработка сообщейний от клиентов. Разбирает действие (ACTION),
-        проверяет полноценность предоставленных данных
-        и запускает соответствующие тому или иному действию функции.
+        Обработка сообщейний от клиентов. Находит обработчик действия (ACTION),
+        проверяет полноценность предоставленных данных и владельца запроса
+        и запускает обработчик. Некорректный запрос получает один ответ 400.
         '''
-
-        global NEW_CONNECTION
         SERVER_LOGGER.debug(f'Получено сообщение от клиента: {message}')
 
-        # Для сообщение о присутствии и проверки пароля
-        if ACTION in message and message[
-            ACTION] == PRESENCE and TIME in message and CHAT_USER in message and PASSWORD in message:
-            # Пользователь не зарегестрирован в текущей сессии.
-            if message[CHAT_USER][ACCOUNT_NAME] not in self.names.keys():
-                self.names[message[CHAT_USER][ACCOUNT_NAME]] = client
-                send_message(client, {RESPONSE: 200})
-                client_ip, client_port = client.getpeername()
-                password = message[PASSWORD]
-                salt = message[CHAT_USER][ACCOUNT_NAME]
-                password_hash = binascii.hexlify(
-                    hashlib.pbkdf2_hmac('sha256', bytes(password, 'utf-8'), bytes(salt, 'utf-8'), 100000))
+        # Клиент ожидает результата проверки пароля, другие запросы до входа не принимаются
+        connection = self.connections.get(client)
+        if connection.state == AUTHENTICATING:
+            self.respond(client, message, {RESPONSE: 400, ERROR: 'Вход еще не завершен.'})
+            return
 
-                try:
-                    if self.database.user_login(message[CHAT_USER][ACCOUNT_NAME], client_ip, client_port,
-                                                password_hash):
-                        response = {RESPONSE: 400, ERROR: 'Неверный пароль! Вы будете отключены.'}
-                        send_message(client, response)
-                        self.clients.remove(client)
-                        client.close()
-                        SERVER_LOGGER.error(
-                            f'Клиент {message[CHAT_USER][ACCOUNT_NAME]} неправильно ввел пароль и был отключен.')
-                    else:
-                        SERVER_LOGGER.info(f"В базе данных зарегистрирован пользователь {client}")
-                except Exception as err:
-                    print(err)
-                    print(f'Пользователь {client} уже зарегестрирован в базе данных')
-                with conflag_lock:
-                    NEW_CONNECTION = True
-
-            # Пользователь зарегестрирован в текущей сессии
-            else:
-                response = {RESPONSE: 400, ERROR: None}
-                response[ERROR] = 'Это имя уже занято'
-                send_message(client, response)
-                self.clients.remove(client)
-                client.close()
+        action = message.get(ACTION)
+        handler = self.handlers.get(action) if isinstance(action, str) else None
+        if handler is None or not handler.accepts(message) or \
+                handler.owner and not self.is_user(client, message[handler.owner]):
+            self.respond(client, message, {RESPONSE: 400, ERROR: 'Запрос некорректен.'})
             return
-        # Для сообщений с содержимым для другого пользователя
-        if ACTION in message and message[
-            ACTION] == MESSAGE and DESTINATION in message and TIME in message and SENDER in message and \
-                MESSAGE_TEXT in message and self.names[message[SENDER]] == client:
-            self.messages.append(message)
-            # Отправляем в БД информацию для статистики передачи сообщений
-            self.database.process_message(message[SENDER], message[DESTINATION])
+        handler.method(self, message, client)
+
+    @action(PRESENCE, (TIME, NUMBER), (CHAT_USER, {ACCOUNT_NAME: str}), (PASSWORD, str))
+    def process_presence(self, message, client):
+        """
+        Обработчик сообщения о присутствии: проверка имени и постановка пароля на проверку
+        """
+        connection = self.connections.get(client)
+        # С соединения, уже выполнившего вход, повторный вход (в том числе под другим именем) не принимается
+        if connection.state != CONNECTED:
+            self.respond(client, message, {RESPONSE: 400, ERROR: 'Вход уже выполнен.'})
+            return
+        name = message[CHAT_USER][ACCOUNT_NAME]
+        # Пользователь зарегестрирован в текущей сессии
+        if self.connections.find(name) is not None or (self.link and name in self.link.locations):
+            self.respond(client, message, {RESPONSE: 400, ERROR: 'Это имя уже занято'})
+            self.close_client(client)
             return
-        # Если клиент выходит
-        if ACTION in message and message[ACTION] == EXIT and ACCOUNT_NAME in message and self.names[
-            message[ACCOUNT_NAME]] == client:
-            # Передаем в БД выход пользователя, для удаления из списка активных пользователей.
-            self.database.user_logout(message[ACCOUNT_NAME])
-            self.clients.remove(self.names[message[ACCOUNT_NAME]])
-            SERVER_LOGGER.info(f'Клиент {message[ACCOUNT_NAME]} корректно отключился от сервера.')
-            self.names[message[ACCOUNT_NAME]].close()
-            del self.names[message[ACCOUNT_NAME]]
-            with conflag_lock:
-                NEW_CONNECTION = True
+
+        client_ip, client_port = client.getpeername()
+        # Формат сообщений - первый поддерживаемый из предложенных клиентом
+        wire_format = choose_format(message.get(FORMATS))
+        # Сжатие с общим контекстом возможно только при четких границах сообщений (кадры)
+        compression = negotiate_compression(message.get(COMPRESSION), self.settings) \
+            if connection.decoder.framed else None
+        # При массовом переподключении лишние входы сразу получают отказ с паузой до повтора,
+        # не занимая пул хеширования и поток БД.
+        # После допуска каждый исход входа (ответ клиенту или его отключение) вызывает finished.
+        retry_after = self.admission.admit(client_ip)
+        if retry_after:
+            self.respond(client, message, {RESPONSE: 429, ERROR: 'Слишком много входов, повторите позже.',
+                                           RETRY_AFTER: round(retry_after, 2)})
+            self.close_client(client)
             return
-        # Блок обработки запросов, савязанных со списком контактов.
-        # Запрос списка контактов
-        if ACTION in message and message[ACTION] == GET_CONTACTS and CHAT_USER in message and self.names[
-            message[CHAT_USER]] == client:
-            response = {RESPONSE: 202,
-                        LIST_INFO: self.database.get_contacts(message[CHAT_USER])}
-            send_message(client, response)
-        # Запрос добавления контакта
-        if ACTION in message and message[
-            ACTION] == ADD_CONTACT and ACCOUNT_NAME in message and CHAT_USER in message and self.names[
-            message[CHAT_USER]] == client:
-            response = {RESPONSE: 200}
-            # Запись в БД
-            self.database.add_contact(message[CHAT_USER], message[ACCOUNT_NAME])
-            self.message = send_message(client, response)
-
-        # Запрос удаления контакта
-        if ACTION in message and message[
-            ACTION] == DEL_CONTACT and ACCOUNT_NAME in message and CHAT_USER in message and self.names[
-            message[CHAT_USER]] == client:
-            response = {RESPONSE: 200}
-            # Отражаем это в БД
-            self.database.remove_contact(message[CHAT_USER], message[ACCOUNT_NAME])
-            send_message(client, response)
-
-        # Если это запрос известных пользователей
-        if ACTION in message and message[ACTION] == USERS_REQUEST and ACCOUNT_NAME in message \
-                and self.names[message[ACCOUNT_NAME]] == client:
-            response = {RESPONSE: 202}
-            response[LIST_INFO] = [user[0]
-                                   for user in self.database.users_list()]
-            send_message(client, response)
-
-        # Иначе отдаём Bad request
+        # Хеширование пароля - в пуле, ответ клиенту отправит process_auth
+        if self.auth_pool.submit(message[PASSWORD], name,
+                                 (name, client, client_ip, client_port, wire_format, compression,
+                                  {REQUEST_ID: message[REQUEST_ID]} if REQUEST_ID in message else {})):
+            self.connections.reserve(connection, name)
         else:
-            response = {RESPONSE: 400, ERROR: None}
-            response[ERROR] = 'Запрос некорректен.'
-            send_message(client, response)
+            self.admission.finished()
+            self.respond(client, message, {RESPONSE: 429, ERROR: 'Сервер перегружен, повторите вход позже.',
+                                           RETRY_AFTER: round(self.admission.pending / self.settings.login_rate, 2)})
+            self.close_client(client)
+
+    @action(MESSAGE, (DESTINATION, str), (TIME, NUMBER), SENDER, (MESSAGE_TEXT, str), owner=SENDER)
+    def process_chat_message(self, message, client):
+        """
+        Обработчик сообщения другому пользователю: постановка в очередь доставки.
+        Ответ отправителю не отправляется.
+        """
+        self.messages.append(message)
+        # Отправляем в БД информацию для статистики передачи сообщений
+        self.storage.submit('process_message', message[SENDER], message[DESTINATION])
+
+    @action(EXIT, ACCOUNT_NAME, owner=ACCOUNT_NAME)
+    def process_exit(self, message, client):
+        """
+        Обработчик выхода клиента
+        """
+        # Передаем в БД выход пользователя, для удаления из списка активных пользователей.
+        self.storage.submit('user_logout', message[ACCOUNT_NAME])
+        SERVER_LOGGER.info(f'Клиент {message[ACCOUNT_NAME]} корректно отключился от сервера.')
+        self.close_client(client)
+        self.announce(WORKER_LEAVE, message[ACCOUNT_NAME])
+        self.presence.unsubscribe(message[ACCOUNT_NAME])
+        self.presence_changed(message[ACCOUNT_NAME], False)
+
+    @action(PING, (TIME, NUMBER))
+    def process_ping(self, message, client):
+        """
+        Обработчик проверки связи от клиента. Ответ содержит RESPONSE, поэтому клиент
+        может ждать его как ответ на запрос (по REQUEST_ID).
+        """
+        self.respond(client, message, {RESPONSE: 200, ACTION: PONG, TIME: time.time()})
+
+    @action(PONG)
+    def process_pong(self, message, client):
+        """
+        Обработчик ответа на PING: время активности клиента уже обновлено при чтении
+        """
+
+    @action(SUBSCRIBE, ACCOUNT_NAME, (LIST_INFO, [str]), owner=ACCOUNT_NAME)
+    def process_subscribe(self, message, client):
+        """
+        Обработчик подписки на присутствие: заменяет прежнюю подписку клиента,
+        в ответе - имена из списка, которые сейчас в сети. Дальше сервер отправляет
+        клиенту только изменения (PRESENCE_UPDATE). Подписаться можно только на свои
+        контакты, остальные имена из списка пропускаются.
+        """
+        name = message[ACCOUNT_NAME]
+
+        def subscribe(contacts, error):
+            # При ошибке БД прежняя подписка остается, клиент получает ответ 500
+            if error is not None:
+                self.respond_stored(client, message, error, None)
+                return
+            # Клиент мог отключиться, пока выбирались контакты
+            if not self.is_user(client, name):
+                return
+            contacts = set(contacts)
+            online = self.presence.subscribe(name, [contact for contact in message[LIST_INFO] if contact in contacts],
+                                             self.is_online)
+            self.respond(client, message, {RESPONSE: 202, LIST_INFO: online})
+
+        self.storage.submit('get_contacts', name, then=subscribe)
+
+    @staticmethod
+    def sync_response(result):
+        """
+        Функция формирования ответа на синхронизацию списка по результату
+        (добавленные, удаленные, версия, полный ли список). FULL - список полный
+        и заменяет имеющийся у клиента.
+        """
+        if result is None:
+            return {RESPONSE: 400, ERROR: 'Не удалось получить список.'}
+        added, removed, version, full = result
+        return {RESPONSE: 202, LIST_INFO: added, REMOVED: removed, VERSION: version, FULL: full}
+
+    @action(GET_CONTACTS, CHAT_USER, owner=CHAT_USER)
+    def process_get_contacts(self, message, client):
+        """
+        Обработчик запроса списка контактов. С версией (VERSION) в ответе только
+        изменения с этой версии: добавленные (LIST_INFO) и удаленные (REMOVED) контакты.
+        """
+        if VERSION in message:
+            self.storage.submit('contacts_since', message[CHAT_USER], message[VERSION],
+                                then=lambda result, error: self.respond_stored(client, message, error,
+                                                                               self.sync_response(result)))
             return
+        self.storage.submit('get_contacts', message[CHAT_USER],
+                            then=lambda contacts, error: self.respond_stored(client, message, error,
+                                                                             {RESPONSE: 202, LIST_INFO: contacts or []}))
+
+    @action(ADD_CONTACT, (ACCOUNT_NAME, str), CHAT_USER, owner=CHAT_USER)
+    def process_add_contact(self, message, client):
+        """
+        Обработчик запроса добавления контакта
+        """
+        self.storage.submit('add_contact', message[CHAT_USER], message[ACCOUNT_NAME],
+                            then=lambda result, error: self.respond_stored(client, message, error, {RESPONSE: 200}))
+
+    @action(DEL_CONTACT, (ACCOUNT_NAME, str), CHAT_USER, owner=CHAT_USER)
+    def process_del_contact(self, message, client):
+        """
+        Обработчик запроса удаления контакта
+        """
+        self.storage.submit('remove_contact', message[CHAT_USER], message[ACCOUNT_NAME],
+                            then=lambda result, error: self.respond_stored(client, message, error, {RESPONSE: 200}))
+
+    def finish_group_request(self, client, message, done, error, reason):
+        """
+        Функция ответа на запрос изменения группы после записи в БД,
+        reason - причина отказа, если изменение не выполнено
+        """
+        if error is None and not done:
+            self.respond(client, message, {RESPONSE: 400, ERROR: reason})
+            return
+        if error is None:
+            self.announce_group(message[GROUP])
+        self.respond_stored(client, message, error, {RESPONSE: 200})
+
+    @action(CREATE_GROUP, (GROUP, str), ACCOUNT_NAME, owner=ACCOUNT_NAME)
+    def process_create_group(self, message, client):
+        """
+        Обработчик запроса создания группы, создатель становится ее участником
+        """
+        self.storage.submit('create_group', message[GROUP], message[ACCOUNT_NAME],
+                            then=lambda done, error: self.finish_group_request(
+                                client, message, done, error, 'Группа с таким именем уже существует.'))
+
+    @action(JOIN_GROUP, (GROUP, str), ACCOUNT_NAME, owner=ACCOUNT_NAME)
+    def process_join_group(self, message, client):
+        """
+        Обработчик запроса вступления в группу
+        """
+        self.storage.submit('join_group', message[GROUP], message[ACCOUNT_NAME],
+                            then=lambda done, error: self.finish_group_request(client, message, done, error,
+                                                                               'Группа не найдена.'))
+
+    @action(LEAVE_GROUP, (GROUP, str), ACCOUNT_NAME, owner=ACCOUNT_NAME)
+    def process_leave_group(self, message, client):
+        """
+        Обработчик запроса выхода из группы
+        """
+        self.storage.submit('leave_group', message[GROUP], message[ACCOUNT_NAME],
+                            then=lambda done, error: self.finish_group_request(client, message, done, error,
+                                                                               'Группа не найдена.'))
+
+    @action(GROUP_MESSAGE, (GROUP, str), (TIME, NUMBER), SENDER, (MESSAGE_TEXT, str), owner=SENDER)
+    def process_chat_group_message(self, message, client):
+        """
+        Обработчик сообщения в группу: отправитель должен быть ее участником.
+        Ответ отправителю не отправляется.
+        """
+        def check_member(members):
+            if message[SENDER] not in members:
+                self.respond(client, message, {RESPONSE: 400, ERROR: 'Вы не участник этой группы.'})
+                return
+            self.messages.append(message)
+
+        self.with_group(message[GROUP], check_member)
+
+    @action(USERS_REQUEST, ACCOUNT_NAME, owner=ACCOUNT_NAME)
+    def process_users_request(self, message, client):
+        """
+        Обработчик запроса списка известных пользователей. С версией (VERSION) в ответе
+        только пользователи, зарегистрированные после этой версии.
+        """
+        if VERSION in message:
+            self.storage.submit('users_since', message[VERSION],
+                                then=lambda result, error: self.respond_stored(
+                                    client, message, error,
+                                    self.sync_response(result and (result[0], [], result[1], result[2]))))
+            return
+        self.storage.submit('users_list', then=lambda users, error: self.respond_stored(
+            client, message, error, {RESPONSE: 202, LIST_INFO: [user[0] for user in users or ()]}))
+
+
+class StreamClient:
+    """
+    Класс - обертка над парой asyncio-потоков клиента.
+    Повторяет методы сокета, которые используют обработчики сообщений сервера.
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        # Счетчики исходящих данных, сам буфер находится в транспорте asyncio
+        self.bytes_queued = 0
+        self.peak = 0
+
+    def send(self, data):
+        self.writer.write(data)
+        self.bytes_queued += len(data)
+        self.peak = max(self.peak, self.buffer_size())
+        return len(data)
+
+    def buffer_size(self):
+        return self.writer.transport.get_write_buffer_size()
+
+    def getpeername(self):
+        return self.writer.get_extra_info('peername')[:2]
+
+    def fileno(self):
+        return self.writer.get_extra_info('socket').fileno()
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncServer(Server):
+    # """
+    # Сервер на asyncio-потоках. Разбор сообщений и работа с БД те же, что и в Server,
+    # но прием соединений и чтение сокетов выполняются по событиям готовности, без опроса.
+    # """
+
+    def init_socket(self):
+        SERVER_LOGGER.info(
+            f'Запущен asyncio-сервер, порт для подключений: {self.port} , адрес с которого принимаются подключения: \
+            {self.addr}. Если адрес не указан, принимаются соединения с любых адресов.')
+
+        # Подготовка сокета, ожиданием на нем занимается цикл событий
+        transport = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if self.link:
+            transport.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        transport.bind((self.addr, int(self.port)))
+        transport.setblocking(False)
+        self.sock = transport
+
+    def main_loop(self):
+        """
+        Функция запуска цикла событий сервера
+        """
+        self.init_socket()
+        asyncio.run(self.serve())
+
+    async def serve(self):
+        """
+        Корутина приема соединений, для каждого клиента запускается handle_client
+        """
+        server = await asyncio.start_server(self.handle_client, sock=self.sock,
+                                            backlog=self.settings.max_connections)
+        loop = asyncio.get_running_loop()
+        if self.link:
+            loop.add_reader(self.link.fileno(), self.link_ready)
+        # Пул проверки паролей будит цикл событий, когда результат готов
+        self.auth_pool.notify = lambda: loop.call_soon_threadsafe(self.auth_ready)
+        self.storage.notify = lambda: loop.call_soon_threadsafe(self.storage_ready)
+        loop.call_later(TICK_INTERVAL, self.tick_ready)
+        async with server:
+            await server.serve_forever()
+
+    def link_ready(self):
+        """
+        Обработчик готовности канала воркеров: принимает сообщения и доставляет пересланные
+        """
+        self.process_link()
+        self.route_messages()
+
+    def tick_ready(self):
+        """
+        Обработчик таймера служебных задач, перезапускает таймер
+        """
+        self.tick()
+        asyncio.get_running_loop().call_later(TICK_INTERVAL, self.tick_ready)
+
+    def auth_ready(self):
+        """
+        Обработчик завершения проверки пароля в пуле
+        """
+        self.process_auth()
+        self.route_messages()
+
+    def schedule_presence(self):
+        """
+        Функция запуска таймера отправки изменений присутствия по окончании интервала накопления
+        """
+        asyncio.get_running_loop().call_later(self.settings.presence_window, self.presence_ready)
+
+    def presence_ready(self):
+        """
+        Обработчик таймера изменений присутствия
+        """
+        self.push_presence()
+
+    def storage_ready(self):
+        """
+        Обработчик готовности результата запроса к БД
+        """
+        self.process_storage()
+        self.route_messages()
+
+    def write_to(self, client, data):
+        """
+        Функция записи данных в транспорт клиента. Неотправленные данные хранит
+        транспорт asyncio, его размер ограничен так же, как буфер в Server.
+        """
+        if client.buffer_size() + len(data) > self.settings.outbound_limit:
+            raise BufferError(f'Переполнен буфер исходящих сообщений: {client.buffer_size()} байт')
+        client.send(data)
+
+    def flush_client(self, client):
+        # Транспорт asyncio отправляет данные сам по готовности сокета
+        pass
+
+    def throttle(self, sender_name, recipient):
+        """
+        Функция регистрации перегруженного получателя. Обработчик отправителя
+        дождется разгрузки его буфера, прежде чем читать следующие сообщения.
+        """
+        sender = self.connections.active(sender_name)
+        if recipient.buffer_size() >= self.settings.outbound_high_watermark and sender is not None:
+            sender.congested.add(recipient)
+
+    def connection_stats(self):
+        return {connection.name: dict(connection.stats(), depth=connection.sock.buffer_size(),
+                                      peak=connection.sock.peak, bytes_queued=connection.sock.bytes_queued)
+                for connection in self.connections if connection.state == ACTIVE}
+
+    async def handle_client(self, reader, writer):
+        """
+        Корутина обслуживания одного клиента: читает сообщения по мере поступления,
+        обрабатывает их и отправляет накопленные сообщения получателям.
+        """
+        client = StreamClient(reader, writer)
+        SERVER_LOGGER.info(f'Соединение {client.getpeername()} с установлено')
+        # drain() ждет, пока буфер транспорта не опустится ниже нижнего порога
+        writer.transport.set_write_buffer_limits(high=self.settings.outbound_high_watermark,
+                                                 low=self.settings.outbound_low_watermark)
+        connection = self.add_client(client, client.getpeername())
+        try:
+            while not writer.is_closing():
+                data = await reader.read(self.settings.recv_buffer_length)
+                if not data:
+                    break
+                self.feed_client(client, data)
+                self.route_messages()
+                await writer.drain()
+                # Обратное давление: не читаем от клиента, пока перегруженные получатели не разгрузятся
+                congested, connection.congested = connection.congested, set()
+                for recipient in congested:
+                    try:
+                        await recipient.writer.drain()
+                    except ConnectionError:
+                        pass
+        except Exception as e:
+            SERVER_LOGGER.info(f'{client.getpeername()} отключился. {e}')
+        finally:
+            self.remove_client(client)
+            writer.close()
+
+
+# Доступные движки сервера
+SERVER_ENGINES = {
+    'select': Server,
+    'asyncio': AsyncServer,
+}
+
+
+def stop_on_sigterm():
+    """
+    Функция, превращающая SIGTERM в обычное завершение процесса,
+    чтобы при остановке выполнились блоки finally (запись статистики)
+    """
+    def stop(signum, frame):
+        # Повторный сигнал не должен прерывать уже начатое завершение
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+
+
+def run_worker(worker_id, listen_address, listen_port, settings, link_directory):
+    """
+    Функция запуска одного процесса-воркера сервера
+    """
+    stop_on_sigterm()
+    database = ServerStorage(clear_active=False, stats_flush_interval=settings.stats_flush_interval,
+                             stats_flush_messages=settings.stats_flush_messages,
+                             offline_limit=settings.offline_queue_limit,
+                             offline_retention=settings.offline_retention,
+                             mmap_size=settings.db_mmap_size)
+    link = WorkerLink(worker_id, settings.server_workers, listen_port, settings, link_directory)
+    SERVER_LOGGER.info(f'Запущен воркер {worker_id}, pid {os.getpid()}')
+    server = SERVER_ENGINES[settings.server_engine](listen_address, listen_port, database, settings, link=link)
+    server.daemon = True
+    try:
+        server.main_loop()
+    finally:
+        # Статистика, накопленная в памяти, записывается при остановке, после запросов из очереди БД
+        server.storage.close()
+        database.flush_stats()
+        link.close()
+
+
+def run_workers(listen_address, listen_port, settings):
+    """
+    Функция запуска нескольких воркеров на одном порту, по одному процессу на ядро.
+    Ядро распределяет входящие соединения между воркерами (SO_REUSEPORT),
+    сообщения между пользователями разных воркеров пересылаются через WorkerLink.
+    """
+    # Каталог сокетов связи воркеров - общий для всех воркеров и закрытый для других пользователей
+    link_directory = WorkerLink.make_directory()
+    processes = [multiprocessing.Process(target=run_worker,
+                                         args=(worker_id, listen_address, listen_port, settings, link_directory),
+                                         daemon=True)
+                 for worker_id in range(settings.server_workers)]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        for process in processes:
+            process.terminate()
+    finally:
+        shutil.rmtree(link_directory, ignore_errors=True)
 
 
 def main():
     """
     Функция запуска приложения
     """
-    dotenv_path = join(dirname(__file__), '.env')
-    load_dotenv(dotenv_path)
+    # Парсинг аргументов. Выполняется единожды при запуске.
+    # Параметры командной строки переопределяют значения из .env и окружения.
+    overrides = {}
+    try:
+        if '--engine' in sys.argv:
+            overrides['server_engine'] = sys.argv[sys.argv.index('--engine') + 1]
+    except IndexError:
+        print('После параметра \'--engine\' необходимо указать движок: select или asyncio.')
+        sys.exit(1)
+
+    try:
+        if '--workers' in sys.argv:
+            overrides['server_workers'] = int(sys.argv[sys.argv.index('--workers') + 1])
+    except (IndexError, ValueError):
+        print('После параметра \'--workers\' необходимо указать число процессов не меньше 1.')
+        sys.exit(1)
 
-    database = ServerStorage()
+    # Настройки загружаются один раз и дальше передаются явно
+    settings = load_settings(overrides=overrides)
+    stop_on_sigterm()
+
+    database = ServerStorage(stats_flush_interval=settings.stats_flush_interval,
+                             stats_flush_messages=settings.stats_flush_messages,
+                             offline_limit=settings.offline_queue_limit,
+                             offline_retention=settings.offline_retention,
+                             mmap_size=settings.db_mmap_size)
 
-    # Парсинг аргументов. Выполняется единожды при запуске.
     try:
         if '-p' in sys.argv:
             listen_port = int(sys.argv[sys.argv.index('-p') + 1])
         else:
-            listen_port = os.environ.get("DEFAULT_PORT")
+            listen_port = settings.default_port
         if int(listen_port) < 1024 or int(listen_port) > 65535:
             SERVER_LOGGER.critical(f'Попытка использования недопустимого порта {listen_port}')
             sys.exit(1)
@@ -296,9 +1423,31 @@ def main():
             'В случае указания параметра \'a\'- необходимо указать адрес.')
         sys.exit(1)
 
-    server = Server(listen_address, listen_port, database)
+    # Выбор движка сервера: опрос accept/select (по умолчанию) или asyncio
+    if settings.server_engine not in SERVER_ENGINES:
+        SERVER_LOGGER.critical(f'Попытка запуска сервера с неизвестным движком {settings.server_engine}')
+        sys.exit(1)
+    SERVER_LOGGER.info(f'Используемый движок сервера: {settings.server_engine}')
+
+    if settings.server_workers < 1:
+        print('Число процессов-воркеров должно быть не меньше 1.')
+        sys.exit(1)
+
+    if settings.server_workers > 1:
+        # Каждый воркер открывает собственное подключение к БД
+        database.session.close()
+        database.database_engine.dispose()
+        run_workers(listen_address, listen_port, settings)
+        return
+
+    server = SERVER_ENGINES[settings.server_engine](listen_address, listen_port, database, settings)
     server.daemon = True
-    server.main_loop()
+    try:
+        server.main_loop()
+    finally:
+        # Статистика, накопленная в памяти, записывается при остановке, после запросов из очереди БД
+        server.storage.close()
+        database.flush_stats()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,54 @@
+import unittest
+from messenger.common.admission import TokenBucket, LoginAdmission
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_refill(self):
+        bucket = TokenBucket(rate=2, burst=2, now=0)
+        for _ in range(2):
+            self.assertEqual(bucket.wait_time(0), 0)
+            bucket.take()
+        self.assertAlmostEqual(bucket.wait_time(0), 0.5)
+        self.assertEqual(bucket.wait_time(0.5), 0)
+        self.assertTrue(bucket.is_full(10))
+
+
+class TestLoginAdmission(unittest.TestCase):
+    def test_per_ip_limit(self):
+        admission = LoginAdmission(rate=1000, burst=1000, ip_rate=0.001, ip_burst=2, max_pending=100)
+        self.assertEqual(admission.admit('10.0.0.1'), 0)
+        self.assertEqual(admission.admit('10.0.0.1'), 0)
+        self.assertGreater(admission.admit('10.0.0.1'), 0)
+        # Другой адрес ограничен своим ведром
+        self.assertEqual(admission.admit('10.0.0.2'), 0)
+        self.assertEqual(admission.stats()['rejected'], 1)
+
+    def test_invalid_limits(self):
+        with self.assertRaises(ValueError):
+            LoginAdmission(rate=0, burst=10, ip_rate=1, ip_burst=5, max_pending=10)
+        with self.assertRaises(ValueError):
+            LoginAdmission(rate=10, burst=10, ip_rate=0, ip_burst=5, max_pending=10)
+
+    def test_prune_interval(self):
+        admission = LoginAdmission(rate=1000, burst=1000, ip_rate=1000, ip_burst=1, max_pending=10,
+                                   prune_interval=3600)
+        admission.admit('10.0.0.1')
+        admission.finished()
+        admission.ip_buckets['10.0.0.1'].updated -= 1
+        # Ведро уже заполнилось, но интервал удаления еще не прошел
+        admission.prune_if_due()
+        self.assertEqual(admission.stats()['addresses'], 1)
+        admission.pruned_at -= 3600
+        admission.prune_if_due()
+        self.assertEqual(admission.stats()['addresses'], 0)
+
+    def test_pending_limit(self):
+        admission = LoginAdmission(rate=1000, burst=1000, ip_rate=1000, ip_burst=1000, max_pending=1)
+        self.assertEqual(admission.admit('10.0.0.1'), 0)
+        self.assertGreater(admission.admit('10.0.0.2'), 0)
+        admission.finished()
+        self.assertEqual(admission.admit('10.0.0.2'), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,30 @@
+import threading
+import unittest
+from messenger.common.auth import AuthPool, hash_password
+
+
+class TestAuthPool(unittest.TestCase):
+    def test_completed(self):
+        ready = threading.Event()
+        pool = AuthPool(2, 4, notify=ready.set)
+        self.assertTrue(pool.submit('secret', 'Mary', 'context'))
+        ready.wait(10)
+        self.assertEqual(list(pool.completed()), [('context', hash_password('secret', 'Mary'), None)])
+        self.assertEqual(pool.pending, 0)
+
+    def test_unencodable_password(self):
+        ready = threading.Event()
+        pool = AuthPool(1, 4, notify=ready.set)
+        # Одиночный суррогат не кодируется в UTF-8
+        self.assertTrue(pool.submit('\ud800', 'Mary', 'context'))
+        ready.wait(10)
+        (context, password_hash, error), = pool.completed()
+        self.assertEqual(context, 'context')
+        self.assertIsNone(password_hash)
+        self.assertIsInstance(error, UnicodeEncodeError)
+        self.assertEqual(pool.pending, 0)
+
+    def test_queue_limit(self):
+        pool = AuthPool(1, 1)
+        self.assertTrue(pool.submit('secret', 'Mary', 1))
+        self.assertFalse(pool.submit('secret', 'Pete', 2))
@@ -0,0 +1,14 @@
+import unittest
+from messenger.benchmarks.run_all import compare
+
+
+class TestCompare(unittest.TestCase):
+    def test_regression(self):
+        baseline = {'codec.encode_message': {'best_us': 10.0}, 'codec.decode_message': {'best_us': 10.0}}
+        results = {'codec.encode_message': {'best_us': 11.0}, 'codec.decode_message': {'best_us': 13.0},
+                   'codec.new': {'best_us': 100.0}}
+        self.assertEqual(compare(results, baseline, 0.2), [('codec.decode_message', 10.0, 13.0)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import json
+import unittest
+from messenger.common.binary_codec import encode_binary, decode_binary, choose_format, is_binary, \
+    BINARY_FORMAT, JSON_FORMAT
+from messenger.common.jim_variables import *
+
+
+class TestBinaryCodec(unittest.TestCase):
+    message = {ACTION: MESSAGE, TIME: 1682600000.25, SENDER: 'client_1', DESTINATION: 'client_2',
+               MESSAGE_TEXT: 'Привет!'}
+
+    def test_round_trip(self):
+        message = {RESPONSE: 202, LIST_INFO: ['Mary', 'Peter', 'x' * 300], ERROR: None, 'flag': True,
+                   'big': 2 ** 40, 'negative': -70000, CHAT_USER: {ACCOUNT_NAME: 'Mary'}}
+        data = encode_binary(message)
+        self.assertTrue(is_binary(data))
+        self.assertEqual(decode_binary(data), message)
+
+    def test_smaller_than_json(self):
+        self.assertLess(len(encode_binary(self.message)), len(json.dumps(self.message).encode('utf-8')))
+
+    def test_truncated(self):
+        data = encode_binary(self.message)
+        with self.assertRaises(ValueError):
+            decode_binary(data[:-3])
+
+    def test_unsupported_type(self):
+        with self.assertRaises(TypeError):
+            encode_binary({ACTION: object()})
+
+    def test_choose_format(self):
+        self.assertEqual(choose_format([BINARY_FORMAT, JSON_FORMAT]), BINARY_FORMAT)
+        self.assertEqual(choose_format(['protobuf', JSON_FORMAT]), JSON_FORMAT)
+        self.assertEqual(choose_format(None), JSON_FORMAT)
+
+
+if __name__ == '__main__':
+    unittest.main()
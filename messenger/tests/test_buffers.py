@@ -0,0 +1,44 @@
+import unittest
+from messenger.common.buffers import OutboundBuffer
+
+
+class TestSocket:
+    def __init__(self, accept):
+        self.accept = accept
+        self.received = b''
+
+    def send(self, data):
+        if not self.accept:
+            raise BlockingIOError
+        sent = bytes(data[:self.accept])
+        self.accept -= len(sent)
+        self.received += sent
+        return len(sent)
+
+
+class TestOutboundBuffer(unittest.TestCase):
+    def test_partial_write(self):
+        buffer = OutboundBuffer(high_watermark=8, low_watermark=2, limit=100)
+        sock = TestSocket(accept=5)
+        buffer.write(b'abcdef')
+        buffer.write(b'ghij')
+        self.assertTrue(buffer.is_congested())
+        self.assertFalse(buffer.flush(sock))
+        self.assertEqual(len(buffer), 5)
+        self.assertEqual(buffer.partial_writes, 1)
+        sock.accept = 100
+        self.assertTrue(buffer.flush(sock))
+        self.assertEqual(sock.received, b'abcdefghij')
+        self.assertTrue(buffer.is_drained())
+        self.assertEqual(buffer.stats()['bytes_sent'], 10)
+        self.assertEqual(buffer.stats()['peak'], 10)
+
+    def test_limit(self):
+        buffer = OutboundBuffer(high_watermark=8, low_watermark=2, limit=10)
+        buffer.write(b'x' * 10)
+        with self.assertRaises(BufferError):
+            buffer.write(b'y')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+from messenger.common.channel import Channel, PendingRequests
+from messenger.common.common_functions import encode_message
+from messenger.common.framing import pack_frame
+from messenger.common.settings import Settings
+
+
+class TestSocket:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def recv(self, max_len):
+        return self.chunks.pop(0)
+
+
+class TestPendingRequests(unittest.TestCase):
+    def test_out_of_order(self):
+        pending = PendingRequests()
+        first_id, first = pending.register()
+        second_id, second = pending.register()
+        self.assertTrue(pending.resolve({'response': 202, 'request_id': second_id}))
+        self.assertTrue(pending.resolve({'response': 200, 'request_id': first_id}))
+        self.assertEqual(first.result(0)['response'], 200)
+        self.assertEqual(second.result(0)['response'], 202)
+        self.assertFalse(pending.resolve({'response': 200, 'request_id': first_id}))
+
+    def test_response_without_id(self):
+        pending = PendingRequests()
+        _, first = pending.register()
+        _, second = pending.register()
+        pending.resolve({'response': 200})
+        self.assertTrue(first.done())
+        self.assertFalse(second.done())
+
+    def test_fail_all(self):
+        pending = PendingRequests()
+        _, future = pending.register()
+        pending.fail_all(ConnectionError())
+        with self.assertRaises(ConnectionError):
+            future.result(0)
+        self.assertEqual(len(pending), 0)
+
+
+class TestChannel(unittest.TestCase):
+    def test_read_ready(self):
+        settings = Settings()
+        stream = pack_frame(encode_message({'response': 200, 'request_id': 1}, settings)) + \
+            pack_frame(encode_message({'action': 'message', 'mess_text': 'Привет!'}, settings))
+        channel = Channel(TestSocket([stream[:10], stream[10:], b'']), settings)
+        request_id, future = channel.pending.register()
+        self.assertEqual(channel.read_ready(), [])
+        messages = channel.read_ready()
+        self.assertTrue(channel.dispatch(messages[0]))
+        self.assertFalse(channel.dispatch(messages[1]))
+        self.assertEqual(future.result(0)['response'], 200)
+        with self.assertRaises(ConnectionError):
+            channel.read_ready()
+        channel.close()
+        self.assertTrue(channel.closed.is_set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+import os
+import tempfile
+import unittest
+from messenger.database.client_database import ClientDatabase
+
+
+class TestClientDatabase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.database = ClientDatabase('test', path=os.path.join(self.directory.name, 'client.db3'),
+                                       history_flush_interval=60, history_batch_size=2)
+
+    def tearDown(self):
+        self.database.close()
+        self.directory.cleanup()
+
+    def test_batched_history(self):
+        for number in range(3):
+            self.database.save_message('Mary', 'Pete', f'text {number}')
+        # Третье сообщение ждет в очереди, get_history записывает его перед чтением
+        history = self.database.get_history(to_who='Pete')
+        self.assertEqual([row[2] for row in history], ['text 0', 'text 1', 'text 2'])
+        self.assertEqual(self.database.history_writer.written, 3)
+
+    def test_history_pages(self):
+        for number in range(5):
+            self.database.save_message('Mary', 'Pete', f'text {number}')
+        self.database.save_message('Pete', 'Mary', 'reply')
+        first = self.database.get_history_page(to_who='Pete', limit=2)
+        self.assertEqual([row[3] for row in first], ['text 4', 'text 3'])
+        second = self.database.get_history_page(to_who='Pete', before=first[-1][0], limit=2)
+        self.assertEqual([row[3] for row in second], ['text 2', 'text 1'])
+        newer = self.database.get_history_page(to_who='Pete', after=second[-1][0], limit=2)
+        self.assertEqual([row[3] for row in newer], ['text 3', 'text 2'])
+        pages = list(self.database.iter_history(to_who='Pete', page_size=2))
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+
+    def test_search(self):
+        self.database.save_message('Mary', 'Pete', 'meeting at noon')
+        self.database.save_message('Pete', 'Mary', 'no meeting today, sorry')
+        self.database.save_message('Mary', 'Pete', 'lunch?')
+        found = self.database.search_history('Meeting')
+        self.assertEqual({row[3] for row in found}, {'meeting at noon', 'no meeting today, sorry'})
+        self.assertEqual(len(self.database.search_history('meeting', limit=1, offset=1)), 1)
+        # Символы синтаксиса FTS5 во вводе не приводят к ошибке
+        self.assertEqual(self.database.search_history('"noon OR'), [])
+
+    def test_apply_sync(self):
+        self.assertEqual(self.database.get_version('users'), 0)
+        self.database.apply_users(['Mary', 'Pete'], 2, full=True)
+        self.database.apply_users(['John'], 3)
+        self.assertEqual(sorted(self.database.get_users()), ['John', 'Mary', 'Pete'])
+        self.assertEqual(self.database.get_version('users'), 3)
+        self.database.apply_contacts(['Pete', 'John'], [], 5, full=True)
+        self.database.apply_contacts(['Mary'], ['Pete'], 7)
+        self.assertEqual(sorted(self.database.get_contacts()), ['John', 'Mary'])
+        self.assertEqual(self.database.get_version('contacts'), 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,29 @@
+import unittest
+from messenger.common.compression import MessageCompression, COMPRESSED_MAGIC
+
+
+class TestMessageCompression(unittest.TestCase):
+    def test_threshold(self):
+        sender = MessageCompression(threshold=100)
+        self.assertEqual(sender.compress(b'{"response": 200}'), b'{"response": 200}')
+        self.assertEqual(sender.compressed_messages, 0)
+
+    def test_shared_context(self):
+        sender = MessageCompression(threshold=10)
+        receiver = MessageCompression(threshold=10)
+        messages = [b'{"list_info": ["user_%d"]}' % number * 20 for number in range(5)]
+        compressed = [sender.compress(message) for message in messages]
+        self.assertTrue(all(data[0] == COMPRESSED_MAGIC for data in compressed))
+        # Повторы между сообщениями сжимаются за счет общего контекста
+        self.assertLess(len(compressed[1]), len(compressed[0]))
+        self.assertEqual([receiver.decompress(data) for data in compressed], messages)
+        self.assertGreater(sender.stats()['bytes_saved'], 0)
+
+    def test_corrupted(self):
+        receiver = MessageCompression(threshold=10)
+        with self.assertRaises(ValueError):
+            receiver.decompress(bytes((COMPRESSED_MAGIC,)) + b'not deflate')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+from messenger.common.connections import ConnectionRegistry, ACTIVE
+
+
+class TestSocket:
+    def __init__(self, fileno):
+        self.number = fileno
+
+    def fileno(self):
+        return self.number
+
+
+class TestConnectionRegistry(unittest.TestCase):
+    def test_lookup(self):
+        registry = ConnectionRegistry()
+        sock = TestSocket(5)
+        connection = registry.add(sock, ('127.0.0.1', 50000), None)
+        registry.reserve(connection, 'Mary')
+        self.assertIs(registry.find('Mary'), connection)
+        self.assertIsNone(registry.active('Mary'))
+        registry.activate(connection)
+        self.assertEqual(connection.state, ACTIVE)
+        self.assertIs(registry.active('Mary'), connection)
+        self.assertIs(registry.get_by_fileno(5), connection)
+        self.assertIs(registry.get_by_address(('127.0.0.1', 50000)), connection)
+        self.assertEqual(registry.names(), ['Mary'])
+
+    def test_remove(self):
+        registry = ConnectionRegistry()
+        sock = TestSocket(6)
+        registry.reserve(registry.add(sock, ('127.0.0.1', 50001), None), 'Pete')
+        registry.remove(sock)
+        self.assertNotIn(sock, registry)
+        self.assertIsNone(registry.find('Pete'))
+        self.assertIsNone(registry.get_by_fileno(6))
+        self.assertEqual(len(registry), 0)
+
+    def test_reserve_again(self):
+        registry = ConnectionRegistry()
+        connection = registry.add(TestSocket(7), ('127.0.0.1', 50002), None)
+        registry.reserve(connection, 'Mary')
+        registry.activate(connection)
+        registry.reserve(connection, 'Pete')
+        # Прежнее имя освобождено, соединение находится только по новому
+        self.assertIsNone(registry.find('Mary'))
+        self.assertIs(registry.find('Pete'), connection)
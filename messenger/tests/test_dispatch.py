@@ -0,0 +1,53 @@
+import unittest
+from messenger.common.dispatch import action, collect_handlers, NUMBER
+
+
+class Base:
+    @action('ping', 'time')
+    def ping(self, message, client):
+        return 'base'
+
+
+Base.handlers = collect_handlers((), vars(Base))
+
+
+class Child(Base):
+    @action('ping', 'time', 'user', owner='user')
+    def ping(self, message, client):
+        return 'child'
+
+    @action('exit', 'account_name', owner='account_name')
+    def exit(self, message, client):
+        return 'exit'
+
+    @action('msg', ('to', str), ('time', NUMBER), ('user', {'account_name': str}), ('list', [str]))
+    def msg(self, message, client):
+        return 'msg'
+
+
+class TestDispatch(unittest.TestCase):
+    def test_collect(self):
+        handlers = collect_handlers((Base,), vars(Child))
+        self.assertEqual(set(handlers), {'ping', 'exit', 'msg'})
+        self.assertEqual(handlers['ping'].method(None, {}, None), 'child')
+        self.assertEqual(handlers['exit'].owner, 'account_name')
+        self.assertEqual(Base.handlers['ping'].method(None, {}, None), 'base')
+
+    def test_accepts(self):
+        handler = collect_handlers((Base,), vars(Child))['ping']
+        self.assertTrue(handler.accepts({'action': 'ping', 'time': 1.1, 'user': 'Mary'}))
+        self.assertFalse(handler.accepts({'action': 'ping', 'time': 1.1}))
+        # Поле владельца - всегда строка
+        self.assertFalse(handler.accepts({'action': 'ping', 'time': 1.1, 'user': ['Mary']}))
+
+    def test_types(self):
+        handler = collect_handlers((Base,), vars(Child))['msg']
+        message = {'action': 'msg', 'to': 'Mary', 'time': 1, 'user': {'account_name': 'Pete'}, 'list': ['a']}
+        self.assertTrue(handler.accepts(message))
+        for field, value in (('to', ['Mary']), ('time', '1'), ('user', {'account_name': 1}), ('user', 'Pete'),
+                             ('list', ['a', {}]), ('list', 'a')):
+            self.assertFalse(handler.accepts(dict(message, **{field: value})), (field, value))
+
+
+if __name__ == '__main__':
+    unittest.main()
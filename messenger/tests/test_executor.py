@@ -0,0 +1,54 @@
+import threading
+import unittest
+from messenger.database.executor import StorageExecutor
+
+
+class FakeStorage:
+    def __init__(self):
+        self.threads = set()
+        self.calls = []
+        self.rollbacks = 0
+
+    def save(self, value):
+        self.threads.add(threading.current_thread().name)
+        self.calls.append(value)
+        return value * 2
+
+    def fail(self):
+        raise ValueError('disk')
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+class TestStorageExecutor(unittest.TestCase):
+    def setUp(self):
+        self.storage = FakeStorage()
+        self.executor = StorageExecutor(self.storage)
+
+    def tearDown(self):
+        self.executor.close()
+
+    def test_order_and_thread(self):
+        results = []
+        for number in range(5):
+            self.executor.submit('save', number, then=results.append)
+        self.assertEqual(self.executor.call('save', 5), 10)
+        # Результаты с then забирает главный цикл
+        for then, future in self.executor.completed():
+            then(future.result())
+        self.assertEqual(results, [0, 2, 4, 6, 8])
+        self.assertEqual(self.storage.calls, [0, 1, 2, 3, 4, 5])
+        self.assertEqual(self.storage.threads, {'storage'})
+        self.assertEqual(self.executor.stats()['calls']['save']['count'], 6)
+
+    def test_error(self):
+        with self.assertRaises(ValueError):
+            self.executor.call('fail')
+        self.assertEqual(self.executor.call('save', 1), 2)
+        # Прерванная транзакция отменена, успешный вызов ее не отменяет
+        self.assertEqual(self.storage.rollbacks, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
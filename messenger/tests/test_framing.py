@@ -0,0 +1,49 @@
+import unittest
+from messenger.common.framing import FrameDecoder, pack_frame, recv_frame, MAX_FRAME_LENGTH
+
+
+class TestSocket:
+    def __init__(self, data, chunk):
+        self.data = data
+        self.chunk = chunk
+
+    def recv(self, max_len):
+        size = min(max_len, self.chunk)
+        part, self.data = self.data[:size], self.data[size:]
+        return part
+
+
+class TestFraming(unittest.TestCase):
+    def test_coalesced_frames(self):
+        decoder = FrameDecoder()
+        stream = pack_frame(b'{"a": 1}') + pack_frame(b'{"b": 2}') + pack_frame(b'{"c": 3}')
+        self.assertEqual(decoder.feed(stream), [b'{"a": 1}', b'{"b": 2}', b'{"c": 3}'])
+        self.assertTrue(decoder.framed)
+
+    def test_split_frames(self):
+        decoder = FrameDecoder()
+        payload = b'x' * 5000
+        stream = pack_frame(payload) + pack_frame(b'tail')
+        messages = []
+        for i in range(0, len(stream), 7):
+            messages.extend(decoder.feed(stream[i:i + 7]))
+        self.assertEqual(messages, [payload, b'tail'])
+        self.assertEqual(decoder.buffer, bytearray())
+
+    def test_raw_json_mode(self):
+        decoder = FrameDecoder()
+        self.assertEqual(decoder.feed(b'{"response": 200}'), [b'{"response": 200}'])
+        self.assertFalse(decoder.framed)
+
+    def test_recv_frame(self):
+        sock = TestSocket(pack_frame(b'y' * 3000) + pack_frame(b'next'), chunk=1000)
+        self.assertEqual(recv_frame(sock), b'y' * 3000)
+        self.assertEqual(recv_frame(sock), b'next')
+
+    def test_too_long(self):
+        with self.assertRaises(ValueError):
+            pack_frame(b'z' * (MAX_FRAME_LENGTH + 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import json
+import time
+import unittest
+from messenger.benchmarks.utils import FakeSocket
+from messenger.common.buffers import OutboundBuffer
+from messenger.common.jim_variables import *
+from messenger.common.settings import load_settings
+from messenger.database.storage import ServerStorage
+from server import Server
+
+
+class ServerTestCase(unittest.TestCase):
+    """
+    Класс - основа тестов сервера: сокеты-заглушки, БД в памяти
+    """
+
+    def setUp(self):
+        self.settings = load_settings(overrides={'wire_format': 'json', 'compression': False})
+        self.server = Server('', self.settings.default_port, ServerStorage(path=':memory:'), self.settings)
+
+    def tearDown(self):
+        self.server.auth_pool.executor.shutdown()
+        self.server.storage.close()
+
+    def connect(self, port):
+        sock = FakeSocket(('127.0.0.1', port))
+        self.server.add_client(sock, sock.address, OutboundBuffer(self.settings.outbound_high_watermark,
+                                                                  self.settings.outbound_low_watermark,
+                                                                  self.settings.outbound_limit))
+        return sock
+
+    def login(self, sock, name, password):
+        message = {ACTION: PRESENCE, TIME: time.time(), CHAT_USER: {ACCOUNT_NAME: name}, PASSWORD: password}
+        self.server.feed_client(sock, json.dumps(message).encode())
+
+    def settle(self):
+        """
+        Функция ожидания проверки паролей и запросов к БД с обработкой их результатов и отправкой ответов
+        """
+        deadline = time.monotonic() + 10
+        while self.server.auth_pool.pending and time.monotonic() < deadline:
+            self.server.process_auth()
+            time.sleep(0.01)
+        self.server.storage.call('directory_stats')
+        self.server.process_storage()
+        for client in list(self.server.pending_output):
+            self.server.flush_client(client)
+
+    def response(self, sock):
+        return json.loads(bytes(sock.data))
+
+
+class TestLoginAdmission(ServerTestCase):
+    """
+    Каждый допущенный вход по любому исходу освобождает место в допуске входов
+    """
+
+    def test_unencodable_password(self):
+        sock = self.connect(50001)
+        self.login(sock, 'eve', '\udc80')
+        self.assertEqual(self.server.admission.pending, 1)
+        self.settle()
+        self.assertEqual(self.server.admission.pending, 0)
+        self.assertNotIn(sock, self.server.connections)
+        self.assertEqual(self.response(sock)[RESPONSE], 400)
+        # Имя освобождено, следующий вход выполняется
+        sock = self.connect(50002)
+        self.login(sock, 'eve', 'secret')
+        self.settle()
+        self.assertEqual(self.response(sock)[RESPONSE], 200)
+        self.assertEqual(self.server.admission.pending, 0)
+
+    def test_wrong_password(self):
+        sock = self.connect(50001)
+        self.login(sock, 'eve', 'secret')
+        self.settle()
+        self.server.remove_client(sock)
+        sock = self.connect(50002)
+        self.login(sock, 'eve', 'wrong')
+        self.settle()
+        self.assertEqual(self.response(sock)[RESPONSE], 400)
+        self.assertEqual(self.server.admission.pending, 0)
+
+    def test_disconnect_while_hashing(self):
+        sock = self.connect(50001)
+        self.login(sock, 'eve', 'secret')
+        self.server.remove_client(sock)
+        self.settle()
+        self.assertEqual(self.server.admission.pending, 0)
+
+    def test_second_presence(self):
+        sock = self.connect(50001)
+        self.login(sock, 'eve', 'secret')
+        self.settle()
+        # Повторный вход с того же соединения под другим именем отклоняется, прежнее имя остается за ним
+        self.login(sock, 'mallory', 'secret')
+        self.settle()
+        self.assertEqual(self.response(sock)[RESPONSE], 400)
+        self.assertIn(sock, self.server.connections)
+        self.assertIsNone(self.server.connections.find('mallory'))
+        self.assertEqual(self.server.connections.active('eve').sock, sock)
+        self.assertEqual(self.server.admission.pending, 0)
+
+
+class TestSubscribe(ServerTestCase):
+    def subscribe(self, sock, names):
+        message = {ACTION: SUBSCRIBE, TIME: time.time(), ACCOUNT_NAME: 'eve', LIST_INFO: names}
+        self.server.feed_client(sock, json.dumps(message).encode())
+        self.settle()
+        return self.response(sock)
+
+    def test_storage_error_keeps_subscription(self):
+        sock = self.connect(50001)
+        self.login(sock, 'eve', 'secret')
+        self.settle()
+        self.server.database.user_login('pete', '127.0.0.1', 50002, b'hash')
+        self.server.database.add_contact('eve', 'pete')
+        self.assertEqual(self.subscribe(sock, ['pete'])[RESPONSE], 202)
+
+        def broken(username):
+            raise RuntimeError('БД недоступна')
+
+        self.server.database.get_contacts = broken
+        self.assertEqual(self.subscribe(sock, ['pete'])[RESPONSE], 500)
+        # Прежняя подписка не затерта пустой
+        self.assertEqual(self.server.presence.known['eve'], {'pete': False})
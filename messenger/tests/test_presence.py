@@ -0,0 +1,49 @@
+import unittest
+from messenger.common.presence import PresenceHub
+
+
+class TestPresenceHub(unittest.TestCase):
+    def setUp(self):
+        self.hub = PresenceHub(window=0, limit=10)
+        self.online = {'Pete'}
+
+    def test_subscribe_snapshot(self):
+        self.assertEqual(self.hub.subscribe('Mary', ['Pete', 'John', 'Mary'], self.online.__contains__), ['Pete'])
+        self.assertEqual(self.hub.stats()['watched'], 2)
+
+    def test_coalesced_delta(self):
+        self.hub.subscribe('Mary', ['Pete', 'John'], self.online.__contains__)
+        self.assertTrue(self.hub.changed('John', True))
+        self.assertFalse(self.hub.changed('Pete', False))
+        self.hub.changed('Nobody', True)
+        self.assertEqual(list(self.hub.due()), [('Mary', ['John'], ['Pete'])])
+        self.assertEqual(list(self.hub.due()), [])
+
+    def test_cancelled_changes(self):
+        self.hub.subscribe('Mary', ['Pete'], self.online.__contains__)
+        self.hub.changed('Pete', False)
+        self.hub.changed('Pete', True)
+        # Вышел и снова вошел за интервал накопления - подписчику нечего сообщать
+        self.assertEqual(list(self.hub.due()), [])
+
+    def test_unsubscribe(self):
+        self.hub.subscribe('Mary', ['Pete'], self.online.__contains__)
+        self.hub.unsubscribe('Mary')
+        self.assertFalse(self.hub.changed('Pete', False))
+        self.assertEqual(self.hub.stats()['subscribers'], 0)
+
+    def test_next_due(self):
+        hub = PresenceHub(window=60, limit=10)
+        self.assertIsNone(hub.next_due())
+        hub.subscribe('Mary', ['Pete'], self.online.__contains__)
+        hub.subscribe('John', ['Pete'], self.online.__contains__)
+        hub.changed('Pete', False)
+        first = hub.next_due()
+        self.assertEqual(first, min(hub.deadlines.values()))
+        # Срок еще не наступил - изменения не отправляются и остаются ближайшими
+        self.assertEqual(list(hub.due()), [])
+        self.assertEqual(hub.next_due(), first)
+
+
+if __name__ == '__main__':
+    unittest.main()
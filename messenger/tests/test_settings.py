@@ -0,0 +1,44 @@
+import os
+import tempfile
+import unittest
+from dataclasses import FrozenInstanceError
+from messenger.common.settings import load_settings
+
+
+class TestSettings(unittest.TestCase):
+    def setUp(self):
+        self.env = tempfile.NamedTemporaryFile('w', suffix='.env', delete=False)
+        self.env.write("DEFAULT_PORT = 8888\nENCODING = 'utf-8'\nFRAMED_MODE = 0\nUNKNOWN = 1\n")
+        self.env.close()
+
+    def tearDown(self):
+        os.unlink(self.env.name)
+        os.environ.pop('MAX_CONNECTIONS', None)
+
+    def test_env_file(self):
+        settings = load_settings(self.env.name)
+        self.assertEqual(settings.default_port, 8888)
+        self.assertEqual(settings.encoding, 'utf-8')
+        self.assertFalse(settings.framed_mode)
+
+    def test_priority(self):
+        os.environ['MAX_CONNECTIONS'] = '50'
+        settings = load_settings(self.env.name, overrides={'default_port': 9999, 'server_engine': None})
+        self.assertEqual(settings.max_connections, 50)
+        self.assertEqual(settings.default_port, 9999)
+        self.assertEqual(settings.server_engine, 'select')
+
+    def test_invalid_login_rate(self):
+        with self.assertRaises(ValueError):
+            load_settings(self.env.name, overrides={'login_rate': 0})
+        with self.assertRaises(ValueError):
+            load_settings(self.env.name, overrides={'login_ip_rate': -1})
+
+    def test_frozen(self):
+        settings = load_settings(self.env.name)
+        with self.assertRaises(FrozenInstanceError):
+            settings.default_port = 1
+
+
+if __name__ == '__main__':
+    unittest.main()
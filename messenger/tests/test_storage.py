@@ -0,0 +1,84 @@
+import unittest
+from messenger.database.storage import UserDirectory, ServerStorage
+
+
+class TestUserDirectory(unittest.TestCase):
+    def test_lookup(self):
+        directory = UserDirectory()
+        directory.add('Mary', 1)
+        self.assertEqual(directory.get_id('Mary'), 1)
+        self.assertEqual(directory.get_name(1), 'Mary')
+        self.assertIsNone(directory.get_id('Pete'))
+        self.assertEqual(directory.stats(), {'size': 1, 'hits': 2, 'misses': 1})
+
+
+class TestOfflineMessages(unittest.TestCase):
+    def setUp(self):
+        self.database = ServerStorage(path=':memory:', offline_limit=2)
+        for name in ('Mary', 'Pete'):
+            self.database.user_login(name, '127.0.0.1', 50000, b'hash')
+
+    def test_store_and_take(self):
+        for number in range(3):
+            self.assertTrue(self.database.store_offline('Pete', {'mess_text': f'text {number}'}))
+        self.assertFalse(self.database.store_offline('Nobody', {'mess_text': 'lost'}))
+        # Самое старое сообщение вытеснено из переполненной очереди
+        self.assertEqual([message for created, message in self.database.take_offline('Pete')],
+                         [{'mess_text': 'text 1'}, {'mess_text': 'text 2'}])
+        self.assertEqual(self.database.take_offline('Pete'), [])
+        stats = self.database.offline_stats()
+        self.assertEqual((stats['stored'], stats['delivered'], stats['dropped']), (3, 2, 1))
+
+    def test_requeue(self):
+        self.database.offline_limit = 10
+        for number in range(3):
+            self.database.store_offline('Pete', {'mess_text': f'text {number}'})
+        entries = self.database.take_offline('Pete')
+        # Пока сообщения выдавались, пришло новое, невыданные возвращаются перед ним
+        self.database.store_offline('Pete', {'mess_text': 'text 3'})
+        self.assertTrue(self.database.requeue_offline('Pete', entries[1:]))
+        again = self.database.take_offline('Pete')
+        self.assertEqual([message['mess_text'] for created, message in again], ['text 1', 'text 2', 'text 3'])
+        # Время сохранения прежнее, срок хранения не продлен
+        self.assertEqual([created for created, message in again[:2]], [created for created, message in entries[1:]])
+        self.assertEqual(self.database.offline_stats()['requeued'], 2)
+
+
+class TestGroups(unittest.TestCase):
+    def test_membership(self):
+        database = ServerStorage(path=':memory:')
+        for name in ('Mary', 'Pete'):
+            database.user_login(name, '127.0.0.1', 50000, b'hash')
+        self.assertTrue(database.create_group('friends', 'Mary'))
+        self.assertFalse(database.create_group('friends', 'Pete'))
+        self.assertTrue(database.join_group('friends', 'Pete'))
+        self.assertFalse(database.join_group('nobody', 'Pete'))
+        self.assertEqual(database.group_members('friends'), {'Mary', 'Pete'})
+        self.assertTrue(database.leave_group('friends', 'Mary'))
+        # Индекс в памяти совпадает с БД
+        self.assertEqual(database.reload_group('friends'), {'Pete'})
+
+
+class TestSync(unittest.TestCase):
+    def setUp(self):
+        self.database = ServerStorage(path=':memory:')
+        for name in ('Mary', 'Pete', 'John'):
+            self.database.user_login(name, '127.0.0.1', 50000, b'hash')
+
+    def test_users_since(self):
+        names, version, full = self.database.users_since(0)
+        self.assertEqual((names, full), (['Mary', 'Pete', 'John'], True))
+        self.database.user_login('Anna', '127.0.0.1', 50000, b'hash')
+        self.assertEqual(self.database.users_since(version), (['Anna'], version + 1, False))
+        # Версия больше известной серверу - полный список
+        self.assertTrue(self.database.users_since(version + 10)[2])
+
+    def test_contacts_since(self):
+        self.database.add_contact('Mary', 'Pete')
+        added, removed, version, full = self.database.contacts_since('Mary', 0)
+        self.assertEqual((added, removed, full), (['Pete'], [], True))
+        self.database.add_contact('Mary', 'John')
+        self.database.remove_contact('Mary', 'Pete')
+        added, removed, new_version, full = self.database.contacts_since('Mary', version)
+        self.assertEqual((added, removed, full), (['John'], ['Pete'], False))
+        self.assertEqual(self.database.contacts_since('Mary', new_version)[:2], ([], []))
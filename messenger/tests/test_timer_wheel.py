@@ -0,0 +1,33 @@
+import unittest
+from messenger.common.timer_wheel import TimerWheel
+
+
+class TestTimerWheel(unittest.TestCase):
+    def setUp(self):
+        self.wheel = TimerWheel(resolution=1.0, slots=4, now=0.0)
+
+    def test_expiry(self):
+        self.wheel.schedule('a', 2)
+        self.wheel.schedule('b', 3)
+        self.assertEqual(self.wheel.advance(1.5), [])
+        self.assertEqual(self.wheel.advance(2.0), ['a'])
+        self.assertEqual(self.wheel.advance(3.0), ['b'])
+        self.assertEqual(len(self.wheel), 0)
+
+    def test_several_rounds(self):
+        # Срок дальше одного оборота колеса
+        self.wheel.schedule('a', 9)
+        self.assertEqual(self.wheel.advance(8.0), [])
+        self.assertEqual(self.wheel.advance(9.0), ['a'])
+
+    def test_reschedule_and_cancel(self):
+        self.wheel.schedule('a', 1)
+        self.wheel.schedule('a', 3)
+        self.wheel.schedule('b', 1)
+        self.wheel.cancel('b')
+        self.assertEqual(self.wheel.advance(2.0), [])
+        self.assertEqual(self.wheel.advance(3.0), ['a'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import os
+import stat
+import tempfile
+import unittest
+from messenger.common.settings import Settings
+from messenger.common.worker_link import WorkerLink, DATAGRAM_LIMIT
+from messenger.common.common_functions import decode_message
+
+
+class TestWorkerLink(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.settings = Settings()
+        self.links = [WorkerLink(worker, 2, 7777, self.settings, self.directory.name)
+                      for worker in range(2)]
+
+    def tearDown(self):
+        for link in self.links:
+            link.close()
+        self.directory.cleanup()
+
+    def test_send_receive(self):
+        message = {'action': 'msg', 'to': 'Mary', 'mess_text': 'x' * 60000}
+        self.assertTrue(self.links[0].send(1, message))
+        self.assertEqual([decode_message(data, self.settings) for data in self.links[1].receive()], [message])
+
+    def test_oversized(self):
+        # Сообщение больше датаграммы не отправляется и не приходит обрезанным
+        self.assertFalse(self.links[0].send(1, {'mess_text': 'x' * DATAGRAM_LIMIT}))
+        self.assertFalse(self.links[0].send(1, {'mess_text': 'x' * 300000}))
+        self.assertEqual(list(self.links[1].receive()), [])
+
+    def test_shared_directory(self):
+        # Каталог, доступный другим пользователям, не принимается
+        os.chmod(self.directory.name, 0o777)
+        with self.assertRaises(PermissionError):
+            WorkerLink(0, 1, 7778, self.settings, self.directory.name)
+
+    def test_make_directory(self):
+        directory = WorkerLink.make_directory()
+        self.assertEqual(stat.S_IMODE(os.stat(directory).st_mode), 0o700)
+        os.rmdir(directory)
+
+    def test_missing_worker(self):
+        self.links[1].close()
+        self.assertFalse(self.links[0].send(1, {'action': 'msg'}))
+
+
+if __name__ == '__main__':
+    unittest.main()